@@ -1,39 +1,579 @@
+# Общее хранилище кешей. Резидентный раннер подставляет один и тот же словарь
+# во все скрипты; при обычном запуске на платформе оно живет в пределах вызова.
+try:
+    CACHE_STORE
+except NameError:
+    CACHE_STORE = {}
+
+# Журнал команды. Сообщения пишутся через log_debug/log_info/log_warning/log_error
+# шаблоном с {} и списком значений: значения подставляются и обрезаются до
+# LOG_PAYLOAD_LIMIT символов, только если уровень сообщения включен, поэтому
+# отключенные отладочные сообщения не форматируют аргументы, поля и ответы Bitrix24.
+# Каждая строка помечается ID вызова, по которому собираются сообщения одной команды.
+# Уровень задается аргументом "log_level" или переменной LOG_LEVEL (ее подставляет
+# резидентный раннер по настройке логгера), по умолчанию "info".
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PAYLOAD_LIMIT = 300
+# Сообщения из циклов (log_sampled) пишутся первый раз и затем каждый LOG_SAMPLE_EVERY-й
+LOG_SAMPLE_EVERY = 100
+
+try:
+    LOG_LEVEL
+except NameError:
+    LOG_LEVEL = "info"
+
+LOG_CONTEXT = {"correlation_id": "-", "level": LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["info"]), "samples": {}}
+
+def start_log_context(command: str, args: dict) -> None:
+    """Начинает журнал вызова: уровень из аргументов и новый ID вызова; вызывается в начале main()."""
+    level = str(args.get("log_level") or LOG_LEVEL).lower()
+    LOG_CONTEXT["level"] = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+    counter = CACHE_STORE.setdefault("log_counter", {"value": 0})
+    counter["value"] += 1
+    correlation_id = args.get("correlation_id") or f"{command}-{datetime.datetime.now().strftime('%H%M%S')}-{counter['value']}"
+    LOG_CONTEXT["correlation_id"] = str(correlation_id)
+    LOG_CONTEXT["samples"] = {}
+
+def log_enabled(level: str) -> bool:
+    """Проверяет, включен ли уровень; нужна, когда значения для сообщения дорого вычислять."""
+    return LOG_LEVELS[level] >= LOG_CONTEXT["level"]
+
+def log_value(value) -> str:
+    """Строка для подстановки в сообщение: словари и списки в JSON, длинные значения обрезаются."""
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > LOG_PAYLOAD_LIMIT:
+        text = text[:LOG_PAYLOAD_LIMIT] + f"... (еще {len(text) - LOG_PAYLOAD_LIMIT} симв.)"
+    return text
+
+def log_message(level: str, message: str, values: list) -> None:
+    """Пишет сообщение уровня level, если он включен."""
+    if LOG_LEVELS[level] < LOG_CONTEXT["level"]:
+        return
+    if values:
+        parts = message.split("{}")
+        message = parts[0]
+        for position in range(1, len(parts)):
+            if position <= len(values):
+                message += log_value(values[position - 1])
+            else:
+                message += "{}"
+            message += parts[position]
+    debug(f"[{LOG_CONTEXT['correlation_id']}] {level.upper()} {message}")
+
+def log_debug(message: str, values: list = None) -> None:
+    log_message("debug", message, values)
+
+def log_info(message: str, values: list = None) -> None:
+    log_message("info", message, values)
+
+def log_warning(message: str, values: list = None) -> None:
+    log_message("warning", message, values)
+
+def log_error(message: str, values: list = None) -> None:
+    log_message("error", message, values)
+
+def log_sampled(key: str, message: str, values: list = None) -> None:
+    """Отладочное сообщение из цикла: пишется первое и каждое LOG_SAMPLE_EVERY-е с одним ключом."""
+    if LOG_LEVELS["debug"] < LOG_CONTEXT["level"]:
+        return
+    samples = LOG_CONTEXT["samples"]
+    count = samples.get(key, 0) + 1
+    samples[key] = count
+    if count == 1 or count % LOG_SAMPLE_EVERY == 0:
+        log_message("debug", message + f" [{key}: {count}]", values)
+
+# Проекции полей: для каждого метода Bitrix24 перечислены только те поля,
+# которые скрипт читает из ответа. b24_post подставляет эти параметры
+# в каждый вызов метода, если они не заданы явно.
+B24_FIELD_PROJECTIONS = {
+    "sonet_group.get": {"SELECT": ["ID", "NAME"]},  # каталог проектов для нечеткого поиска
+    "user.search": {"SELECT": ["ID"]},  # ID исполнителя
+    "user.current": {"SELECT": ["ID"]},  # ID постановщика
+    "tasks.task.add": {"select": ["ID", "CREATED_BY", "TITLE", "STATUS", "GROUP_ID"]},  # ссылка на задачу и запись индекса
+}
+
+def apply_field_projection(method: str, params: dict or None) -> dict or None:
+    """Дополняет параметры вызова проекцией полей метода из B24_FIELD_PROJECTIONS."""
+    projection = B24_FIELD_PROJECTIONS.get(method)
+    if not projection:
+        return params
+    projected = dict(params or {})
+    for option in projection:
+        projected.setdefault(option, projection[option])
+    return projected
+
+# Предохранитель (circuit breaker) для каждого портала Bitrix24.
+# После серии ошибок или медленных ответов портал считается недоступным
+# на CIRCUIT_OPEN_SECONDS, запросы к нему сразу завершаются ошибкой,
+# затем пропускается один пробный запрос.
+B24_TIMEOUT = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW = 20
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_SLOW_SECONDS = 8
+CIRCUIT_OPEN_SECONDS = 30
+
+def get_circuit(portal_url: str) -> dict:
+    """Возвращает состояние предохранителя портала, создавая его при первом обращении."""
+    circuits = CACHE_STORE.setdefault("circuit_breakers", {})
+    circuit = circuits.get(portal_url)
+    if circuit is None:
+        circuit = {"state": "closed", "failures": 0, "outcomes": [], "opened_at": None, "rejected": 0}
+        circuits[portal_url] = circuit
+    return circuit
+
+def circuit_allows_request(portal_url: str) -> bool:
+    """Проверяет, можно ли сейчас отправить запрос на портал."""
+    circuit = get_circuit(portal_url)
+    if circuit["state"] == "closed":
+        return True
+    if circuit["state"] == "open":
+        if datetime.datetime.now() - circuit["opened_at"] >= datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS):
+            log_info("circuit_breaker: пробный запрос к порталу {}", [portal_url])
+            circuit["state"] = "half_open"
+            return True
+        return False
+    # half_open: пробный запрос уже отправлен, остальные ждут его результата
+    return False
+
+def record_circuit_outcome(portal_url: str, is_ok: bool) -> None:
+    """Учитывает результат запроса и при необходимости размыкает или замыкает предохранитель."""
+    circuit = get_circuit(portal_url)
+    outcomes = circuit["outcomes"]
+    outcomes.append(is_ok)
+    if len(outcomes) > CIRCUIT_WINDOW:
+        del outcomes[0]
+
+    if is_ok:
+        circuit["failures"] = 0
+        if circuit["state"] != "closed":
+            log_info("circuit_breaker: портал {} снова доступен.", [portal_url])
+            circuit["state"] = "closed"
+            circuit["outcomes"] = [True]
+        return
+
+    circuit["failures"] += 1
+    error_rate = outcomes.count(False) / len(outcomes)
+    too_many_errors = len(outcomes) >= CIRCUIT_WINDOW // 2 and error_rate >= CIRCUIT_ERROR_RATE
+    if circuit["state"] == "half_open" or circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD or too_many_errors:
+        if circuit["state"] != "open":
+            log_warning("circuit_breaker: портал {} временно отключен (ошибок подряд: {}).", [portal_url, circuit['failures']])
+        circuit["state"] = "open"
+        circuit["opened_at"] = datetime.datetime.now()
+
+# Бюджет времени команды: NextBot ждет ответ скрипта ограниченное время, поэтому
+# вызов main() укладывается в COMMAND_BUDGET_SECONDS. Каждый запрос получает таймаут
+# не больше оставшегося времени, а когда времени не осталось, запрос не отправляется.
+COMMAND_BUDGET_SECONDS = 25
+BUDGET_MIN_TIMEOUT = 0.5
+LATENCY_BUDGET = {"deadline": None}
+
+def start_latency_budget(seconds: float = COMMAND_BUDGET_SECONDS) -> None:
+    """Начинает отсчет бюджета времени команды; вызывается в начале main()."""
+    LATENCY_BUDGET["deadline"] = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+def remaining_budget() -> float or None:
+    """Сколько секунд осталось до конца бюджета команды (None, если бюджет не задан)."""
+    deadline = LATENCY_BUDGET["deadline"]
+    if deadline is None:
+        return None
+    left = deadline - datetime.datetime.now()
+    return left.days * 86400 + left.seconds + left.microseconds / 1000000
+
+def budget_timeout(timeout: float) -> float:
+    """Урезает таймаут запроса до оставшегося бюджета; если бюджет исчерпан, выбрасывает requests.exceptions.Timeout."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining < BUDGET_MIN_TIMEOUT:
+        raise requests.exceptions.Timeout("Бюджет времени команды исчерпан, запрос не отправлен.")
+    return min(timeout, remaining)
+
+def b24_post(webhook_url: str, method: str, params: dict or None = None, timeout: int = B24_TIMEOUT):
+    """
+    Вызывает метод REST API Bitrix24 с таймаутом и через предохранитель портала.
+    Если портал временно отключен, сразу выбрасывает requests.exceptions.ConnectionError.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    # Таймаут считается до проверки предохранителя, чтобы не оставить пробный запрос неотправленным
+    timeout = budget_timeout(timeout)
+    if not circuit_allows_request(portal_url):
+        get_circuit(portal_url)["rejected"] += 1
+        raise requests.exceptions.ConnectionError(f"Портал {portal_url} временно недоступен, запрос {method} не отправлен.")
+
+    params = apply_field_projection(method, params)
+    started_at = datetime.datetime.now()
+    try:
+        response = requests.post(f"{webhook_url}{method}.json", json=params, timeout=timeout)
+    except Exception:
+        record_circuit_outcome(portal_url, False)
+        raise
+    is_slow = datetime.datetime.now() - started_at > datetime.timedelta(seconds=CIRCUIT_SLOW_SECONDS)
+    record_circuit_outcome(portal_url, response.status_code < 500 and not is_slow)
+    return response
+
+# Ключи для нечеткого поиска с учетом ошибок распознавания речи. Для каждого слова
+# строятся основа без падежного окончания в латинской транслитерации и фонетический
+# код, поэтому "маркетинга", "Маркетинг" и "marketing" совпадают по ключу.
+RUSSIAN_ENDINGS = sorted((
+    "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему", "иях", "ях", "ах", "ов", "ев",
+    "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ию", "ия", "ии", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+TRANSLIT_MAP = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+PHONETIC_REPLACEMENTS = (
+    ("shch", "s"), ("sh", "s"), ("zh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("ph", "f"),
+    ("ck", "k"), ("x", "ks"), ("w", "v"), ("q", "k"), ("j", "i"), ("y", "i"),
+    ("b", "p"), ("v", "f"), ("g", "k"), ("d", "t"), ("z", "s"),
+)
+PHONETIC_VOWELS = "aeiou"
+PROJECT_INDEX_TTL_SECONDS = 300
+
+def split_words(text) -> list:
+    """Нормализует текст и разбивает его на слова."""
+    if not isinstance(text, str) or not text:
+        return []
+    return re.sub(r'[^\w\s]', '', text).lower().replace('ё', 'е').split()
+
+def stem_word(word: str) -> str:
+    """Отбрасывает типичное русское окончание, если остается основа не короче трех букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def transliterate_word(word: str) -> str:
+    """Переводит кириллицу в латиницу, латиницу и цифры оставляет как есть."""
+    return ''.join(TRANSLIT_MAP.get(c, c) for c in word)
+
+def phonetic_code(latin_word: str) -> str:
+    """Грубый фонетический код: глухие и звонкие согласные совпадают, гласные после первой буквы отбрасываются."""
+    code = latin_word
+    for replacement in PHONETIC_REPLACEMENTS:
+        code = code.replace(replacement[0], replacement[1])
+    if not code:
+        return ""
+    result_chars = [code[0]]
+    for c in code[1:]:
+        if c not in PHONETIC_VOWELS and c != result_chars[-1]:
+            result_chars.append(c)
+    return ''.join(result_chars)
+
+def word_keys(word: str) -> list:
+    """Ключи слова для индекса: транслитерированная основа и фонетический код (если он не слишком короткий)."""
+    word_keys_cache = CACHE_STORE.setdefault("word_keys", {})
+    keys = word_keys_cache.get(word)
+    if keys is None:
+        latin_stem = transliterate_word(stem_word(word))
+        keys = ["t:" + latin_stem]
+        code = phonetic_code(latin_stem)
+        if len(code) >= 3:
+            keys.append("p:" + code)
+        if len(word_keys_cache) > 50000:
+            word_keys_cache.clear()
+        word_keys_cache[word] = keys
+    return keys
+
+def get_project_index(webhook_url: str) -> dict:
+    """
+    Возвращает каталог проектов портала с индексом ключей слов названий.
+    Каталог кешируется в CACHE_STORE на PROJECT_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    project_indexes = CACHE_STORE.setdefault("project_index", {})
+    index = project_indexes.get(portal_url)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=PROJECT_INDEX_TTL_SECONDS):
+        return index
 
+    response = b24_post(webhook_url, "sonet_group.get", {})
+    response.raise_for_status()
+    projects = response.json().get("result", [])
 
-def get_webhook_from_sheet(sheet_url: str, user_name: str) -> str or None:
+    index = {"names": {}, "position": {}, "keys": {}, "built_at": now}
+    for project in projects:
+        project_name = project.get("NAME")
+        if not isinstance(project_name, str) or not project_name:
+            continue
+        project_id = int(project.get("ID"))
+        index["names"][project_id] = project_name
+        index["position"][project_id] = len(index["position"])
+        for word in set(split_words(project_name)):
+            for key in word_keys(word):
+                index["keys"].setdefault(key, set()).add(project_id)
+    project_indexes[portal_url] = index
+    return index
+
+def match_project_id(index: dict, project_name: str) -> int or None:
     """
-    Получает вебхук пользователя из опубликованной Google Таблицы CSV.
-    Формат таблицы: A - Имя, B - Вебхук.
+    Находит в индексе проект с наибольшим числом совпавших слов запроса.
+    Каждое слово запроса - несколько обращений к словарю ключей, без перебора проектов.
+    При равенстве выигрывает проект, который портал вернул первым.
     """
-    debug(f"-> get_webhook_from_sheet: ищем вебхук для '{user_name}'")
-    try:
-        response = requests.get(sheet_url, timeout=5)
-        response.raise_for_status()
-        csv_data = response.text
-        lines = csv_data.strip().splitlines()
-
-        for line in lines:
-            if not line.strip(): continue
-            parts = line.strip().split(',')
-            if len(parts) >= 2:
-                sheet_user = parts[0].strip()
-                webhook = parts[1].strip()
-                webhook = ''.join(c for c in webhook if c.isprintable())
-                
-                if sheet_user == user_name:
-                    debug(f"<- get_webhook_from_sheet: Вебхук для '{user_name}' найден.")
-                    if not webhook.endswith('/'): webhook += '/'
-                    return webhook
-        
-        debug(f"<- get_webhook_from_sheet: Пользователь '{user_name}' НЕ найден в таблице.")
+    counts = {}
+    for word in dict.fromkeys(split_words(project_name)):
+        matched_ids = set()
+        for key in word_keys(word):
+            matched_ids.update(index["keys"].get(key, ()))
+        for project_id in matched_ids:
+            counts[project_id] = counts.get(project_id, 0) + 1
+
+    best_match_id = None
+    max_common_count = 0
+    for project_id in counts:
+        common_count = counts[project_id]
+        if common_count > max_common_count or (
+                common_count == max_common_count and index["position"][project_id] < index["position"][best_match_id]):
+            max_common_count = common_count
+            best_match_id = project_id
+    return best_match_id
+
+# Индекс названий задач портала для нечеткого поиска: все задачи (кроме
+# удаленных в корзину) с разобранными словами названий, статусом и проектом.
+# Строится потоковым проходом по всем страницам tasks.task.list и живет в CACHE_STORE
+# TASK_INDEX_TTL_SECONDS. Изменения задач не сбрасывают индекс, а исправляют его
+# записи на месте по данным из ответа Bitrix24 (write-through).
+# Запись задачи - компактный кортеж (название, слова, статус, проект): слова
+# названий общие для всех порталов (одна строка на слово), статус и проект -
+# целые числа, остальные поля ответа не хранятся. Поэтому один резидентный
+# процесс держит в памяти индексы нескольких больших порталов.
+TASK_INDEX_TTL_SECONDS = 300
+# Индекс только незавершенных задач (фильтр "!STATUS": 5) кешируется под отдельным ключом
+TASK_INDEX_OPEN_SUFFIX = "|open"
+TASK_TITLE = 0
+TASK_WORDS = 1
+TASK_STATUS = 2
+TASK_GROUP = 3
+INTERNED_WORDS_LIMIT = 200000
+
+def intern_words(words: list) -> tuple:
+    """Кортеж слов, в котором одинаковые слова всех названий - один и тот же объект строки."""
+    interned = CACHE_STORE.setdefault("interned_words", {})
+    if len(interned) > INTERNED_WORDS_LIMIT:
+        interned.clear()
+    return tuple(interned.setdefault(word, word) for word in words)
+
+def put_task_record(index: dict, task: dict) -> None:
+    """Добавляет задачу в индекс или обновляет ее запись полями, которые есть в task."""
+    task_id = int(task.get("id"))
+    record = index["tasks"].get(task_id) or ("", (), 0, 0)
+    title = record[TASK_TITLE]
+    words = record[TASK_WORDS]
+    status = record[TASK_STATUS]
+    group_id = record[TASK_GROUP]
+    if task.get("title") is not None:
+        title = task["title"]
+        words = intern_words(split_words(title))
+    if task.get("status") is not None:
+        status = int(task["status"])
+    if task.get("groupId") is not None:
+        group_id = int(task["groupId"] or 0)
+    # Запись заменяется целиком: читатели индекса видят либо старую, либо новую версию
+    index["tasks"][task_id] = (title, words, status, group_id)
+
+def patch_task_index(webhook_url: str, task: dict or None = None, deleted_task_id: int or None = None) -> None:
+    """
+    Исправляет индекс названий задач после изменения (write-through): task — задача
+    из ответа tasks.task.add/update, deleted_task_id — ID удаленной задачи.
+    Если индекс портала еще не построен, исправлять нечего.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    task_indexes = CACHE_STORE.get("task_index", {})
+    # Полный индекс и индекс незавершенных задач исправляются одинаково
+    for index_key in (portal_url, portal_url + TASK_INDEX_OPEN_SUFFIX):
+        index = task_indexes.get(index_key)
+        if not index:
+            continue
+        if deleted_task_id is not None:
+            index["tasks"].pop(int(deleted_task_id), None)
+            log_debug("patch_task_index: задача {} удалена из индекса {}.", [deleted_task_id, index_key])
+        if task and task.get("id"):
+            put_task_record(index, task)
+            if index_key != portal_url and index["tasks"][int(task["id"])][TASK_STATUS] == 5:
+                # Завершенная задача уходит из индекса незавершенных
+                index["tasks"].pop(int(task["id"]))
+            log_debug("patch_task_index: задача {} обновлена в индексе {}.", [task.get('id'), index_key])
+
+# Контекст диалога: недавно созданные и измененные задачи и проекты пользователя
+# (CACHE_STORE["session_context"]). Уточняющие команды вроде «поставь ей высокий
+# приоритет» или «перенеси эту задачу на завтра» находят задачу по нему, без
+# загрузки списка задач портала.
+SESSION_CONTEXT_TTL_SECONDS = 1800
+SESSION_CONTEXT_SIZE = 5
+# Указательные слова и местоимения: только они делают фразу ссылкой на предмет разговора
+CONTEXT_REFERENCE_WORDS = {
+    "эта", "эту", "этой", "этот", "этого", "этом", "это", "та", "ту", "той", "тот", "том", "то",
+    "она", "ее", "ей", "нее", "ней", "он", "его", "ему", "него", "нему", "туда", "там",
+}
+# Слова, допустимые рядом с указательным («эту задачу», «тот же проект»), но не ссылка сами по себе
+CONTEXT_REFERENCE_COMPANIONS = {
+    "же", "задача", "задачу", "задаче", "задачей", "задачи", "проект", "проекта", "проекте", "проекту", "проектом",
+}
+
+def get_session_context(webhook_url: str, user_name: str) -> dict:
+    """Возвращает контекст диалога пользователя на портале {"tasks": [...], "projects": [...]}."""
+    context_key = f"{webhook_url.split('/rest/')[0]}|{user_name}"
+    return CACHE_STORE.setdefault("session_context", {}).setdefault(context_key, {"tasks": [], "projects": []})
+
+def push_context_entry(entries: list, entry: dict) -> list:
+    """
+    Ставит запись первой, дополняя ее пустые поля из прежней записи с тем же ID.
+    Возвращает новый список не длиннее SESSION_CONTEXT_SIZE: контекст могут читать параллельные команды.
+    """
+    for item in entries:
+        if item["id"] == entry["id"]:
+            for field in item:
+                if not entry.get(field):
+                    entry[field] = item[field]
+    entry["touched_at"] = datetime.datetime.now()
+    return ([entry] + [item for item in entries if item["id"] != entry["id"]])[:SESSION_CONTEXT_SIZE]
+
+def remember_project(webhook_url: str, user_name: str, project_id: int, project_name: str or None = None) -> None:
+    """Запоминает проект как последний упомянутый в диалоге."""
+    context = get_session_context(webhook_url, user_name)
+    context["projects"] = push_context_entry(context["projects"], {"id": int(project_id), "name": project_name or ""})
+
+def remember_task(webhook_url: str, user_name: str, task_id: int, title: str or None = None, project_id: int or None = None) -> None:
+    """Запоминает созданную или измененную задачу (и ее проект) как последнюю в диалоге."""
+    if project_id is not None and str(project_id) in ("", "0"):
+        project_id = None
+    context = get_session_context(webhook_url, user_name)
+    entry = {"id": int(task_id), "title": title or "", "project_id": int(project_id) if project_id else None}
+    context["tasks"] = push_context_entry(context["tasks"], entry)
+    if project_id:
+        remember_project(webhook_url, user_name, project_id)
+
+def forget_task(webhook_url: str, user_name: str, task_id: int) -> None:
+    """Убирает удаленную задачу из контекста диалога."""
+    context = get_session_context(webhook_url, user_name)
+    context["tasks"] = [item for item in context["tasks"] if item["id"] != int(task_id)]
+
+def recent_context_entries(entries: list) -> list:
+    """Записи контекста моложе SESSION_CONTEXT_TTL_SECONDS, последние первыми."""
+    now = datetime.datetime.now()
+    return [item for item in entries if now - item["touched_at"] < datetime.timedelta(seconds=SESSION_CONTEXT_TTL_SECONDS)]
+
+def is_context_reference(text: str) -> bool:
+    """Проверяет, что текст только указывает на предмет разговора («её», «эту задачу», «тот же проект»)."""
+    words = split_words(text)
+    if not any(word in CONTEXT_REFERENCE_WORDS for word in words):
+        return False
+    return all(word in CONTEXT_REFERENCE_WORDS or word in CONTEXT_REFERENCE_COMPANIONS for word in words)
+
+def resolve_project_from_context(webhook_url: str, user_name: str, project_name: str) -> int or None:
+    """
+    Возвращает ID последнего проекта диалога, если project_name только указывает на него
+    («тот же проект», «туда») и на портале нет проекта с буквально таким названием.
+    """
+    if not is_context_reference(project_name):
         return None
+    try:
+        index = get_project_index(webhook_url)
+        words = split_words(project_name)
+        if any(split_words(name) == words for name in index["names"].values()):
+            # Настоящее название проекта важнее контекста, его найдет обычный поиск
+            return None
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+        log_warning("resolve_project_from_context: каталог проектов недоступен: {}", [e])
+    projects = recent_context_entries(get_session_context(webhook_url, user_name)["projects"])
+    return projects[0]["id"] if projects else None
+
+# Хранилище учетных данных: вебхуки ищутся в локальном индексе
+# CACHE_STORE["credentials"] ({имя: [вебхуки порталов]}). Резидентный раннер
+# заполняет его из своего хранилища (SQLite, JSON, окружение) и тогда таблица
+# не читается вовсе; иначе индекс импортируется из Google Таблицы, не чаще
+# раза в WEBHOOK_SHEET_SYNC_SECONDS.
+WEBHOOK_SHEET_SYNC_SECONDS = 300
+
+def normalize_webhook(webhook: str) -> str:
+    """Убирает непечатаемые символы и добавляет завершающий '/'."""
+    webhook = ''.join(c for c in webhook.strip() if c.isprintable())
+    if not webhook.endswith('/'): webhook += '/'
+    return webhook
+
+def parse_webhook_sheet(csv_data: str) -> dict:
+    """
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в словарь {имя: [вебхуки]}.
+    У пользователя, работающего на нескольких порталах, несколько строк;
+    первая строка задает основной портал.
+    """
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        if not line.strip(): continue
+        parts = line.strip().split(',')
+        if len(parts) >= 2:
+            sheet_user = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if sheet_user and webhook != '/':
+                user_webhooks = webhooks.setdefault(sheet_user, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+def get_credential_index() -> dict:
+    """Возвращает индекс учетных данных, создавая пустой индекс с импортом из таблицы."""
+    credentials = CACHE_STORE.get("credentials")
+    if credentials is None:
+        credentials = {"source": "sheet", "webhooks": {}, "synced_at": None}
+        CACHE_STORE["credentials"] = credentials
+    return credentials
+
+def sync_webhooks_from_sheet(sheet_url: str, credentials: dict) -> None:
+    """Загружает опубликованную Google Таблицу CSV и заменяет ею индекс вебхуков."""
+    response = requests.get(sheet_url, timeout=budget_timeout(5))
+    response.raise_for_status()
+    credentials["webhooks"] = parse_webhook_sheet(response.text)
+    credentials["synced_at"] = datetime.datetime.now()
+
+def find_user_webhooks(sheet_url: str, user_name: str) -> list:
+    """
+    Возвращает все вебхуки пользователя (основной первым) из хранилища учетных данных.
+    Google Таблица служит только источником для импорта: она читается,
+    если индекс пуст или пользователь не найден, а с прошлой загрузки
+    прошло больше WEBHOOK_SHEET_SYNC_SECONDS.
+    """
+    credentials = get_credential_index()
+    user_webhooks = credentials["webhooks"].get(user_name)
+    if user_webhooks:
+        log_debug("<- find_user_webhooks: Вебхуки для '{}' найдены в индексе ({}).", [user_name, credentials['source']])
+        return user_webhooks
+    if credentials["source"] != "sheet":
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден в хранилище {}.", [user_name, credentials['source']])
+        return []
+
+    synced_at = credentials["synced_at"]
+    if synced_at is not None and datetime.datetime.now() - synced_at < datetime.timedelta(seconds=WEBHOOK_SHEET_SYNC_SECONDS):
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден, таблица загружена недавно.", [user_name])
+        return []
+    try:
+        sync_webhooks_from_sheet(sheet_url, credentials)
     except Exception as e:
-        debug(f"<- get_webhook_from_sheet: Ошибка при доступе к Google Sheets: {e}")
-        return None
+        log_error("<- find_user_webhooks: Ошибка при доступе к Google Sheets: {}", [e])
+        return []
+
+    user_webhooks = credentials["webhooks"].get(user_name) or []
+    log_debug("<- find_user_webhooks: Для '{}' в таблице найдено вебхуков: {}.", [user_name, len(user_webhooks)])
+    return user_webhooks
+
+def get_webhook_from_sheet(sheet_url: str, user_name: str) -> str or None:
+    """Получает основной вебхук пользователя (см. find_user_webhooks)."""
+    log_debug("-> get_webhook_from_sheet: ищем вебхук для '{}'", [user_name])
+    user_webhooks = find_user_webhooks(sheet_url, user_name)
+    if user_webhooks:
+        return user_webhooks[0]
+    return None
 
 def parse_deadline(deadline_str: str) -> str or None:
     """Преобразует текстовое описание срока в формат Bitrix24."""
-    debug(f"-> parse_deadline: '{deadline_str}'")
+    log_debug("-> parse_deadline: '{}'", [deadline_str])
     deadline_str = deadline_str.lower().strip()
     now = datetime.datetime.now()
     deadline_dt = None
@@ -71,7 +611,7 @@ def parse_deadline(deadline_str: str) -> str or None:
                     minute = int(time_parts[1])
             deadline_dt = datetime.datetime(year, month, day, hour, minute)
         except (ValueError, IndexError):
-            debug(f"Не удалось преобразовать '{deadline_str}' в дату и время.")
+            log_debug("Не удалось преобразовать '{}' в дату и время.", [deadline_str])
             deadline_dt = None
 
     if deadline_dt:
@@ -82,98 +622,66 @@ def parse_deadline(deadline_str: str) -> str or None:
         mi = deadline_dt.minute
         s = deadline_dt.second
         result_dt = f"{y:04d}-{m:02d}-{d:02d}T{h:02d}:{mi:02d}:{s:02d}"
-        debug(f"<- parse_deadline: возвращает '{result_dt}'")
+        log_debug("<- parse_deadline: возвращает '{}'", [result_dt])
         return result_dt
 
-    debug(f"<- parse_deadline: не удалось распознать срок, возвращает None")
+    log_debug("<- parse_deadline: не удалось распознать срок, возвращает None")
     return None
 
 def find_project_id_by_name(webhook_url: str, project_name: str) -> int or None:
-    """Ищет ID проекта (рабочей группы) в Bitrix24 по наиболее похожему названию (метод 'мешка слов')."""
-    debug(f"-> find_project_id_by_name (fuzzy): '{project_name}'")
-    url = f"{webhook_url}sonet_group.get.json"
-    # Получаем все проекты
-    params = {} 
-
+    """
+    Ищет ID проекта (рабочей группы) в Bitrix24 по наиболее похожему названию (метод 'мешка слов').
+    Слова сравниваются по ключам основы, транслитерации и звучания, поэтому поиск
+    переживает падежные окончания и ошибки распознавания речи.
+    """
+    log_debug("-> find_project_id_by_name (fuzzy): '{}'", [project_name])
     try:
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        projects = response.json().get("result", [])
-
-        if not projects:
-            debug("<- find_project_id_by_name (fuzzy): Список проектов пуст.")
-            return None
-            
-        # Нормализация и разбиение на слова поискового запроса
-        if not isinstance(project_name, str) or not project_name:
-            search_words = set()
-        else:
-            cleaned_project_name = re.sub(r'[^\w\s]', '', project_name).lower()
-            search_words = set(cleaned_project_name.split())
-        
-        if not search_words:
-            debug("<- find_project_id_by_name (fuzzy): Название проекта пустое после нормализации.")
-            return None
+        index = get_project_index(webhook_url)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log_error("<- find_project_id_by_name (fuzzy): ОШИБКА API: {}", [e])
+        return None
 
-        best_match_id = None
-        max_common_count = 0
+    if not index["names"]:
+        log_debug("<- find_project_id_by_name (fuzzy): Список проектов пуст.")
+        return None
 
-        for project in projects:
-            current_project_name = project.get("NAME")
+    if not split_words(project_name):
+        log_debug("<- find_project_id_by_name (fuzzy): Название проекта пустое после нормализации.")
+        return None
 
-            # Нормализация и разбиение на слова названия проекта
-            if not isinstance(current_project_name, str) or not current_project_name:
-                project_words = set()
-            else:
-                cleaned_current_project_name = re.sub(r'[^\w\s]', '', current_project_name).lower()
-                project_words = set(cleaned_current_project_name.split())
-            
-            common_count = len(search_words.intersection(project_words))
-            
-            if common_count > max_common_count:
-                max_common_count = common_count
-                best_match_id = int(project.get("ID"))
-                debug(f"Новый лучший кандидат на проект: ID {best_match_id} ('{current_project_name}') с {common_count} совпадениями.")
-
-        # Считаем совпадение успешным, если нашлось хотя бы одно общее слово
-        if best_match_id and max_common_count > 0:
-            debug(f"<- find_project_id_by_name (fuzzy): Найден наиболее похожий проект ID: {best_match_id}")
-            return best_match_id
-        else:
-            debug(f"<- find_project_id_by_name (fuzzy): Не найдено достаточно похожего проекта для '{project_name}'.")
-            return None
+    best_match_id = match_project_id(index, project_name)
+    if best_match_id:
+        log_debug("<- find_project_id_by_name (fuzzy): Найден наиболее похожий проект ID: {} ('{}')", [best_match_id, index['names'][best_match_id]])
+        return best_match_id
 
-    except requests.exceptions.RequestException as e:
-        debug(f"<- find_project_id_by_name (fuzzy): ОШИБКА API: {e}")
+    log_debug("<- find_project_id_by_name (fuzzy): Не найдено достаточно похожего проекта для '{}'.", [project_name])
     return None
 
 def find_user_id_by_name(webhook_url: str, user_name: str) -> int or None:
     """Ищет ID пользователя в Bitrix24 по имени, фамилии или частичному совпадению."""
-    debug(f"-> find_user_id_by_name: '{user_name}'")
-    url = f"{webhook_url}user.search.json"
+    log_debug("-> find_user_id_by_name: '{}'", [user_name])
     params = {"FILTER": {"FIND": user_name}}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook_url, "user.search", params)
         response.raise_for_status()
         result_json = response.json()
         if result_json.get("result") and len(result_json["result"]) > 0:
             user_id = result_json["result"][0].get("ID")
-            debug(f"<- find_user_id_by_name: пользователь найден, ID: {user_id}")
+            log_debug("<- find_user_id_by_name: пользователь найден, ID: {}", [user_id])
             return user_id
         else:
-            debug(f"<- find_user_id_by_name: пользователь '{user_name}' не найден.")
+            log_debug("<- find_user_id_by_name: пользователь '{}' не найден.", [user_name])
             return None
     except requests.exceptions.RequestException as e:
-        debug(f"<- find_user_id_by_name: ОШИБКА API: {e}")
+        log_error("<- find_user_id_by_name: ОШИБКА API: {}", [e])
     return None
 
 def create_b24_task(webhook_url: str, fields: dict) -> (int or None, str or None):
     """Создает задачу в Bitrix24 и возвращает ее ID и ссылку."""
-    debug(f"-> create_b24_task: с полями {fields}")
-    url = f"{webhook_url}tasks.task.add.json"
+    log_debug("-> create_b24_task: с полями {}", [fields])
     params = {"fields": fields}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook_url, "tasks.task.add", params)
         response.raise_for_status()
         result_json = response.json()
         if "result" in result_json and "task" in result_json["result"]:
@@ -183,39 +691,228 @@ def create_b24_task(webhook_url: str, fields: dict) -> (int or None, str or None
                 portal_url = webhook_url.split('/rest/')[0]
                 creator_id = task.get("createdBy")
                 task_link = f"{portal_url}/company/personal/user/{creator_id}/tasks/task/view/{task_id}/"
-                debug(f"<- create_b24_task: задача создана, ID: {task_id}, ссылка: {task_link}")
+                log_info("<- create_b24_task: задача создана, ID: {}, ссылка: {}", [task_id, task_link])
+                patch_task_index(webhook_url, task)
                 return task_id, task_link
     except requests.exceptions.RequestException as e:
-        debug(f"<- create_b24_task: ОШИБКА API: {e}")
-        debug(f"Ответ от сервера: {response.text}")
+        log_error("<- create_b24_task: ОШИБКА API: {}", [e])
+        if 'response' in locals() and hasattr(response, 'text'):
+            log_error("Ответ от сервера: {}", [response.text])
     
-    debug("<- create_b24_task: не удалось создать задачу, возвращает None, None")
+    log_debug("<- create_b24_task: не удалось создать задачу, возвращает None, None")
     return None, None
 
+# Чек-лист и подзадачи создаются вместе с задачей одним вызовом batch:
+# команды ссылаются на ID новой задачи через $result[task][task][id].
+# Метод batch Bitrix24 выполняет не больше 50 команд за вызов
+BATCH_MAX_COMMANDS = 50
+URL_SAFE_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~$[]"
+
+def url_quote(value) -> str:
+    """Кодирует значение для строки запроса команды batch (UTF-8, percent-encoding)."""
+    encoded = []
+    for c in str(value):
+        if c in URL_SAFE_CHARS:
+            encoded.append(c)
+        else:
+            for byte in c.encode("utf-8"):
+                encoded.append(f"%{byte:02X}")
+    return "".join(encoded)
+
+def flatten_query_params(prefix: str, value, pairs: list) -> None:
+    """Разворачивает вложенные параметры в пары вида fields[TITLE]=... для batch."""
+    if isinstance(value, dict):
+        for key in value:
+            flatten_query_params(f"{prefix}[{key}]" if prefix else str(key), value[key], pairs)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            item = value[index]
+            flatten_query_params(f"{prefix}[{index}]", item, pairs)
+    else:
+        pairs.append(f"{url_quote(prefix)}={url_quote(value)}")
+
+def build_batch_command(method: str, params: dict) -> str:
+    """Строка команды batch "метод?параметры" с проекцией полей метода."""
+    pairs = []
+    flatten_query_params("", apply_field_projection(method, params) or {}, pairs)
+    return f"{method}?{'&'.join(pairs)}"
+
+def call_batch(webhook_url: str, commands: list, halt: int = 0) -> dict:
+    """
+    Выполняет список команд [{"key", "method", "params"}] одним вызовом batch.
+    Команды выполняются по порядку и могут ссылаться на результаты предыдущих
+    через $result[ключ][...]. С halt=1 пакет останавливается на первой ошибке:
+    команды после нее не выполняются и не попадают ни в результаты, ни в ошибки.
+    Возвращает словари результатов и ошибок по ключам.
+    """
+    log_debug("-> call_batch: команд: {}", [len(commands)])
+    cmd = {}
+    for command in commands:
+        cmd[command["key"]] = build_batch_command(command["method"], command["params"])
+    response = b24_post(webhook_url, "batch", {"halt": halt, "cmd": cmd}, timeout=30)
+    response.raise_for_status()
+    result_json = response.json()
+    if "error" in result_json:
+        raise ValueError(result_json.get("error_description") or result_json["error"])
+    batch_result = result_json.get("result", {})
+    results = batch_result.get("result") or {}
+    errors = batch_result.get("result_error") or {}
+    # Пустые результаты Bitrix24 отдает списком, а не словарем
+    if isinstance(results, list):
+        results = {}
+    if isinstance(errors, list):
+        errors = {}
+    log_debug("<- call_batch: успешно: {}, ошибок: {}", [len(results), len(errors)])
+    return {"results": results, "errors": errors}
+
+def normalize_items(raw_items) -> list:
+    """
+    Приводит пункты чек-листа или подзадачи из args к списку {"title", "deadline"}.
+    NextBot может передать список строк или словарей, JSON-строку или одну строку
+    с пунктами через запятую, точку с запятой или перевод строки.
+    """
+    if isinstance(raw_items, str):
+        text = raw_items.strip()
+        if text.startswith("["):
+            try:
+                raw_items = json.loads(text)
+            except ValueError:
+                raw_items = re.split(r"[,;\n]", text.strip("[]"))
+        else:
+            raw_items = re.split(r"[,;\n]", text)
+    if not isinstance(raw_items, list):
+        return []
+    items = []
+    for raw in raw_items:
+        if isinstance(raw, dict):
+            title = str(raw.get("title") or "").strip()
+            deadline = raw.get("deadline")
+        else:
+            title = str(raw or "").strip()
+            deadline = None
+        if title:
+            items.append({"title": title, "deadline": deadline})
+    return items
+
+def create_b24_task_with_items(webhook_url: str, fields: dict, checklist: list, subtasks: list) -> dict or None:
+    """
+    Создает задачу, пункты ее чек-листа (task.checklistitem.add) и подзадачи
+    (tasks.task.add с PARENT_ID) одним вызовом batch.
+    Подзадачи наследуют ответственного, проект и приоритет задачи. Пакет
+    останавливается на первой ошибке (halt=1): если задача не создана, пункты и
+    подзадачи не создаются отдельно от нее. Команды, пропущенные из-за ошибки
+    другого пункта, повторяются вторым пакетом с известным ID задачи.
+    Возвращает {"task_id", "task_link", "checklist", "subtasks", "warnings"} или None, если задача не создана.
+    """
+    log_debug("-> create_b24_task_with_items: пунктов чек-листа: {}, подзадач: {}", [len(checklist), len(subtasks)])
+    parent_ref = "$result[task][task][id]"
+    commands = [{"key": "task", "method": "tasks.task.add", "params": {"fields": fields}}]
+    for index in range(len(checklist)):
+        item = checklist[index]
+        commands.append({"key": f"check_{index}", "method": "task.checklistitem.add",
+                         "params": {"TASKID": parent_ref, "FIELDS": {"TITLE": item["title"]}}})
+    warnings = []
+    for index in range(len(subtasks)):
+        item = subtasks[index]
+        subtask_fields = {"TITLE": item["title"], "PARENT_ID": parent_ref}
+        for field in ("RESPONSIBLE_ID", "GROUP_ID", "PRIORITY"):
+            if field in fields:
+                subtask_fields[field] = fields[field]
+        if item["deadline"]:
+            deadline = parse_deadline(str(item["deadline"]))
+            if deadline:
+                subtask_fields["DEADLINE"] = deadline
+            else:
+                warnings.append(f"срок подзадачи '{item['title']}' не распознан")
+        commands.append({"key": f"subtask_{index}", "method": "tasks.task.add", "params": {"fields": subtask_fields}})
+
+    try:
+        batch = call_batch(webhook_url, commands, halt=1)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log_error("<- create_b24_task_with_items: ОШИБКА API: {}", [e])
+        return None
+
+    task = (batch["results"].get("task") or {}).get("task") or {}
+    task_id = task.get("id")
+    if not task_id:
+        error = batch["errors"].get("task") or {}
+        log_warning("<- create_b24_task_with_items: задача не создана: {}", [error.get('error_description')])
+        return None
+    patch_task_index(webhook_url, task)
+    portal_url = webhook_url.split('/rest/')[0]
+    task_link = f"{portal_url}/company/personal/user/{task.get('createdBy')}/tasks/task/view/{task_id}/"
+
+    # Пакет остановился на ошибке пункта или подзадачи: оставшиеся команды отправляем
+    # отдельно, уже с ID созданной задачи
+    skipped = [command for command in commands[1:]
+               if command["key"] not in batch["results"] and command["key"] not in batch["errors"]]
+    if skipped:
+        for command in skipped:
+            if command["method"] == "task.checklistitem.add":
+                command["params"]["TASKID"] = task_id
+            else:
+                command["params"]["fields"]["PARENT_ID"] = task_id
+        try:
+            retry = call_batch(webhook_url, skipped)
+            batch["results"].update(retry["results"])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error("create_b24_task_with_items: пропущенные команды не выполнены: {}", [e])
+
+    checklist_count = 0
+    for index in range(len(checklist)):
+        item = checklist[index]
+        if f"check_{index}" in batch["results"]:
+            checklist_count += 1
+        else:
+            warnings.append(f"пункт чек-листа '{item['title']}' не добавлен")
+    subtask_ids = []
+    for index in range(len(subtasks)):
+        item = subtasks[index]
+        subtask = (batch["results"].get(f"subtask_{index}") or {}).get("task") or {}
+        if subtask.get("id"):
+            subtask_ids.append(int(subtask["id"]))
+            patch_task_index(webhook_url, subtask)
+        else:
+            warnings.append(f"подзадача '{item['title']}' не создана")
+    log_info("<- create_b24_task_with_items: задача {}, пунктов: {}, подзадач: {}", [task_id, checklist_count, subtask_ids])
+    return {"task_id": task_id, "task_link": task_link, "checklist": checklist_count,
+            "subtasks": subtask_ids, "warnings": warnings}
+
 def get_current_user_id(webhook_url: str) -> int or None:
     """Получает ID пользователя, которому принадлежит вебхук."""
-    debug("-> get_current_user_id: запрашиваем данные текущего пользователя")
-    url = f"{webhook_url}user.current.json"
+    log_debug("-> get_current_user_id: запрашиваем данные текущего пользователя")
     try:
-        response = requests.post(url, timeout=5)
+        response = b24_post(webhook_url, "user.current", timeout=5)
         response.raise_for_status()
         result = response.json().get("result", {})
         user_id = result.get("ID")
         if user_id:
-            debug(f"<- get_current_user_id: ID текущего пользователя: {user_id}")
+            log_debug("<- get_current_user_id: ID текущего пользователя: {}", [user_id])
             return int(user_id)
         else:
-            debug("<- get_current_user_id: Не удалось получить ID из ответа.")
+            log_debug("<- get_current_user_id: Не удалось получить ID из ответа.")
             return None
     except Exception as e:
-        debug(f"<- get_current_user_id: Ошибка при получении данных пользователя: {e}")
+        log_error("<- get_current_user_id: Ошибка при получении данных пользователя: {}", [e])
         return None
 
+def invalidate_task_listings(webhook_url: str) -> None:
+    """Сбрасывает кеш списков задач и дайджесты show_task для портала после изменения задач."""
+    portal_url = webhook_url.split('/rest/')[0]
+    CACHE_STORE.get("show_task", {}).pop(portal_url, None)
+    CACHE_STORE.get("show_task_digests", {}).pop(portal_url, None)
+    # Новое поколение не дает фоновым обновлениям, начатым до сброса, записать старый ответ
+    generations = CACHE_STORE.setdefault("show_task_generation", {})
+    generations[portal_url] = generations.get(portal_url, 0) + 1
+    log_debug("invalidate_task_listings: кеш списков задач портала {} сброшен.", [portal_url])
+
 # --- Основная функция, которую вызывает платформа ---
 
 def main(args: dict) -> dict:
-    debug("--- Запуск функции add_new_task ---")
-    debug(f"Получены аргументы от NextBot: {args}")
+    start_log_context("add_new_task", args)
+    start_latency_budget()
+    log_info("--- Запуск функции add_new_task ---")
+    log_debug("Получены аргументы от NextBot: {}", [args])
 
     GSHEET_URL = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv"
     user_name = args.get("nameUser")
@@ -237,9 +934,19 @@ def main(args: dict) -> dict:
     if not task_title:
         return {"result": "error", "message": "Необходимо указать название задачи."}
 
+    # Пункты чек-листа и подзадачи: "собрать данные, сделать слайды, согласовать"
+    checklist = normalize_items(args.get("checklist"))
+    subtasks = normalize_items(args.get("subtasks"))
+    if 1 + len(checklist) + len(subtasks) > BATCH_MAX_COMMANDS:
+        msg = f"За одну команду можно добавить не больше {BATCH_MAX_COMMANDS - 1} пунктов чек-листа и подзадач."
+        return {"result": "error", "message": msg}
+
     project_id = None
     if project_name:
-        project_id = find_project_id_by_name(webhook_url, project_name)
+        # «В тот же проект» - последний проект из контекста диалога
+        project_id = resolve_project_from_context(webhook_url, user_name, project_name)
+        if not project_id:
+            project_id = find_project_id_by_name(webhook_url, project_name)
         if not project_id:
             msg = f"Проект, похожий на '{project_name}', не найден. Задача не была создана."
             return {"result": "error", "message": msg}
@@ -249,16 +956,16 @@ def main(args: dict) -> dict:
         responsible_id = find_user_id_by_name(webhook_url, responsible_name)
         if not responsible_id:
             return {"result": "error", "message": f"Пользователь '{responsible_name}' не найден. Проверьте имя."}
-        debug(f"Ответственный найден по имени. ID: {responsible_id}")
+        log_debug("Ответственный найден по имени. ID: {}", [responsible_id])
     else:
         # Ответственный не указан, используем владельца вебхука
         responsible_id = get_current_user_id(webhook_url)
         if not responsible_id:
             # В качестве запасного варианта, если API не ответил, ставим администратора (ID=1)
             responsible_id = 1
-            debug("Не удалось определить владельца вебхука, используется ID по умолчанию: 1")
+            log_warning("Не удалось определить владельца вебхука, используется ID по умолчанию: 1")
         else:
-            debug(f"Ответственный не указан. Используется владелец вебхука. ID: {responsible_id}")
+            log_debug("Ответственный не указан. Используется владелец вебхука. ID: {}", [responsible_id])
 
     deadline = None
     if deadline_str:
@@ -276,11 +983,31 @@ def main(args: dict) -> dict:
     priority_map = {"высокий": "2", "средний": "1", "низкий": "0", "2": "2", "1": "1", "0": "0"}
     fields["PRIORITY"] = priority_map.get(str(priority_arg).lower().strip(), "1")
 
+    if checklist or subtasks:
+        # Задача, чек-лист и подзадачи - одним вызовом batch
+        created = create_b24_task_with_items(webhook_url, fields, checklist, subtasks)
+        if not created:
+            return {"result": "error", "message": "Произошла ошибка при создании задачи в Bitrix24."}
+        invalidate_task_listings(webhook_url)
+        remember_task(webhook_url, user_name, created["task_id"], task_title, project_id)
+        success_message = f"✅ Задача «{task_title}» успешно создана!"
+        if checklist:
+            success_message += f"\\n☑️ Пунктов чек-листа: {created['checklist']} из {len(checklist)}"
+        if subtasks:
+            success_message += f"\\n📎 Подзадач: {len(created['subtasks'])} из {len(subtasks)}"
+        success_message += f"\\n\\n🔗 Ссылка: {created['task_link']}"
+        answer = {"result": "success", "message": success_message, "subtask_ids": created["subtasks"]}
+        if created["warnings"]:
+            answer["warnings"] = created["warnings"]
+        return answer
+
     task_result = create_b24_task(webhook_url, fields)
     task_id = task_result[0]
     task_link = task_result[1]
     
     if task_id and task_link:
+        invalidate_task_listings(webhook_url)
+        remember_task(webhook_url, user_name, task_id, task_title, project_id)
         success_message = f"✅ Задача «{task_title}» успешно создана!\\n\\n🔗 Ссылка: {task_link}"
         return {"result": "success", "message": success_message}
     else:
@@ -0,0 +1,1299 @@
+# Общее хранилище кешей. Резидентный раннер подставляет один и тот же словарь
+# во все скрипты; при обычном запуске на платформе оно живет в пределах вызова.
+try:
+    CACHE_STORE
+except NameError:
+    CACHE_STORE = {}
+
+# Журнал команды. Сообщения пишутся через log_debug/log_info/log_warning/log_error
+# шаблоном с {} и списком значений: значения подставляются и обрезаются до
+# LOG_PAYLOAD_LIMIT символов, только если уровень сообщения включен, поэтому
+# отключенные отладочные сообщения не форматируют аргументы, поля и ответы Bitrix24.
+# Каждая строка помечается ID вызова, по которому собираются сообщения одной команды.
+# Уровень задается аргументом "log_level" или переменной LOG_LEVEL (ее подставляет
+# резидентный раннер по настройке логгера), по умолчанию "info".
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PAYLOAD_LIMIT = 300
+# Сообщения из циклов (log_sampled) пишутся первый раз и затем каждый LOG_SAMPLE_EVERY-й
+LOG_SAMPLE_EVERY = 100
+
+try:
+    LOG_LEVEL
+except NameError:
+    LOG_LEVEL = "info"
+
+LOG_CONTEXT = {"correlation_id": "-", "level": LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["info"]), "samples": {}}
+
+def start_log_context(command, args):
+    """Начинает журнал вызова: уровень из аргументов и новый ID вызова; вызывается в начале main()."""
+    level = str(args.get("log_level") or LOG_LEVEL).lower()
+    LOG_CONTEXT["level"] = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+    counter = CACHE_STORE.setdefault("log_counter", {"value": 0})
+    counter["value"] += 1
+    correlation_id = args.get("correlation_id") or f"{command}-{datetime.datetime.now().strftime('%H%M%S')}-{counter['value']}"
+    LOG_CONTEXT["correlation_id"] = str(correlation_id)
+    LOG_CONTEXT["samples"] = {}
+
+def log_enabled(level):
+    """Проверяет, включен ли уровень; нужна, когда значения для сообщения дорого вычислять."""
+    return LOG_LEVELS[level] >= LOG_CONTEXT["level"]
+
+def log_value(value):
+    """Строка для подстановки в сообщение: словари и списки в JSON, длинные значения обрезаются."""
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > LOG_PAYLOAD_LIMIT:
+        text = text[:LOG_PAYLOAD_LIMIT] + f"... (еще {len(text) - LOG_PAYLOAD_LIMIT} симв.)"
+    return text
+
+def log_message(level, message, values):
+    """Пишет сообщение уровня level, если он включен."""
+    if LOG_LEVELS[level] < LOG_CONTEXT["level"]:
+        return
+    if values:
+        parts = message.split("{}")
+        message = parts[0]
+        for position in range(1, len(parts)):
+            if position <= len(values):
+                message += log_value(values[position - 1])
+            else:
+                message += "{}"
+            message += parts[position]
+    debug(f"[{LOG_CONTEXT['correlation_id']}] {level.upper()} {message}")
+
+def log_debug(message, values=None):
+    log_message("debug", message, values)
+
+def log_info(message, values=None):
+    log_message("info", message, values)
+
+def log_warning(message, values=None):
+    log_message("warning", message, values)
+
+def log_error(message, values=None):
+    log_message("error", message, values)
+
+def log_sampled(key, message, values=None):
+    """Отладочное сообщение из цикла: пишется первое и каждое LOG_SAMPLE_EVERY-е с одним ключом."""
+    if LOG_LEVELS["debug"] < LOG_CONTEXT["level"]:
+        return
+    samples = LOG_CONTEXT["samples"]
+    count = samples.get(key, 0) + 1
+    samples[key] = count
+    if count == 1 or count % LOG_SAMPLE_EVERY == 0:
+        log_message("debug", message + f" [{key}: {count}]", values)
+
+# Проекции полей: для каждого метода Bitrix24 перечислены только те поля,
+# которые скрипт читает из ответа. b24_post подставляет эти параметры
+# в каждый вызов метода, если они не заданы явно.
+B24_FIELD_PROJECTIONS = {
+    "sonet_group.get": {"SELECT": ["ID", "NAME"]},  # каталог проектов для нечеткого поиска
+    "user.search": {"SELECT": ["ID"]},  # ID исполнителей
+    "user.current": {"SELECT": ["ID"]},  # ID постановщика
+    "tasks.task.list": {"select": ["ID", "TITLE", "GROUP_ID", "STATUS"]},  # индекс названий задач
+    "tasks.task.add": {"select": ["ID", "CREATED_BY", "TITLE", "STATUS", "GROUP_ID"]},  # ссылка на задачу и запись индекса
+    "tasks.task.update": {"select": ["ID", "CREATED_BY", "TITLE", "STATUS", "GROUP_ID"]},  # ссылка на задачу и запись индекса
+}
+
+def apply_field_projection(method, params):
+    """Дополняет параметры вызова проекцией полей метода из B24_FIELD_PROJECTIONS."""
+    projection = B24_FIELD_PROJECTIONS.get(method)
+    if not projection:
+        return params
+    projected = dict(params or {})
+    for option in projection:
+        projected.setdefault(option, projection[option])
+    return projected
+
+# Предохранитель (circuit breaker) для каждого портала Bitrix24.
+# После серии ошибок или медленных ответов портал считается недоступным
+# на CIRCUIT_OPEN_SECONDS, запросы к нему сразу завершаются ошибкой,
+# затем пропускается один пробный запрос.
+B24_TIMEOUT = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW = 20
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_SLOW_SECONDS = 8
+CIRCUIT_OPEN_SECONDS = 30
+
+def get_circuit(portal_url):
+    """Возвращает состояние предохранителя портала, создавая его при первом обращении."""
+    circuits = CACHE_STORE.setdefault("circuit_breakers", {})
+    circuit = circuits.get(portal_url)
+    if circuit is None:
+        circuit = {"state": "closed", "failures": 0, "outcomes": [], "opened_at": None, "rejected": 0}
+        circuits[portal_url] = circuit
+    return circuit
+
+def circuit_allows_request(portal_url):
+    """Проверяет, можно ли сейчас отправить запрос на портал."""
+    circuit = get_circuit(portal_url)
+    if circuit["state"] == "closed":
+        return True
+    if circuit["state"] == "open":
+        if datetime.datetime.now() - circuit["opened_at"] >= datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS):
+            log_info("circuit_breaker: пробный запрос к порталу {}", [portal_url])
+            circuit["state"] = "half_open"
+            return True
+        return False
+    # half_open: пробный запрос уже отправлен, остальные ждут его результата
+    return False
+
+def record_circuit_outcome(portal_url, is_ok):
+    """Учитывает результат запроса и при необходимости размыкает или замыкает предохранитель."""
+    circuit = get_circuit(portal_url)
+    outcomes = circuit["outcomes"]
+    outcomes.append(is_ok)
+    if len(outcomes) > CIRCUIT_WINDOW:
+        del outcomes[0]
+
+    if is_ok:
+        circuit["failures"] = 0
+        if circuit["state"] != "closed":
+            log_info("circuit_breaker: портал {} снова доступен.", [portal_url])
+            circuit["state"] = "closed"
+            circuit["outcomes"] = [True]
+        return
+
+    circuit["failures"] += 1
+    error_rate = outcomes.count(False) / len(outcomes)
+    too_many_errors = len(outcomes) >= CIRCUIT_WINDOW // 2 and error_rate >= CIRCUIT_ERROR_RATE
+    if circuit["state"] == "half_open" or circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD or too_many_errors:
+        if circuit["state"] != "open":
+            log_warning("circuit_breaker: портал {} временно отключен (ошибок подряд: {}).", [portal_url, circuit['failures']])
+        circuit["state"] = "open"
+        circuit["opened_at"] = datetime.datetime.now()
+
+# Бюджет времени команды: NextBot ждет ответ скрипта ограниченное время, поэтому
+# вызов main() укладывается в COMMAND_BUDGET_SECONDS. Каждый запрос получает таймаут
+# не больше оставшегося времени, а когда времени не осталось, запрос не отправляется.
+COMMAND_BUDGET_SECONDS = 25
+BUDGET_MIN_TIMEOUT = 0.5
+LATENCY_BUDGET = {"deadline": None}
+
+def start_latency_budget(seconds=COMMAND_BUDGET_SECONDS):
+    """Начинает отсчет бюджета времени команды; вызывается в начале main()."""
+    LATENCY_BUDGET["deadline"] = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+def remaining_budget():
+    """Сколько секунд осталось до конца бюджета команды (None, если бюджет не задан)."""
+    deadline = LATENCY_BUDGET["deadline"]
+    if deadline is None:
+        return None
+    left = deadline - datetime.datetime.now()
+    return left.days * 86400 + left.seconds + left.microseconds / 1000000
+
+def budget_timeout(timeout):
+    """Урезает таймаут запроса до оставшегося бюджета; если бюджет исчерпан, выбрасывает requests.exceptions.Timeout."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining < BUDGET_MIN_TIMEOUT:
+        raise requests.exceptions.Timeout("Бюджет времени команды исчерпан, запрос не отправлен.")
+    return min(timeout, remaining)
+
+def b24_post(webhook_url, method, params=None, timeout=B24_TIMEOUT, stream=False):
+    """
+    Вызывает метод REST API Bitrix24 с таймаутом и через предохранитель портала.
+    Если портал временно отключен, сразу выбрасывает requests.exceptions.ConnectionError.
+    При stream=True тело ответа не загружается целиком (см. open_task_stream).
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    # Таймаут считается до проверки предохранителя, чтобы не оставить пробный запрос неотправленным
+    timeout = budget_timeout(timeout)
+    if not circuit_allows_request(portal_url):
+        get_circuit(portal_url)["rejected"] += 1
+        raise requests.exceptions.ConnectionError(f"Портал {portal_url} временно недоступен, запрос {method} не отправлен.")
+
+    params = apply_field_projection(method, params)
+    started_at = datetime.datetime.now()
+    try:
+        response = requests.post(f"{webhook_url}{method}.json", json=params, timeout=timeout, stream=stream)
+    except Exception:
+        record_circuit_outcome(portal_url, False)
+        raise
+    is_slow = datetime.datetime.now() - started_at > datetime.timedelta(seconds=CIRCUIT_SLOW_SECONDS)
+    record_circuit_outcome(portal_url, response.status_code < 500 and not is_slow)
+    return response
+
+# Потоковое чтение больших ответов tasks.task.list: задачи разбираются по одной,
+# полный текст ответа и дерево всех задач одновременно в памяти не держатся.
+STREAM_CHUNK_SIZE = 65536
+
+def open_task_stream(response):
+    """
+    Начинает потоковое чтение ответа tasks.task.list.
+    Читает ответ до начала массива задач и возвращает состояние потока.
+    Если массива нет (ответ с ошибкой), в состоянии заполняются error и error_description.
+    """
+    if not response.encoding:
+        response.encoding = "utf-8"
+    stream = {
+        "chunks": response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True),
+        "buffer": "",
+        "error": None,
+        "error_description": None,
+        "has_tasks": False,
+        "finished": False,
+        "decoder": json.JSONDecoder(),
+    }
+    for chunk in stream["chunks"]:
+        stream["buffer"] += chunk
+        match = re.search(r'"result"\s*:\s*\{\s*"tasks"\s*:\s*\[', stream["buffer"])
+        if match:
+            stream["buffer"] = stream["buffer"][match.end():]
+            stream["has_tasks"] = True
+            return stream
+
+    # Массива задач нет: ответ небольшой, разбираем его целиком
+    payload = json.loads(stream["buffer"]) if stream["buffer"].strip() else {}
+    stream["buffer"] = ""
+    if isinstance(payload, dict) and payload.get("error"):
+        stream["error"] = payload.get("error")
+        stream["error_description"] = payload.get("error_description", "Нет описания")
+    return stream
+
+def read_stream_task(stream, fields):
+    """
+    Читает из потока следующую задачу, оставляя в ней только поля из fields.
+    Возвращает None, когда список задач закончился. Позиция чтения хранится
+    в самом состоянии потока, поэтому функция вызывается в обычном цикле while.
+    """
+    if not stream["has_tasks"] or stream["finished"]:
+        return None
+    buffer = stream["buffer"]
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if not buffer:
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise json.JSONDecodeError("Ответ оборвался внутри списка задач", "", 0)
+            buffer = chunk
+            continue
+        if buffer[0] == "]":
+            # Хвост ответа (курсор next, total) остается в потоке для read_stream_next
+            stream["buffer"] = buffer[1:]
+            stream["finished"] = True
+            return None
+        try:
+            decoded = stream["decoder"].raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Задача пришла не целиком, дочитываем следующий фрагмент
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise
+            buffer += chunk
+            continue
+        task = decoded[0]
+        stream["buffer"] = buffer[decoded[1]:]
+        return {field: task[field] for field in fields if field in task}
+
+def read_stream_next(stream):
+    """
+    Дочитывает ответ tasks.task.list после списка задач и возвращает курсор
+    следующей страницы ("next") или None, если страница последняя.
+    """
+    tail = stream["buffer"]
+    for chunk in stream["chunks"]:
+        tail += chunk
+    stream["buffer"] = ""
+    match = re.search(r'"next"\s*:\s*(\d+)', tail)
+    return int(match.group(1)) if match else None
+
+# Ключи для нечеткого поиска с учетом ошибок распознавания речи. Для каждого слова
+# строятся основа без падежного окончания в латинской транслитерации и фонетический
+# код, поэтому "маркетинга", "Маркетинг" и "marketing" совпадают по ключу.
+RUSSIAN_ENDINGS = sorted((
+    "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему", "иях", "ях", "ах", "ов", "ев",
+    "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ию", "ия", "ии", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+TRANSLIT_MAP = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+PHONETIC_REPLACEMENTS = (
+    ("shch", "s"), ("sh", "s"), ("zh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("ph", "f"),
+    ("ck", "k"), ("x", "ks"), ("w", "v"), ("q", "k"), ("j", "i"), ("y", "i"),
+    ("b", "p"), ("v", "f"), ("g", "k"), ("d", "t"), ("z", "s"),
+)
+PHONETIC_VOWELS = "aeiou"
+PROJECT_INDEX_TTL_SECONDS = 300
+
+def split_words(text):
+    """Нормализует текст и разбивает его на слова."""
+    if not isinstance(text, str) or not text:
+        return []
+    return re.sub(r'[^\w\s]', '', text).lower().replace('ё', 'е').split()
+
+def stem_word(word):
+    """Отбрасывает типичное русское окончание, если остается основа не короче трех букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def transliterate_word(word):
+    """Переводит кириллицу в латиницу, латиницу и цифры оставляет как есть."""
+    return ''.join(TRANSLIT_MAP.get(c, c) for c in word)
+
+def phonetic_code(latin_word):
+    """Грубый фонетический код: глухие и звонкие согласные совпадают, гласные после первой буквы отбрасываются."""
+    code = latin_word
+    for replacement in PHONETIC_REPLACEMENTS:
+        code = code.replace(replacement[0], replacement[1])
+    if not code:
+        return ""
+    result_chars = [code[0]]
+    for c in code[1:]:
+        if c not in PHONETIC_VOWELS and c != result_chars[-1]:
+            result_chars.append(c)
+    return ''.join(result_chars)
+
+def word_keys(word):
+    """Ключи слова для индекса: транслитерированная основа и фонетический код (если он не слишком короткий)."""
+    word_keys_cache = CACHE_STORE.setdefault("word_keys", {})
+    keys = word_keys_cache.get(word)
+    if keys is None:
+        latin_stem = transliterate_word(stem_word(word))
+        keys = ["t:" + latin_stem]
+        code = phonetic_code(latin_stem)
+        if len(code) >= 3:
+            keys.append("p:" + code)
+        if len(word_keys_cache) > 50000:
+            word_keys_cache.clear()
+        word_keys_cache[word] = keys
+    return keys
+
+def build_query_index(text):
+    """Индекс ключей поискового запроса: ключ -> номера слов запроса."""
+    words = list(dict.fromkeys(split_words(text)))
+    keys = {}
+    for index in range(len(words)):
+        word = words[index]
+        for key in word_keys(word):
+            keys.setdefault(key, set()).add(index)
+    return {"size": len(words), "keys": keys}
+
+def count_matched_words(query, words):
+    """Сколько слов запроса совпало со словами текста хотя бы по одному ключу."""
+    matched = set()
+    for word in words:
+        for key in word_keys(word):
+            indexes = query["keys"].get(key)
+            if indexes:
+                matched.update(indexes)
+    return len(matched)
+
+def get_project_index(webhook_url):
+    """
+    Возвращает каталог проектов портала с индексом ключей слов названий.
+    Каталог кешируется в CACHE_STORE на PROJECT_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    project_indexes = CACHE_STORE.setdefault("project_index", {})
+    index = project_indexes.get(portal_url)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=PROJECT_INDEX_TTL_SECONDS):
+        return index
+
+    response = b24_post(webhook_url, "sonet_group.get", {})
+    response.raise_for_status()
+    projects = response.json().get("result", [])
+
+    index = {"names": {}, "position": {}, "keys": {}, "built_at": now}
+    for project in projects:
+        project_name = project.get("NAME")
+        if not isinstance(project_name, str) or not project_name:
+            continue
+        project_id = int(project.get("ID"))
+        index["names"][project_id] = project_name
+        index["position"][project_id] = len(index["position"])
+        for word in set(split_words(project_name)):
+            for key in word_keys(word):
+                index["keys"].setdefault(key, set()).add(project_id)
+    project_indexes[portal_url] = index
+    return index
+
+def match_project_id(index, project_name):
+    """
+    Находит в индексе проект с наибольшим числом совпавших слов запроса.
+    Каждое слово запроса - несколько обращений к словарю ключей, без перебора проектов.
+    При равенстве выигрывает проект, который портал вернул первым.
+    """
+    counts = {}
+    for word in dict.fromkeys(split_words(project_name)):
+        matched_ids = set()
+        for key in word_keys(word):
+            matched_ids.update(index["keys"].get(key, ()))
+        for project_id in matched_ids:
+            counts[project_id] = counts.get(project_id, 0) + 1
+
+    best_match_id = None
+    max_common_count = 0
+    for project_id in counts:
+        common_count = counts[project_id]
+        if common_count > max_common_count or (
+                common_count == max_common_count and index["position"][project_id] < index["position"][best_match_id]):
+            max_common_count = common_count
+            best_match_id = project_id
+    return best_match_id
+
+# Индекс названий задач портала для нечеткого поиска: все задачи (кроме
+# удаленных в корзину) с разобранными словами названий, статусом и проектом.
+# Строится потоковым проходом по всем страницам tasks.task.list и живет в CACHE_STORE
+# TASK_INDEX_TTL_SECONDS. Изменения задач не сбрасывают индекс, а исправляют его
+# записи на месте по данным из ответа Bitrix24 (write-through).
+# Запись задачи - компактный кортеж (название, слова, статус, проект): слова
+# названий общие для всех порталов (одна строка на слово), статус и проект -
+# целые числа, остальные поля ответа не хранятся. Поэтому один резидентный
+# процесс держит в памяти индексы нескольких больших порталов.
+TASK_INDEX_TTL_SECONDS = 300
+# Индекс только незавершенных задач (фильтр "!STATUS": 5) кешируется под отдельным ключом
+TASK_INDEX_OPEN_SUFFIX = "|open"
+TASK_TITLE = 0
+TASK_WORDS = 1
+TASK_STATUS = 2
+TASK_GROUP = 3
+INTERNED_WORDS_LIMIT = 200000
+
+def intern_words(words):
+    """Кортеж слов, в котором одинаковые слова всех названий - один и тот же объект строки."""
+    interned = CACHE_STORE.setdefault("interned_words", {})
+    if len(interned) > INTERNED_WORDS_LIMIT:
+        interned.clear()
+    return tuple(interned.setdefault(word, word) for word in words)
+
+def put_task_record(index, task):
+    """Добавляет задачу в индекс или обновляет ее запись полями, которые есть в task."""
+    task_id = int(task.get("id"))
+    record = index["tasks"].get(task_id) or ("", (), 0, 0)
+    title = record[TASK_TITLE]
+    words = record[TASK_WORDS]
+    status = record[TASK_STATUS]
+    group_id = record[TASK_GROUP]
+    if task.get("title") is not None:
+        title = task["title"]
+        words = intern_words(split_words(title))
+    if task.get("status") is not None:
+        status = int(task["status"])
+    if task.get("groupId") is not None:
+        group_id = int(task["groupId"] or 0)
+    # Запись заменяется целиком: читатели индекса видят либо старую, либо новую версию
+    index["tasks"][task_id] = (title, words, status, group_id)
+
+def get_task_index(webhook_url, open_only=False):
+    """
+    Возвращает индекс названий задач портала {"tasks": {id: запись}, "built_at"}.
+    open_only=True - индекс только незавершенных задач, он хранится отдельно от полного.
+    Индекс кешируется в CACHE_STORE на TASK_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    index_key = portal_url + TASK_INDEX_OPEN_SUFFIX if open_only else portal_url
+    task_indexes = CACHE_STORE.setdefault("task_index", {})
+    index = task_indexes.get(index_key)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=TASK_INDEX_TTL_SECONDS):
+        return index
+
+    task_filter = {"ZOMBIE": "N"}
+    if open_only:
+        task_filter["!STATUS"] = 5
+    index = {"tasks": {}, "built_at": now}
+    start = 0
+    # Bitrix24 отдает список страницами по 50 задач: идем по курсору next до последней
+    # страницы, каждую читаем потоково (в памяти одновременно только одна задача ответа)
+    while start is not None:
+        params = {"order": {"ID": "ASC"}, "filter": task_filter, "start": start}
+        response = b24_post(webhook_url, "tasks.task.list", params, stream=True)
+        response.raise_for_status()
+        stream = open_task_stream(response)
+        if stream["error"]:
+            response.close()
+            raise ValueError(stream["error_description"])
+        while True:
+            task = read_stream_task(stream, ["id", "title", "status", "groupId"])
+            if task is None:
+                break
+            put_task_record(index, task)
+        start = read_stream_next(stream)
+        response.close()
+    log_debug("get_task_index: в индексе портала {} задач: {}", [index_key, len(index["tasks"])])
+    task_indexes[index_key] = index
+    return index
+
+def patch_task_index(webhook_url, task=None, deleted_task_id=None):
+    """
+    Исправляет индекс названий задач после изменения (write-through): task — задача
+    из ответа tasks.task.add/update, deleted_task_id — ID удаленной задачи.
+    Если индекс портала еще не построен, исправлять нечего.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    task_indexes = CACHE_STORE.get("task_index", {})
+    # Полный индекс и индекс незавершенных задач исправляются одинаково
+    for index_key in (portal_url, portal_url + TASK_INDEX_OPEN_SUFFIX):
+        index = task_indexes.get(index_key)
+        if not index:
+            continue
+        if deleted_task_id is not None:
+            index["tasks"].pop(int(deleted_task_id), None)
+            log_debug("patch_task_index: задача {} удалена из индекса {}.", [deleted_task_id, index_key])
+        if task and task.get("id"):
+            put_task_record(index, task)
+            if index_key != portal_url and index["tasks"][int(task["id"])][TASK_STATUS] == 5:
+                # Завершенная задача уходит из индекса незавершенных
+                index["tasks"].pop(int(task["id"]))
+            log_debug("patch_task_index: задача {} обновлена в индексе {}.", [task.get('id'), index_key])
+
+# Контекст диалога: недавно созданные и измененные задачи и проекты пользователя
+# (CACHE_STORE["session_context"]). Уточняющие команды вроде «поставь ей высокий
+# приоритет» или «перенеси эту задачу на завтра» находят задачу по нему, без
+# загрузки списка задач портала.
+SESSION_CONTEXT_TTL_SECONDS = 1800
+SESSION_CONTEXT_SIZE = 5
+# Указательные слова и местоимения: только они делают фразу ссылкой на предмет разговора
+CONTEXT_REFERENCE_WORDS = {
+    "эта", "эту", "этой", "этот", "этого", "этом", "это", "та", "ту", "той", "тот", "том", "то",
+    "она", "ее", "ей", "нее", "ней", "он", "его", "ему", "него", "нему", "туда", "там",
+}
+# Слова, допустимые рядом с указательным («эту задачу», «тот же проект»), но не ссылка сами по себе
+CONTEXT_REFERENCE_COMPANIONS = {
+    "же", "задача", "задачу", "задаче", "задачей", "задачи", "проект", "проекта", "проекте", "проекту", "проектом",
+}
+
+def get_session_context(webhook_url, user_name):
+    """Возвращает контекст диалога пользователя на портале {"tasks": [...], "projects": [...]}."""
+    context_key = f"{webhook_url.split('/rest/')[0]}|{user_name}"
+    return CACHE_STORE.setdefault("session_context", {}).setdefault(context_key, {"tasks": [], "projects": []})
+
+def push_context_entry(entries, entry):
+    """
+    Ставит запись первой, дополняя ее пустые поля из прежней записи с тем же ID.
+    Возвращает новый список не длиннее SESSION_CONTEXT_SIZE: контекст могут читать параллельные команды.
+    """
+    for item in entries:
+        if item["id"] == entry["id"]:
+            for field in item:
+                if not entry.get(field):
+                    entry[field] = item[field]
+    entry["touched_at"] = datetime.datetime.now()
+    return ([entry] + [item for item in entries if item["id"] != entry["id"]])[:SESSION_CONTEXT_SIZE]
+
+def remember_project(webhook_url, user_name, project_id, project_name=None):
+    """Запоминает проект как последний упомянутый в диалоге."""
+    context = get_session_context(webhook_url, user_name)
+    context["projects"] = push_context_entry(context["projects"], {"id": int(project_id), "name": project_name or ""})
+
+def remember_task(webhook_url, user_name, task_id, title=None, project_id=None):
+    """Запоминает созданную или измененную задачу (и ее проект) как последнюю в диалоге."""
+    if project_id is not None and str(project_id) in ("", "0"):
+        project_id = None
+    context = get_session_context(webhook_url, user_name)
+    entry = {"id": int(task_id), "title": title or "", "project_id": int(project_id) if project_id else None}
+    context["tasks"] = push_context_entry(context["tasks"], entry)
+    if project_id:
+        remember_project(webhook_url, user_name, project_id)
+
+def forget_task(webhook_url, user_name, task_id):
+    """Убирает удаленную задачу из контекста диалога."""
+    context = get_session_context(webhook_url, user_name)
+    context["tasks"] = [item for item in context["tasks"] if item["id"] != int(task_id)]
+
+def recent_context_entries(entries):
+    """Записи контекста моложе SESSION_CONTEXT_TTL_SECONDS, последние первыми."""
+    now = datetime.datetime.now()
+    return [item for item in entries if now - item["touched_at"] < datetime.timedelta(seconds=SESSION_CONTEXT_TTL_SECONDS)]
+
+def is_context_reference(text):
+    """Проверяет, что текст только указывает на предмет разговора («её», «эту задачу», «тот же проект»)."""
+    words = split_words(text)
+    if not any(word in CONTEXT_REFERENCE_WORDS for word in words):
+        return False
+    return all(word in CONTEXT_REFERENCE_WORDS or word in CONTEXT_REFERENCE_COMPANIONS for word in words)
+
+def resolve_project_from_context(webhook_url, user_name, project_name):
+    """
+    Возвращает ID последнего проекта диалога, если project_name только указывает на него
+    («тот же проект», «туда») и на портале нет проекта с буквально таким названием.
+    """
+    if not is_context_reference(project_name):
+        return None
+    try:
+        index = get_project_index(webhook_url)
+        words = split_words(project_name)
+        if any(split_words(name) == words for name in index["names"].values()):
+            # Настоящее название проекта важнее контекста, его найдет обычный поиск
+            return None
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+        log_warning("resolve_project_from_context: каталог проектов недоступен: {}", [e])
+    projects = recent_context_entries(get_session_context(webhook_url, user_name)["projects"])
+    return projects[0]["id"] if projects else None
+
+# Хранилище учетных данных: вебхуки ищутся в локальном индексе
+# CACHE_STORE["credentials"] ({имя: [вебхуки порталов]}). Резидентный раннер
+# заполняет его из своего хранилища (SQLite, JSON, окружение) и тогда таблица
+# не читается вовсе; иначе индекс импортируется из Google Таблицы, не чаще
+# раза в WEBHOOK_SHEET_SYNC_SECONDS.
+WEBHOOK_SHEET_SYNC_SECONDS = 300
+
+def normalize_webhook(webhook):
+    """Убирает непечатаемые символы и добавляет завершающий '/'."""
+    webhook = ''.join(c for c in webhook.strip() if c.isprintable())
+    if not webhook.endswith('/'): webhook += '/'
+    return webhook
+
+def parse_webhook_sheet(csv_data):
+    """
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в словарь {имя: [вебхуки]}.
+    У пользователя, работающего на нескольких порталах, несколько строк;
+    первая строка задает основной портал.
+    """
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        if not line.strip(): continue
+        parts = line.strip().split(',')
+        if len(parts) >= 2:
+            sheet_user = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if sheet_user and webhook != '/':
+                user_webhooks = webhooks.setdefault(sheet_user, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+def get_credential_index():
+    """Возвращает индекс учетных данных, создавая пустой индекс с импортом из таблицы."""
+    credentials = CACHE_STORE.get("credentials")
+    if credentials is None:
+        credentials = {"source": "sheet", "webhooks": {}, "synced_at": None}
+        CACHE_STORE["credentials"] = credentials
+    return credentials
+
+def sync_webhooks_from_sheet(sheet_url, credentials):
+    """Загружает опубликованную Google Таблицу CSV и заменяет ею индекс вебхуков."""
+    response = requests.get(sheet_url, timeout=budget_timeout(5))
+    response.raise_for_status()
+    credentials["webhooks"] = parse_webhook_sheet(response.text)
+    credentials["synced_at"] = datetime.datetime.now()
+
+def find_user_webhooks(sheet_url, user_name):
+    """
+    Возвращает все вебхуки пользователя (основной первым) из хранилища учетных данных.
+    Google Таблица служит только источником для импорта: она читается,
+    если индекс пуст или пользователь не найден, а с прошлой загрузки
+    прошло больше WEBHOOK_SHEET_SYNC_SECONDS.
+    """
+    credentials = get_credential_index()
+    user_webhooks = credentials["webhooks"].get(user_name)
+    if user_webhooks:
+        log_debug("<- find_user_webhooks: Вебхуки для '{}' найдены в индексе ({}).", [user_name, credentials['source']])
+        return user_webhooks
+    if credentials["source"] != "sheet":
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден в хранилище {}.", [user_name, credentials['source']])
+        return []
+
+    synced_at = credentials["synced_at"]
+    if synced_at is not None and datetime.datetime.now() - synced_at < datetime.timedelta(seconds=WEBHOOK_SHEET_SYNC_SECONDS):
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден, таблица загружена недавно.", [user_name])
+        return []
+    try:
+        sync_webhooks_from_sheet(sheet_url, credentials)
+    except Exception as e:
+        log_error("<- find_user_webhooks: Ошибка при доступе к Google Sheets: {}", [e])
+        return []
+
+    user_webhooks = credentials["webhooks"].get(user_name) or []
+    log_debug("<- find_user_webhooks: Для '{}' в таблице найдено вебхуков: {}.", [user_name, len(user_webhooks)])
+    return user_webhooks
+
+def get_webhook_from_sheet(sheet_url, user_name):
+    """Получает основной вебхук пользователя (см. find_user_webhooks)."""
+    log_debug("-> get_webhook_from_sheet: ищем вебхук для '{}'", [user_name])
+    user_webhooks = find_user_webhooks(sheet_url, user_name)
+    if user_webhooks:
+        return user_webhooks[0]
+    return None
+
+# Ранжированный поиск задач: сколько кандидатов возвращать и насколько близкими
+# (по доле общих слов) должны быть оценки, чтобы переспросить пользователя
+TASK_CANDIDATES_TOP_K = 3
+TASK_AMBIGUITY_MARGIN = 0.15
+
+# Метод batch Bitrix24 выполняет не больше 50 команд за вызов
+BATCH_MAX_COMMANDS = 50
+URL_SAFE_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~$[]"
+
+STATUS_MAP = {
+    "ждет выполнения": 2,
+    "выполняется": 3,
+    "ожидает контроля": 4,
+    "завершена": 5,
+    "отложена": 6,
+}
+PRIORITY_MAP = {"высокий": "2", "средний": "1", "низкий": "0", "2": "2", "1": "1", "0": "0"}
+ACTION_NAMES = {"create": "Создание", "update": "Обновление", "delete": "Удаление"}
+
+def push_top_candidate(top, candidate, top_k):
+    """Вставляет кандидата в список, упорядоченный по убыванию оценки, сохраняя не более top_k элементов."""
+    rank = (candidate["score"], candidate["similarity"])
+    index = len(top)
+    while index > 0 and (top[index - 1]["score"], top[index - 1]["similarity"]) < rank:
+        index -= 1
+    if index < top_k:
+        top.insert(index, candidate)
+        if len(top) > top_k:
+            top.pop()
+
+def score_title(search, task_words):
+    """Оценивает слова названия задачи для поиска: (число общих слов, доля совпадения) или None."""
+    common_count = count_matched_words(search["query"], task_words)
+    if common_count == 0:
+        return None
+    similarity = common_count / (search["query"]["size"] + len(set(task_words)) - common_count)
+    return {"score": common_count, "similarity": similarity}
+
+def rank_tasks_for_searches(webhook_url, searches):
+    """
+    Ранжирует задачи Bitrix24 сразу для всех поисков команды за один проход
+    по индексу названий задач. Для каждого поиска {"query", "project_id", "skip_completed",
+    "candidates"} заполняет до TASK_CANDIDATES_TOP_K кандидатов по убыванию оценки.
+    """
+    log_debug("-> rank_tasks_for_searches: поисков: {}", [len(searches)])
+    index = get_task_index(webhook_url)
+
+    tasks_seen = 0
+    # Совпадения в цикле пишутся выборочно и только при включенном отладочном уровне
+    trace = log_enabled("debug")
+    for search in searches:
+        search["group_id"] = int(search["project_id"]) if search["project_id"] is not None else None
+    # Снимок записей: индекс могут исправлять параллельные команды
+    for item in list(index["tasks"].items()):
+        record = item[1]
+        tasks_seen += 1
+        for search in searches:
+            if search["group_id"] is not None and record[TASK_GROUP] != search["group_id"]:
+                continue
+            if search["skip_completed"] and record[TASK_STATUS] == 5:
+                continue
+            rank = score_title(search, record[TASK_WORDS])
+            if rank:
+                rank["id"] = item[0]
+                rank["title"] = record[TASK_TITLE]
+                push_top_candidate(search["candidates"], rank, TASK_CANDIDATES_TOP_K)
+                if trace:
+                    log_sampled("rank_tasks_for_searches", "rank_tasks_for_searches: совпадение с задачей {} (общих слов: {})", [item[0], rank["score"]])
+    log_debug("<- rank_tasks_for_searches: просмотрено задач: {}", [tasks_seen])
+
+def select_close_candidates(candidates):
+    """
+    Оставляет кандидатов, неотличимых от лучшего: с тем же числом общих слов
+    и долей совпадения не ниже лучшей более чем на TASK_AMBIGUITY_MARGIN.
+    Если таких больше одного, пользователя нужно переспросить.
+    """
+    if not candidates:
+        return []
+    best = candidates[0]
+    return [c for c in candidates
+            if c["score"] == best["score"] and best["similarity"] - c["similarity"] <= TASK_AMBIGUITY_MARGIN]
+
+def format_candidates_message(candidates):
+    """Формирует короткий список похожих задач для уточнения."""
+    lines = ["Нашлось несколько похожих задач:"]
+    for index in range(1, len(candidates) + 1):
+        candidate = candidates[index - 1]
+        if candidate.get("ref"):
+            lines.append(f"{index}. новая «{candidate['title']}» из этой же команды")
+        else:
+            lines.append(f"{index}. #{candidate['id']} «{candidate['title']}»")
+    lines.append("Уточните, какую из них выбрать.")
+    return "\n".join(lines)
+
+def parse_deadline(deadline_str):
+    """Преобразует текстовое описание срока в формат Bitrix24."""
+    log_debug("-> parse_deadline: '{}'", [deadline_str])
+    deadline_str = deadline_str.lower().strip()
+    now = datetime.datetime.now()
+    deadline_dt = None
+
+    if "завтра" in deadline_str:
+        deadline_dt = (now + datetime.timedelta(days=1)).replace(hour=18, minute=0, second=0)
+    elif "послезавтра" in deadline_str:
+        deadline_dt = (now + datetime.timedelta(days=2)).replace(hour=18, minute=0, second=0)
+    elif "через неделю" in deadline_str:
+        deadline_dt = (now + datetime.timedelta(weeks=1)).replace(hour=18, minute=0, second=0)
+    elif "через" in deadline_str:
+        match = re.search(r"через (\d+)\s+(дн|дня|дней|час|часа|часов)", deadline_str)
+        if match:
+            value = int(match.group(1))
+            unit = match.group(2)
+            if "дн" in unit:
+                deadline_dt = (now + datetime.timedelta(days=value)).replace(hour=18, minute=0, second=0)
+            elif "час" in unit:
+                deadline_dt = now + datetime.timedelta(hours=value)
+    else:
+        try:
+            # Ручной парсинг "ДД.ММ.ГГГГ" или "ДД.ММ.ГГГГ ЧЧ:ММ"
+            parts = deadline_str.split(' ')
+            date_parts = parts[0].split('.')
+            day = int(date_parts[0])
+            month = int(date_parts[1])
+            year = int(date_parts[2])
+            hour = 18
+            minute = 0
+            if len(parts) > 1:
+                time_parts = parts[1].split(':')
+                if len(time_parts) >= 2:
+                    hour = int(time_parts[0])
+                    minute = int(time_parts[1])
+            deadline_dt = datetime.datetime(year, month, day, hour, minute)
+        except (ValueError, IndexError):
+            log_debug("Не удалось преобразовать '{}' в дату и время.", [deadline_str])
+            deadline_dt = None
+
+    if deadline_dt:
+        # Ручное форматирование даты в строку
+        y = deadline_dt.year
+        m = deadline_dt.month
+        d = deadline_dt.day
+        h = deadline_dt.hour
+        mi = deadline_dt.minute
+        s = deadline_dt.second
+        result_dt = f"{y:04d}-{m:02d}-{d:02d}T{h:02d}:{mi:02d}:{s:02d}"
+        log_debug("<- parse_deadline: возвращает '{}'", [result_dt])
+        return result_dt
+
+    log_debug("<- parse_deadline: не удалось распознать срок, возвращает None")
+    return None
+
+def url_quote(value):
+    """Кодирует значение для строки запроса команды batch (UTF-8, percent-encoding)."""
+    encoded = []
+    for c in str(value):
+        if c in URL_SAFE_CHARS:
+            encoded.append(c)
+        else:
+            for byte in c.encode("utf-8"):
+                encoded.append(f"%{byte:02X}")
+    return "".join(encoded)
+
+def flatten_query_params(prefix, value, pairs):
+    """Разворачивает вложенные параметры в пары вида fields[TITLE]=... для batch."""
+    if isinstance(value, dict):
+        for key in value:
+            flatten_query_params(f"{prefix}[{key}]" if prefix else str(key), value[key], pairs)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            item = value[index]
+            flatten_query_params(f"{prefix}[{index}]", item, pairs)
+    else:
+        pairs.append(f"{url_quote(prefix)}={url_quote(value)}")
+
+def build_batch_command(method, params):
+    """Строка команды batch "метод?параметры" с проекцией полей метода."""
+    pairs = []
+    flatten_query_params("", apply_field_projection(method, params) or {}, pairs)
+    return f"{method}?{'&'.join(pairs)}"
+
+def call_batch(webhook_url, commands, halt=0):
+    """
+    Выполняет список команд [{"key", "method", "params"}] одним вызовом batch.
+    Команды выполняются по порядку и могут ссылаться на результаты предыдущих
+    через $result[ключ][...]. С halt=1 пакет останавливается на первой ошибке:
+    команды после нее не выполняются и не попадают ни в результаты, ни в ошибки.
+    Возвращает словари результатов и ошибок по ключам.
+    """
+    log_debug("-> call_batch: команд: {}", [len(commands)])
+    cmd = {}
+    for command in commands:
+        cmd[command["key"]] = build_batch_command(command["method"], command["params"])
+    response = b24_post(webhook_url, "batch", {"halt": halt, "cmd": cmd}, timeout=30)
+    response.raise_for_status()
+    result_json = response.json()
+    if "error" in result_json:
+        raise ValueError(result_json.get("error_description") or result_json["error"])
+    batch_result = result_json.get("result", {})
+    results = batch_result.get("result") or {}
+    errors = batch_result.get("result_error") or {}
+    # Пустые результаты Bitrix24 отдает списком, а не словарем
+    if isinstance(results, list):
+        results = {}
+    if isinstance(errors, list):
+        errors = {}
+    log_debug("<- call_batch: успешно: {}, ошибок: {}", [len(results), len(errors)])
+    return {"results": results, "errors": errors}
+
+def resolve_users(webhook_url, names, need_current_user):
+    """
+    Находит ID пользователей по именам и владельца вебхука одним вызовом batch.
+    Возвращает словарь {имя: ID или None}; владелец вебхука — под ключом None.
+    """
+    commands = []
+    for index in range(len(names)):
+        name = names[index]
+        commands.append({"key": f"user_{index}", "method": "user.search", "params": {"FILTER": {"FIND": name}}})
+    if need_current_user:
+        commands.append({"key": "current_user", "method": "user.current", "params": {}})
+    if not commands:
+        return {}
+
+    user_ids = {}
+    try:
+        batch = call_batch(webhook_url, commands)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log_error("resolve_users: ОШИБКА API: {}", [e])
+        batch = {"results": {}, "errors": {}}
+    for index in range(len(names)):
+        name = names[index]
+        found = batch["results"].get(f"user_{index}")
+        user_ids[name] = int(found[0]["ID"]) if found else None
+    if need_current_user:
+        current = batch["results"].get("current_user") or {}
+        user_ids[None] = int(current["ID"]) if current.get("ID") else None
+    return user_ids
+
+def normalize_operations(raw_operations):
+    """Приводит список операций из args к списку словарей (NextBot может передать JSON-строку)."""
+    if isinstance(raw_operations, str):
+        try:
+            raw_operations = json.loads(raw_operations)
+        except ValueError:
+            return None
+    if not isinstance(raw_operations, list):
+        return None
+    operations = []
+    for raw in raw_operations:
+        if not isinstance(raw, dict):
+            return None
+        operation = dict(raw)
+        operation["action"] = str(operation.get("action", "")).lower().strip()
+        operations.append(operation)
+    return operations
+
+def build_update_fields(operation, project_id, user_ids, warnings):
+    """Поля для tasks.task.update по аргументам операции (как в update_task)."""
+    fields = {}
+    if "title" in operation:
+        fields["TITLE"] = operation["title"]
+    if "description" in operation:
+        fields["DESCRIPTION"] = operation["description"]
+    if operation.get("project") and project_id:
+        fields["GROUP_ID"] = project_id
+    if "responsible" in operation:
+        responsible_id = user_ids.get(operation["responsible"])
+        if responsible_id:
+            fields["RESPONSIBLE_ID"] = responsible_id
+        else:
+            warnings.append(f"ответственный '{operation['responsible']}' не найден")
+    if "deadline" in operation:
+        deadline = parse_deadline(str(operation["deadline"]))
+        if deadline:
+            fields["DEADLINE"] = deadline
+        else:
+            warnings.append(f"срок '{operation['deadline']}' не распознан")
+    if "status" in operation:
+        status_id = STATUS_MAP.get(str(operation["status"]).lower().strip())
+        if status_id:
+            fields["STATUS"] = status_id
+        else:
+            warnings.append(f"статус '{operation['status']}' не распознан")
+    if "priority" in operation:
+        priority_value = PRIORITY_MAP.get(str(operation["priority"]).lower().strip())
+        if priority_value:
+            fields["PRIORITY"] = priority_value
+        else:
+            warnings.append(f"приоритет '{operation['priority']}' не распознан")
+    return fields
+
+def task_link_from_result(webhook_url, task_result):
+    """Ссылка на задачу по ответу tasks.task.add/update внутри batch."""
+    task = (task_result or {}).get("task") or {}
+    task_id = task.get("id")
+    if not task_id:
+        return None
+    portal_url = webhook_url.split('/rest/')[0]
+    return f"{portal_url}/company/personal/user/{task.get('createdBy')}/tasks/task/view/{task_id}/"
+
+def invalidate_task_listings(webhook_url):
+    """Сбрасывает кеш списков задач и дайджесты show_task для портала после изменения задач."""
+    portal_url = webhook_url.split('/rest/')[0]
+    CACHE_STORE.get("show_task", {}).pop(portal_url, None)
+    CACHE_STORE.get("show_task_digests", {}).pop(portal_url, None)
+    # Новое поколение не дает фоновым обновлениям, начатым до сброса, записать старый ответ
+    generations = CACHE_STORE.setdefault("show_task_generation", {})
+    generations[portal_url] = generations.get(portal_url, 0) + 1
+    log_debug("invalidate_task_listings: кеш списков задач портала {} сброшен.", [portal_url])
+
+# --- Основная функция, которую вызывает платформа ---
+
+def main(args):
+    """
+    Выполняет несколько операций над задачами из одной фразы пользователя.
+    args["operations"] - список {"action": "create" | "update" | "delete", ...} с теми же
+    аргументами, что у add_new_task, update_task и delete_task. Общие поиски (вебхук,
+    проекты, пользователи, задачи по названию) выполняются один раз, а все изменения
+    отправляются одним вызовом batch: сначала создание, затем обновление, затем удаление,
+    поэтому операция может ссылаться на задачу, созданную в этой же команде.
+    """
+    start_log_context("batch_tasks", args)
+    start_latency_budget()
+    log_info("--- Запуск функции batch_tasks ---")
+    log_debug("Получены аргументы от NextBot: {}", [args])
+
+    GSHEET_URL = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv"
+    user_name = args.get("nameUser")
+    if not user_name:
+        return {"result": "error", "message": "Техническая ошибка: не было передано имя пользователя (nameUser)."}
+
+    operations = normalize_operations(args.get("operations"))
+    if not operations:
+        return {"result": "error", "message": "Необходимо передать список операций (operations)."}
+    for operation in operations:
+        if operation["action"] not in ACTION_NAMES:
+            return {"result": "error", "message": f"Неизвестное действие '{operation['action']}'. Допустимы: create, update, delete."}
+    if len(operations) > BATCH_MAX_COMMANDS:
+        return {"result": "error", "message": f"За одну команду можно выполнить не больше {BATCH_MAX_COMMANDS} операций."}
+
+    webhook_url = get_webhook_from_sheet(GSHEET_URL, user_name)
+    if not webhook_url:
+        msg = f"Не удалось найти вебхук для пользователя '{user_name}'. Убедитесь, что вы внесены в базу."
+        return {"result": "error", "message": msg}
+
+    # Итог по каждой операции в исходном порядке
+    outcomes = []
+    for index in range(len(operations)):
+        operation = operations[index]
+        outcomes.append({"action": operation["action"], "result": None, "message": ""})
+
+    # 1. Проекты: каталог загружается один раз на все операции
+    project_ids = {}
+    for operation in operations:
+        project_name = operation.get("project") or operation.get("project_name")
+        if project_name and project_name not in project_ids:
+            project_ids[project_name] = None
+    if project_ids:
+        try:
+            index = get_project_index(webhook_url)
+            for project_name in project_ids:
+                project_ids[project_name] = match_project_id(index, project_name)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error("Не удалось загрузить каталог проектов: {}", [e])
+
+    # 2. Пользователи: все имена и владелец вебхука одним вызовом batch
+    responsible_names = []
+    need_current_user = False
+    for operation in operations:
+        name = operation.get("responsible")
+        if name and name not in responsible_names:
+            responsible_names.append(name)
+        if operation["action"] == "create" and not name:
+            need_current_user = True
+    user_ids = resolve_users(webhook_url, responsible_names, need_current_user)
+
+    # 3. Создание задач
+    commands = []
+    created_keys = []
+    for index in range(len(operations)):
+        operation = operations[index]
+        if operation["action"] != "create":
+            continue
+        outcome = outcomes[index]
+        project_name = operation.get("project")
+        if not operation.get("title"):
+            outcome["result"] = "error"
+            outcome["message"] = "не указано название задачи"
+            continue
+        if project_name and not project_ids.get(project_name):
+            outcome["result"] = "error"
+            outcome["message"] = f"проект, похожий на '{project_name}', не найден"
+            continue
+        responsible_id = user_ids.get(operation["responsible"]) if operation.get("responsible") else user_ids.get(None)
+        if operation.get("responsible") and not responsible_id:
+            outcome["result"] = "error"
+            outcome["message"] = f"пользователь '{operation['responsible']}' не найден"
+            continue
+        fields = {
+            "TITLE": operation["title"],
+            "DESCRIPTION": operation.get("description", ""),
+            # Как и в add_new_task: если владелец вебхука не определен, ставим администратора (ID=1)
+            "RESPONSIBLE_ID": responsible_id or 1,
+            "PRIORITY": PRIORITY_MAP.get(str(operation.get("priority", "1")).lower().strip(), "1"),
+        }
+        if project_name:
+            fields["GROUP_ID"] = project_ids[project_name]
+        if operation.get("deadline"):
+            deadline = parse_deadline(str(operation["deadline"]))
+            if deadline:
+                fields["DEADLINE"] = deadline
+        key = f"create_{index}"
+        outcome["key"] = key
+        created_keys.append({"key": key, "title": operation["title"]})
+        commands.append({"key": key, "method": "tasks.task.add", "params": {"fields": fields}})
+
+    # 4. Поиск задач для обновления и удаления: один проход по списку задач на все операции.
+    # Задачи, создаваемые в этой же команде, тоже участвуют в поиске как кандидаты.
+    searches = []
+    # Совпадения с создаваемыми задачами пишутся выборочно и только при включенном отладочном уровне
+    trace = log_enabled("debug")
+    for index in range(len(operations)):
+        operation = operations[index]
+        if operation["action"] == "create" or operation.get("task_id"):
+            continue
+        title = operation.get("find_title") if operation["action"] == "update" else operation.get("title")
+        query = build_query_index(title)
+        if not query["size"]:
+            outcomes[index]["result"] = "error"
+            outcomes[index]["message"] = "не указано название задачи для поиска"
+            continue
+        project_name = operation.get("project") or operation.get("project_name")
+        if project_name and not project_ids.get(project_name):
+            outcomes[index]["result"] = "error"
+            outcomes[index]["message"] = f"проект, похожий на '{project_name}', не найден"
+            continue
+        search = {"index": index, "title": title, "query": query, "candidates": [],
+                  "project_id": project_ids.get(project_name) if project_name else None,
+                  "skip_completed": operation["action"] == "update"}
+        for created in created_keys:
+            rank = score_title(search, split_words(created["title"]))
+            if rank:
+                rank["id"] = None
+                rank["ref"] = created["key"]
+                rank["title"] = created["title"]
+                push_top_candidate(search["candidates"], rank, TASK_CANDIDATES_TOP_K)
+                if trace:
+                    log_sampled("created_task_matches", "совпадение с создаваемой задачей {} '{}' (общих слов: {})", [created["key"], created["title"], rank["score"]])
+        searches.append(search)
+    if searches:
+        try:
+            rank_tasks_for_searches(webhook_url, searches)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error("Не удалось загрузить список задач: {}", [e])
+            for search in searches:
+                outcomes[search["index"]]["result"] = "error"
+                outcomes[search["index"]]["message"] = "не удалось загрузить список задач из Bitrix24"
+            searches = []
+
+    targets = {}
+    for search in searches:
+        outcome = outcomes[search["index"]]
+        close_candidates = select_close_candidates(search["candidates"])
+        if len(close_candidates) > 1:
+            outcome["result"] = "clarify"
+            outcome["message"] = format_candidates_message(close_candidates)
+            outcome["candidates"] = [{"id": c["id"], "title": c["title"]} for c in close_candidates]
+            continue
+        if not search["candidates"]:
+            outcome["result"] = "error"
+            outcome["message"] = f"задача, похожая на '{search['title']}', не найдена"
+            continue
+        best = search["candidates"][0]
+        # Ссылка на задачу, созданную раньше в этом же batch, подставляется порталом
+        if best.get("ref"):
+            targets[search["index"]] = f"$result[{best['ref']}][task][id]"
+            outcome["depends_on"] = best["ref"]
+        else:
+            targets[search["index"]] = best["id"]
+        outcome["title"] = best["title"]
+    for index in range(len(operations)):
+        operation = operations[index]
+        if operation["action"] != "create" and operation.get("task_id"):
+            targets[index] = int(operation["task_id"])
+
+    # 5. Обновление, затем удаление: удаление идет последним, чтобы не мешать обновлениям
+    for action in ("update", "delete"):
+        for index in range(len(operations)):
+            operation = operations[index]
+            if operation["action"] != action or index not in targets:
+                continue
+            outcome = outcomes[index]
+            key = f"{action}_{index}"
+            if action == "update":
+                warnings = []
+                project_name = operation.get("project")
+                fields = build_update_fields(operation, project_ids.get(project_name) if project_name else None,
+                                             user_ids, warnings)
+                if warnings:
+                    outcome["warnings"] = warnings
+                if not fields:
+                    outcome["result"] = "error"
+                    outcome["message"] = "не передано ни одного поля для обновления"
+                    continue
+                commands.append({"key": key, "method": "tasks.task.update",
+                                 "params": {"taskId": targets[index], "fields": fields}})
+            else:
+                commands.append({"key": key, "method": "tasks.task.delete", "params": {"taskId": targets[index]}})
+            outcome["key"] = key
+            outcome["task_id"] = targets[index]
+
+    # 6. Все изменения - одним вызовом batch
+    batch = {"results": {}, "errors": {}}
+    if commands:
+        try:
+            batch = call_batch(webhook_url, commands)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error("ОШИБКА batch: {}", [e])
+            for outcome in outcomes:
+                if outcome.get("key"):
+                    outcome["result"] = "error"
+                    outcome["message"] = "Bitrix24 не выполнил пакет изменений"
+                    outcome.pop("key")
+
+    any_changes = False
+    for outcome in outcomes:
+        key = outcome.pop("key", None)
+        depends_on = outcome.pop("depends_on", None)
+        if not key:
+            continue
+        if key in batch["errors"] or key not in batch["results"]:
+            error = batch["errors"].get(key) or {}
+            outcome["result"] = "error"
+            outcome["message"] = error.get("error_description") or "ошибка Bitrix24"
+            continue
+        any_changes = True
+        outcome["result"] = "success"
+        task_result = batch["results"][key]
+        if outcome["action"] == "delete":
+            if depends_on:
+                outcome["task_id"] = int(batch["results"][depends_on]["task"]["id"])
+            outcome["message"] = f"задача #{outcome['task_id']} удалена"
+            patch_task_index(webhook_url, deleted_task_id=outcome["task_id"])
+            forget_task(webhook_url, user_name, outcome["task_id"])
+            continue
+        if isinstance(task_result, dict) and task_result.get("task"):
+            patch_task_index(webhook_url, task_result["task"])
+            if task_result["task"].get("id"):
+                remember_task(webhook_url, user_name, task_result["task"]["id"], task_result["task"].get("title"),
+                              task_result["task"].get("groupId"))
+        link = task_link_from_result(webhook_url, task_result)
+        outcome["task_id"] = int(task_result["task"]["id"]) if link else outcome.get("task_id")
+        outcome["message"] = f"задача #{outcome['task_id']} {'создана' if outcome['action'] == 'create' else 'обновлена'}"
+        if link:
+            outcome["link"] = link
+
+    if any_changes:
+        invalidate_task_listings(webhook_url)
+
+    lines = []
+    for index in range(len(outcomes)):
+        outcome = outcomes[index]
+        mark = {"success": "✅", "clarify": "❓"}.get(outcome["result"], "❌")
+        lines.append(f"{mark} {index + 1}. {ACTION_NAMES[outcome['action']]}: {outcome['message']}")
+        if outcome.get("warnings"):
+            lines.append(f"   ⚠️ {'; '.join(outcome['warnings'])}")
+    statuses = {outcome["result"] for outcome in outcomes}
+    if statuses == {"success"}:
+        overall = "success"
+    elif "success" in statuses:
+        overall = "partial"
+    elif "clarify" in statuses:
+        overall = "clarify"
+    else:
+        overall = "error"
+    return {"result": overall, "message": "\\n".join(lines), "operations": outcomes}
+
+# --- Точка входа для платформы NextBot ---
+# Платформа выполняет этот файл и ожидает найти результат в переменной `result`.
+result = main(args)
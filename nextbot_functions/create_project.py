@@ -1,89 +1,549 @@
+# Общее хранилище кешей. Резидентный раннер подставляет один и тот же словарь
+# во все скрипты; при обычном запуске на платформе оно живет в пределах вызова.
+try:
+    CACHE_STORE
+except NameError:
+    CACHE_STORE = {}
 
-def get_webhook_from_sheet(sheet_url, user_name):
+# Журнал команды. Сообщения пишутся через log_debug/log_info/log_warning/log_error
+# шаблоном с {} и списком значений: значения подставляются и обрезаются до
+# LOG_PAYLOAD_LIMIT символов, только если уровень сообщения включен, поэтому
+# отключенные отладочные сообщения не форматируют аргументы, поля и ответы Bitrix24.
+# Каждая строка помечается ID вызова, по которому собираются сообщения одной команды.
+# Уровень задается аргументом "log_level" или переменной LOG_LEVEL (ее подставляет
+# резидентный раннер по настройке логгера), по умолчанию "info".
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PAYLOAD_LIMIT = 300
+# Сообщения из циклов (log_sampled) пишутся первый раз и затем каждый LOG_SAMPLE_EVERY-й
+LOG_SAMPLE_EVERY = 100
+
+try:
+    LOG_LEVEL
+except NameError:
+    LOG_LEVEL = "info"
+
+LOG_CONTEXT = {"correlation_id": "-", "level": LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["info"]), "samples": {}}
+
+def start_log_context(command, args):
+    """Начинает журнал вызова: уровень из аргументов и новый ID вызова; вызывается в начале main()."""
+    level = str(args.get("log_level") or LOG_LEVEL).lower()
+    LOG_CONTEXT["level"] = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+    counter = CACHE_STORE.setdefault("log_counter", {"value": 0})
+    counter["value"] += 1
+    correlation_id = args.get("correlation_id") or f"{command}-{datetime.datetime.now().strftime('%H%M%S')}-{counter['value']}"
+    LOG_CONTEXT["correlation_id"] = str(correlation_id)
+    LOG_CONTEXT["samples"] = {}
+
+def log_enabled(level):
+    """Проверяет, включен ли уровень; нужна, когда значения для сообщения дорого вычислять."""
+    return LOG_LEVELS[level] >= LOG_CONTEXT["level"]
+
+def log_value(value):
+    """Строка для подстановки в сообщение: словари и списки в JSON, длинные значения обрезаются."""
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > LOG_PAYLOAD_LIMIT:
+        text = text[:LOG_PAYLOAD_LIMIT] + f"... (еще {len(text) - LOG_PAYLOAD_LIMIT} симв.)"
+    return text
+
+def log_message(level, message, values):
+    """Пишет сообщение уровня level, если он включен."""
+    if LOG_LEVELS[level] < LOG_CONTEXT["level"]:
+        return
+    if values:
+        parts = message.split("{}")
+        message = parts[0]
+        for position in range(1, len(parts)):
+            if position <= len(values):
+                message += log_value(values[position - 1])
+            else:
+                message += "{}"
+            message += parts[position]
+    debug(f"[{LOG_CONTEXT['correlation_id']}] {level.upper()} {message}")
+
+def log_debug(message, values=None):
+    log_message("debug", message, values)
+
+def log_info(message, values=None):
+    log_message("info", message, values)
+
+def log_warning(message, values=None):
+    log_message("warning", message, values)
+
+def log_error(message, values=None):
+    log_message("error", message, values)
+
+def log_sampled(key, message, values=None):
+    """Отладочное сообщение из цикла: пишется первое и каждое LOG_SAMPLE_EVERY-е с одним ключом."""
+    if LOG_LEVELS["debug"] < LOG_CONTEXT["level"]:
+        return
+    samples = LOG_CONTEXT["samples"]
+    count = samples.get(key, 0) + 1
+    samples[key] = count
+    if count == 1 or count % LOG_SAMPLE_EVERY == 0:
+        log_message("debug", message + f" [{key}: {count}]", values)
+
+# Проекции полей: для каждого метода Bitrix24 перечислены только те поля,
+# которые скрипт читает из ответа. b24_post подставляет эти параметры
+# в каждый вызов метода, если они не заданы явно.
+B24_FIELD_PROJECTIONS = {
+    "user.current": {"SELECT": ["ID"]},  # ID владельца проекта
+    "user.get": {"SELECT": ["ID", "NAME", "LAST_NAME", "SECOND_NAME"]},  # справочник пользователей для поиска по имени
+    "tasks.task.add": {"select": ["ID", "TITLE", "STATUS", "GROUP_ID"]},  # задачи шаблона для индекса задач
+}
+
+def apply_field_projection(method, params):
+    """Дополняет параметры вызова проекцией полей метода из B24_FIELD_PROJECTIONS."""
+    projection = B24_FIELD_PROJECTIONS.get(method)
+    if not projection:
+        return params
+    projected = dict(params or {})
+    for option in projection:
+        projected.setdefault(option, projection[option])
+    return projected
+
+# Предохранитель (circuit breaker) для каждого портала Bitrix24.
+# После серии ошибок или медленных ответов портал считается недоступным
+# на CIRCUIT_OPEN_SECONDS, запросы к нему сразу завершаются ошибкой,
+# затем пропускается один пробный запрос.
+B24_TIMEOUT = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW = 20
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_SLOW_SECONDS = 8
+CIRCUIT_OPEN_SECONDS = 30
+
+def get_circuit(portal_url):
+    """Возвращает состояние предохранителя портала, создавая его при первом обращении."""
+    circuits = CACHE_STORE.setdefault("circuit_breakers", {})
+    circuit = circuits.get(portal_url)
+    if circuit is None:
+        circuit = {"state": "closed", "failures": 0, "outcomes": [], "opened_at": None, "rejected": 0}
+        circuits[portal_url] = circuit
+    return circuit
+
+def circuit_allows_request(portal_url):
+    """Проверяет, можно ли сейчас отправить запрос на портал."""
+    circuit = get_circuit(portal_url)
+    if circuit["state"] == "closed":
+        return True
+    if circuit["state"] == "open":
+        if datetime.datetime.now() - circuit["opened_at"] >= datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS):
+            log_info("circuit_breaker: пробный запрос к порталу {}", [portal_url])
+            circuit["state"] = "half_open"
+            return True
+        return False
+    # half_open: пробный запрос уже отправлен, остальные ждут его результата
+    return False
+
+def record_circuit_outcome(portal_url, is_ok):
+    """Учитывает результат запроса и при необходимости размыкает или замыкает предохранитель."""
+    circuit = get_circuit(portal_url)
+    outcomes = circuit["outcomes"]
+    outcomes.append(is_ok)
+    if len(outcomes) > CIRCUIT_WINDOW:
+        del outcomes[0]
+
+    if is_ok:
+        circuit["failures"] = 0
+        if circuit["state"] != "closed":
+            log_info("circuit_breaker: портал {} снова доступен.", [portal_url])
+            circuit["state"] = "closed"
+            circuit["outcomes"] = [True]
+        return
+
+    circuit["failures"] += 1
+    error_rate = outcomes.count(False) / len(outcomes)
+    too_many_errors = len(outcomes) >= CIRCUIT_WINDOW // 2 and error_rate >= CIRCUIT_ERROR_RATE
+    if circuit["state"] == "half_open" or circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD or too_many_errors:
+        if circuit["state"] != "open":
+            log_warning("circuit_breaker: портал {} временно отключен (ошибок подряд: {}).", [portal_url, circuit['failures']])
+        circuit["state"] = "open"
+        circuit["opened_at"] = datetime.datetime.now()
+
+# Бюджет времени команды: NextBot ждет ответ скрипта ограниченное время, поэтому
+# вызов main() укладывается в COMMAND_BUDGET_SECONDS. Каждый запрос получает таймаут
+# не больше оставшегося времени, а когда времени не осталось, запрос не отправляется.
+COMMAND_BUDGET_SECONDS = 25
+BUDGET_MIN_TIMEOUT = 0.5
+LATENCY_BUDGET = {"deadline": None}
+
+def start_latency_budget(seconds=COMMAND_BUDGET_SECONDS):
+    """Начинает отсчет бюджета времени команды; вызывается в начале main()."""
+    LATENCY_BUDGET["deadline"] = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+def remaining_budget():
+    """Сколько секунд осталось до конца бюджета команды (None, если бюджет не задан)."""
+    deadline = LATENCY_BUDGET["deadline"]
+    if deadline is None:
+        return None
+    left = deadline - datetime.datetime.now()
+    return left.days * 86400 + left.seconds + left.microseconds / 1000000
+
+def budget_timeout(timeout):
+    """Урезает таймаут запроса до оставшегося бюджета; если бюджет исчерпан, выбрасывает requests.exceptions.Timeout."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining < BUDGET_MIN_TIMEOUT:
+        raise requests.exceptions.Timeout("Бюджет времени команды исчерпан, запрос не отправлен.")
+    return min(timeout, remaining)
+
+def b24_post(webhook_url, method, params=None, timeout=B24_TIMEOUT):
     """
-    Получает вебхук пользователя из опубликованной Google Таблицы CSV.
-    Формат таблицы: A - Имя, B - Вебхук.
+    Вызывает метод REST API Bitrix24 с таймаутом и через предохранитель портала.
+    Если портал временно отключен, сразу выбрасывает requests.exceptions.ConnectionError.
     """
-    debug(f"-> get_webhook_from_sheet: ищем вебхук для '{user_name}'")
+    portal_url = webhook_url.split('/rest/')[0]
+    # Таймаут считается до проверки предохранителя, чтобы не оставить пробный запрос неотправленным
+    timeout = budget_timeout(timeout)
+    if not circuit_allows_request(portal_url):
+        get_circuit(portal_url)["rejected"] += 1
+        raise requests.exceptions.ConnectionError(f"Портал {portal_url} временно недоступен, запрос {method} не отправлен.")
+
+    params = apply_field_projection(method, params)
+    started_at = datetime.datetime.now()
     try:
-        response = requests.get(sheet_url, timeout=5)
-        response.raise_for_status()
-        csv_data = response.text
-        lines = csv_data.strip().splitlines()
-
-        for line in lines:
-            if not line.strip(): continue
-            parts = line.strip().split(',')
-            if len(parts) >= 2:
-                sheet_user = parts[0].strip()
-                webhook = parts[1].strip()
-                webhook = ''.join(c for c in webhook if c.isprintable())
-                
-                if sheet_user == user_name:
-                    debug(f"<- get_webhook_from_sheet: Вебхук для '{user_name}' найден.")
-                    if not webhook.endswith('/'): webhook += '/'
-                    return webhook
-        
-        debug(f"<- get_webhook_from_sheet: Пользователь '{user_name}' НЕ найден в таблице.")
-        return None
+        response = requests.post(f"{webhook_url}{method}.json", json=params, timeout=timeout)
+    except Exception:
+        record_circuit_outcome(portal_url, False)
+        raise
+    is_slow = datetime.datetime.now() - started_at > datetime.timedelta(seconds=CIRCUIT_SLOW_SECONDS)
+    record_circuit_outcome(portal_url, response.status_code < 500 and not is_slow)
+    return response
+
+# Ключи для нечеткого поиска с учетом ошибок распознавания речи (как в скриптах задач).
+# Нужны, чтобы добавить новый проект в кешированный каталог проектов с теми же
+# ключами слов, с какими его строит get_project_index.
+RUSSIAN_ENDINGS = sorted((
+    "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему", "иях", "ях", "ах", "ов", "ев",
+    "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ию", "ия", "ии", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+TRANSLIT_MAP = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+PHONETIC_REPLACEMENTS = (
+    ("shch", "s"), ("sh", "s"), ("zh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("ph", "f"),
+    ("ck", "k"), ("x", "ks"), ("w", "v"), ("q", "k"), ("j", "i"), ("y", "i"),
+    ("b", "p"), ("v", "f"), ("g", "k"), ("d", "t"), ("z", "s"),
+)
+PHONETIC_VOWELS = "aeiou"
+
+def split_words(text):
+    """Нормализует текст и разбивает его на слова."""
+    if not isinstance(text, str) or not text:
+        return []
+    return re.sub(r'[^\w\s]', '', text).lower().replace('ё', 'е').split()
+
+def stem_word(word):
+    """Отбрасывает типичное русское окончание, если остается основа не короче трех букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def transliterate_word(word):
+    """Переводит кириллицу в латиницу, латиницу и цифры оставляет как есть."""
+    return ''.join(TRANSLIT_MAP.get(c, c) for c in word)
+
+def phonetic_code(latin_word):
+    """Грубый фонетический код: глухие и звонкие согласные совпадают, гласные после первой буквы отбрасываются."""
+    code = latin_word
+    for replacement in PHONETIC_REPLACEMENTS:
+        code = code.replace(replacement[0], replacement[1])
+    if not code:
+        return ""
+    result_chars = [code[0]]
+    for c in code[1:]:
+        if c not in PHONETIC_VOWELS and c != result_chars[-1]:
+            result_chars.append(c)
+    return ''.join(result_chars)
+
+def word_keys(word):
+    """Ключи слова для индекса: транслитерированная основа и фонетический код (если он не слишком короткий)."""
+    word_keys_cache = CACHE_STORE.setdefault("word_keys", {})
+    keys = word_keys_cache.get(word)
+    if keys is None:
+        latin_stem = transliterate_word(stem_word(word))
+        keys = ["t:" + latin_stem]
+        code = phonetic_code(latin_stem)
+        if len(code) >= 3:
+            keys.append("p:" + code)
+        if len(word_keys_cache) > 50000:
+            word_keys_cache.clear()
+        word_keys_cache[word] = keys
+    return keys
+
+# Индекс названий задач портала для нечеткого поиска: все задачи (кроме
+# удаленных в корзину) с разобранными словами названий, статусом и проектом.
+# Строится потоковым проходом по всем страницам tasks.task.list и живет в CACHE_STORE
+# TASK_INDEX_TTL_SECONDS. Изменения задач не сбрасывают индекс, а исправляют его
+# записи на месте по данным из ответа Bitrix24 (write-through).
+# Запись задачи - компактный кортеж (название, слова, статус, проект): слова
+# названий общие для всех порталов (одна строка на слово), статус и проект -
+# целые числа, остальные поля ответа не хранятся. Поэтому один резидентный
+# процесс держит в памяти индексы нескольких больших порталов.
+TASK_INDEX_TTL_SECONDS = 300
+# Индекс только незавершенных задач (фильтр "!STATUS": 5) кешируется под отдельным ключом
+TASK_INDEX_OPEN_SUFFIX = "|open"
+TASK_TITLE = 0
+TASK_WORDS = 1
+TASK_STATUS = 2
+TASK_GROUP = 3
+INTERNED_WORDS_LIMIT = 200000
+
+def intern_words(words):
+    """Кортеж слов, в котором одинаковые слова всех названий - один и тот же объект строки."""
+    interned = CACHE_STORE.setdefault("interned_words", {})
+    if len(interned) > INTERNED_WORDS_LIMIT:
+        interned.clear()
+    return tuple(interned.setdefault(word, word) for word in words)
+
+def put_task_record(index, task):
+    """Добавляет задачу в индекс или обновляет ее запись полями, которые есть в task."""
+    task_id = int(task.get("id"))
+    record = index["tasks"].get(task_id) or ("", (), 0, 0)
+    title = record[TASK_TITLE]
+    words = record[TASK_WORDS]
+    status = record[TASK_STATUS]
+    group_id = record[TASK_GROUP]
+    if task.get("title") is not None:
+        title = task["title"]
+        words = intern_words(split_words(title))
+    if task.get("status") is not None:
+        status = int(task["status"])
+    if task.get("groupId") is not None:
+        group_id = int(task["groupId"] or 0)
+    # Запись заменяется целиком: читатели индекса видят либо старую, либо новую версию
+    index["tasks"][task_id] = (title, words, status, group_id)
+
+def patch_task_index(webhook_url, task=None, deleted_task_id=None):
+    """
+    Исправляет индекс названий задач после изменения (write-through): task — задача
+    из ответа tasks.task.add/update, deleted_task_id — ID удаленной задачи.
+    Если индекс портала еще не построен, исправлять нечего.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    task_indexes = CACHE_STORE.get("task_index", {})
+    # Полный индекс и индекс незавершенных задач исправляются одинаково
+    for index_key in (portal_url, portal_url + TASK_INDEX_OPEN_SUFFIX):
+        index = task_indexes.get(index_key)
+        if not index:
+            continue
+        if deleted_task_id is not None:
+            index["tasks"].pop(int(deleted_task_id), None)
+            log_debug("patch_task_index: задача {} удалена из индекса {}.", [deleted_task_id, index_key])
+        if task and task.get("id"):
+            put_task_record(index, task)
+            if index_key != portal_url and index["tasks"][int(task["id"])][TASK_STATUS] == 5:
+                # Завершенная задача уходит из индекса незавершенных
+                index["tasks"].pop(int(task["id"]))
+            log_debug("patch_task_index: задача {} обновлена в индексе {}.", [task.get('id'), index_key])
+
+# Контекст диалога: недавно созданные и измененные задачи и проекты пользователя
+# (CACHE_STORE["session_context"]). Уточняющие команды вроде «поставь ей высокий
+# приоритет» или «перенеси эту задачу на завтра» находят задачу по нему, без
+# загрузки списка задач портала.
+SESSION_CONTEXT_TTL_SECONDS = 1800
+SESSION_CONTEXT_SIZE = 5
+
+def get_session_context(webhook_url, user_name):
+    """Возвращает контекст диалога пользователя на портале {"tasks": [...], "projects": [...]}."""
+    context_key = f"{webhook_url.split('/rest/')[0]}|{user_name}"
+    return CACHE_STORE.setdefault("session_context", {}).setdefault(context_key, {"tasks": [], "projects": []})
+
+def push_context_entry(entries, entry):
+    """
+    Ставит запись первой, дополняя ее пустые поля из прежней записи с тем же ID.
+    Возвращает новый список не длиннее SESSION_CONTEXT_SIZE: контекст могут читать параллельные команды.
+    """
+    for item in entries:
+        if item["id"] == entry["id"]:
+            for field in item:
+                if not entry.get(field):
+                    entry[field] = item[field]
+    entry["touched_at"] = datetime.datetime.now()
+    return ([entry] + [item for item in entries if item["id"] != entry["id"]])[:SESSION_CONTEXT_SIZE]
+
+def remember_project(webhook_url, user_name, project_id, project_name=None):
+    """Запоминает проект как последний упомянутый в диалоге."""
+    context = get_session_context(webhook_url, user_name)
+    context["projects"] = push_context_entry(context["projects"], {"id": int(project_id), "name": project_name or ""})
+
+# Хранилище учетных данных: вебхуки ищутся в локальном индексе
+# CACHE_STORE["credentials"] ({имя: [вебхуки порталов]}). Резидентный раннер
+# заполняет его из своего хранилища (SQLite, JSON, окружение) и тогда таблица
+# не читается вовсе; иначе индекс импортируется из Google Таблицы, не чаще
+# раза в WEBHOOK_SHEET_SYNC_SECONDS.
+WEBHOOK_SHEET_SYNC_SECONDS = 300
+
+def normalize_webhook(webhook):
+    """Убирает непечатаемые символы и добавляет завершающий '/'."""
+    webhook = ''.join(c for c in webhook.strip() if c.isprintable())
+    if not webhook.endswith('/'): webhook += '/'
+    return webhook
+
+def parse_webhook_sheet(csv_data):
+    """
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в словарь {имя: [вебхуки]}.
+    У пользователя, работающего на нескольких порталах, несколько строк;
+    первая строка задает основной портал.
+    """
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        if not line.strip(): continue
+        parts = line.strip().split(',')
+        if len(parts) >= 2:
+            sheet_user = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if sheet_user and webhook != '/':
+                user_webhooks = webhooks.setdefault(sheet_user, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+def get_credential_index():
+    """Возвращает индекс учетных данных, создавая пустой индекс с импортом из таблицы."""
+    credentials = CACHE_STORE.get("credentials")
+    if credentials is None:
+        credentials = {"source": "sheet", "webhooks": {}, "synced_at": None}
+        CACHE_STORE["credentials"] = credentials
+    return credentials
+
+def sync_webhooks_from_sheet(sheet_url, credentials):
+    """Загружает опубликованную Google Таблицу CSV и заменяет ею индекс вебхуков."""
+    response = requests.get(sheet_url, timeout=budget_timeout(5))
+    response.raise_for_status()
+    credentials["webhooks"] = parse_webhook_sheet(response.text)
+    credentials["synced_at"] = datetime.datetime.now()
+
+def find_user_webhooks(sheet_url, user_name):
+    """
+    Возвращает все вебхуки пользователя (основной первым) из хранилища учетных данных.
+    Google Таблица служит только источником для импорта: она читается,
+    если индекс пуст или пользователь не найден, а с прошлой загрузки
+    прошло больше WEBHOOK_SHEET_SYNC_SECONDS.
+    """
+    credentials = get_credential_index()
+    user_webhooks = credentials["webhooks"].get(user_name)
+    if user_webhooks:
+        log_debug("<- find_user_webhooks: Вебхуки для '{}' найдены в индексе ({}).", [user_name, credentials['source']])
+        return user_webhooks
+    if credentials["source"] != "sheet":
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден в хранилище {}.", [user_name, credentials['source']])
+        return []
+
+    synced_at = credentials["synced_at"]
+    if synced_at is not None and datetime.datetime.now() - synced_at < datetime.timedelta(seconds=WEBHOOK_SHEET_SYNC_SECONDS):
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден, таблица загружена недавно.", [user_name])
+        return []
+    try:
+        sync_webhooks_from_sheet(sheet_url, credentials)
     except Exception as e:
-        debug(f"<- get_webhook_from_sheet: Ошибка при доступе к Google Sheets: {e}")
-        return None
+        log_error("<- find_user_webhooks: Ошибка при доступе к Google Sheets: {}", [e])
+        return []
+
+    user_webhooks = credentials["webhooks"].get(user_name) or []
+    log_debug("<- find_user_webhooks: Для '{}' в таблице найдено вебхуков: {}.", [user_name, len(user_webhooks)])
+    return user_webhooks
+
+def get_webhook_from_sheet(sheet_url, user_name):
+    """Получает основной вебхук пользователя (см. find_user_webhooks)."""
+    log_debug("-> get_webhook_from_sheet: ищем вебхук для '{}'", [user_name])
+    user_webhooks = find_user_webhooks(sheet_url, user_name)
+    if user_webhooks:
+        return user_webhooks[0]
+    return None
 
 def get_current_user_id(webhook_url):
     """Получает ID пользователя, которому принадлежит вебхук."""
-    debug("-> get_current_user_id: запрашиваем данные текущего пользователя")
-    url = f"{webhook_url}user.current.json"
+    log_debug("-> get_current_user_id: запрашиваем данные текущего пользователя")
     try:
-        response = requests.post(url, timeout=5)
+        response = b24_post(webhook_url, "user.current", timeout=5)
         response.raise_for_status()
         result = response.json().get("result", {})
         user_id = result.get("ID")
         if user_id:
-            debug(f"<- get_current_user_id: ID текущего пользователя: {user_id}")
+            log_debug("<- get_current_user_id: ID текущего пользователя: {}", [user_id])
             return int(user_id)
         else:
-            debug("<- get_current_user_id: Не удалось получить ID из ответа.")
+            log_debug("<- get_current_user_id: Не удалось получить ID из ответа.")
             return None
     except Exception as e:
-        debug(f"<- get_current_user_id: Ошибка при получении данных пользователя: {e}")
+        log_error("<- get_current_user_id: Ошибка при получении данных пользователя: {}", [e])
         return None
 
+# Справочник пользователей портала: все страницы user.get (по 50 пользователей, курсор
+# next) раз в USER_DIRECTORY_TTL_SECONDS, по нему ищутся руководители, участники
+# и исполнители ролей шаблона.
+# Пользователь хранится кортежем (ID, имя, фамилия, отчество).
+USER_DIRECTORY_TTL_SECONDS = 600
+
+def get_user_directory(webhook_url):
+    """Возвращает список пользователей портала, кешированный в CACHE_STORE."""
+    portal_url = webhook_url.split('/rest/')[0]
+    directories = CACHE_STORE.setdefault("user_directory", {})
+    directory = directories.get(portal_url)
+    now = datetime.datetime.now()
+    if directory and now - directory["loaded_at"] < datetime.timedelta(seconds=USER_DIRECTORY_TTL_SECONDS):
+        return directory["users"]
+
+    # Из ответа остаются только компактные записи (ID, имя, фамилия, отчество) в нижнем регистре
+    users = []
+    start = 0
+    while start is not None:
+        response = b24_post(webhook_url, "user.get", {"start": start}, timeout=5)
+        response.raise_for_status()
+        page = response.json()
+        for user in page.get("result", []):
+            users.append((int(user["ID"]), (user.get("NAME") or "").lower(), (user.get("LAST_NAME") or "").lower(),
+                          (user.get("SECOND_NAME") or "").lower()))
+        start = page.get("next")
+    log_debug("get_user_directory: пользователей портала: {}", [len(users)])
+    directories[portal_url] = {"users": users, "loaded_at": now}
+    return users
+
+def find_user_id_in_directory(users, name):
+    """Ищет ID пользователя по имени, фамилии или отчеству (частичное совпадение)."""
+    name_lower = name.lower()
+    for user in users:
+        if name_lower in user[1] or name_lower in user[2] or name_lower in user[3]:
+            return user[0]
+    return None
+
 def find_user_ids_by_names(webhook_url, names):
     """Находит ID пользователей по их именам."""
-    debug(f"-> find_user_ids_by_names: ищем пользователей: {names}")
+    log_debug("-> find_user_ids_by_names: ищем пользователей: {}", [names])
     if not names:
         return []
     
-    url = f"{webhook_url}user.get.json"
     try:
-        response = requests.post(url, timeout=5)
-        response.raise_for_status()
-        users = response.json().get("result", [])
+        users = get_user_directory(webhook_url)
         
         found_ids = []
         for name in names:
-            name_lower = name.lower()
-            for user in users:
-                if (name_lower in user.get("NAME", "").lower() or 
-                    name_lower in user.get("LAST_NAME", "").lower() or 
-                    name_lower in user.get("SECOND_NAME", "").lower()):
-                    found_ids.append(int(user["ID"]))
-                    break
+            user_id = find_user_id_in_directory(users, name)
+            if user_id:
+                found_ids.append(user_id)
         
-        debug(f"<- find_user_ids_by_names: найдены ID: {found_ids}")
+        log_debug("<- find_user_ids_by_names: найдены ID: {}", [found_ids])
         return found_ids
     except Exception as e:
-        debug(f"<- find_user_ids_by_names: Ошибка при поиске пользователей: {e}")
+        log_error("<- find_user_ids_by_names: Ошибка при поиске пользователей: {}", [e])
         return []
 
 def create_b24_project(webhook_url, fields):
     """Создает проект в Bitrix24 и возвращает его ID и ссылку."""
-    debug(f"-> create_b24_project: с полями {fields}")
-    url = f"{webhook_url}sonet_group.create.json"
+    log_debug("-> create_b24_project: с полями {}", [fields])
     params = {"fields": fields}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook_url, "sonet_group.create", params)
         response.raise_for_status()
         result_json = response.json()
         if "result" in result_json:
@@ -91,19 +551,293 @@ def create_b24_project(webhook_url, fields):
             if project_id:
                 portal_url = webhook_url.split('/rest/')[0]
                 project_link = f"{portal_url}/workgroups/group/{project_id}/"
-                debug(f"<- create_b24_project: проект создан, ID: {project_id}, ссылка: {project_link}")
+                log_info("<- create_b24_project: проект создан, ID: {}, ссылка: {}", [project_id, project_link])
+                patch_project_index(webhook_url, project_id, fields.get("NAME"))
                 return project_id, project_link
     except Exception as e:
-        debug(f"<- create_b24_project: ОШИБКА API: {e}")
-        debug(f"Ответ от сервера: {response.text}")
+        log_error("<- create_b24_project: ОШИБКА API: {}", [e])
+        if 'response' in locals() and hasattr(response, 'text'):
+            log_error("Ответ от сервера: {}", [response.text])
     
-    debug("<- create_b24_project: не удалось создать проект, возвращает None, None")
+    log_debug("<- create_b24_project: не удалось создать проект, возвращает None, None")
     return None, None
 
+def patch_project_index(webhook_url, project_id, project_name):
+    """
+    Добавляет созданный проект в кешированный каталог проектов портала (write-through),
+    чтобы он сразу находился по имени без повторной загрузки всего каталога.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    index = CACHE_STORE.get("project_index", {}).get(portal_url)
+    if not index or not project_name:
+        return
+    project_id = int(project_id)
+    index["names"][project_id] = project_name
+    index["position"][project_id] = len(index["position"])
+    for word in set(split_words(project_name)):
+        for key in word_keys(word):
+            index["keys"].setdefault(key, set()).add(project_id)
+    log_debug("patch_project_index: проект {} добавлен в каталог портала {}.", [project_id, portal_url])
+
+def invalidate_task_listings(webhook_url):
+    """Сбрасывает кеш списков задач и дайджесты show_task для портала после изменения задач."""
+    portal_url = webhook_url.split('/rest/')[0]
+    CACHE_STORE.get("show_task", {}).pop(portal_url, None)
+    CACHE_STORE.get("show_task_digests", {}).pop(portal_url, None)
+    # Новое поколение не дает фоновым обновлениям, начатым до сброса, записать старый ответ
+    generations = CACHE_STORE.setdefault("show_task_generation", {})
+    generations[portal_url] = generations.get(portal_url, 0) + 1
+    log_debug("invalidate_task_listings: кеш списков задач портала {} сброшен.", [portal_url])
+
+# Шаблоны проектов: список задач со сроком в днях от сегодняшнего дня и ролью
+# исполнителя. Роли "руководитель" и "владелец" назначаются автоматически,
+# остальные - по аргументу roles ({"дизайнер": "Анна"}).
+PROJECT_TEMPLATES = {
+    "запуск сайта": [
+        {"title": "Собрать требования к сайту", "days": 3, "role": "руководитель"},
+        {"title": "Подготовить структуру и прототип", "days": 7, "role": "руководитель"},
+        {"title": "Нарисовать макеты страниц", "days": 14, "role": "дизайнер"},
+        {"title": "Сверстать и запрограммировать страницы", "days": 24, "role": "разработчик"},
+        {"title": "Наполнить сайт контентом", "days": 26, "role": "контент-менеджер"},
+        {"title": "Протестировать сайт", "days": 28, "role": "тестировщик"},
+        {"title": "Запустить сайт", "days": 30, "role": "руководитель"},
+    ],
+    "маркетинговая кампания": [
+        {"title": "Определить цели и бюджет кампании", "days": 2, "role": "руководитель"},
+        {"title": "Подготовить медиаплан", "days": 5, "role": "маркетолог"},
+        {"title": "Подготовить креативы", "days": 10, "role": "дизайнер"},
+        {"title": "Запустить рекламу", "days": 12, "role": "маркетолог"},
+        {"title": "Подготовить отчет по кампании", "days": 30, "role": "маркетолог"},
+    ],
+    "мероприятие": [
+        {"title": "Согласовать программу мероприятия", "days": 3, "role": "руководитель"},
+        {"title": "Забронировать площадку", "days": 5, "role": "администратор"},
+        {"title": "Разослать приглашения", "days": 7, "role": "маркетолог"},
+        {"title": "Заказать печать и оформление", "days": 10, "role": "дизайнер"},
+        {"title": "Провести мероприятие", "days": 14, "role": "руководитель"},
+        {"title": "Собрать обратную связь", "days": 16, "role": "администратор"},
+    ],
+}
+OWNER_ROLES = ("владелец", "я")
+DIRECTOR_ROLES = ("руководитель",)
+# Метод batch Bitrix24 выполняет не больше 50 команд за вызов
+BATCH_MAX_COMMANDS = 50
+URL_SAFE_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~$[]"
+
+def url_quote(value):
+    """Кодирует значение для строки запроса команды batch (UTF-8, percent-encoding)."""
+    encoded = []
+    for c in str(value):
+        if c in URL_SAFE_CHARS:
+            encoded.append(c)
+        else:
+            for byte in c.encode("utf-8"):
+                encoded.append(f"%{byte:02X}")
+    return "".join(encoded)
+
+def flatten_query_params(prefix, value, pairs):
+    """Разворачивает вложенные параметры в пары вида fields[TITLE]=... для batch."""
+    if isinstance(value, dict):
+        for key in value:
+            flatten_query_params(f"{prefix}[{key}]" if prefix else str(key), value[key], pairs)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            item = value[index]
+            flatten_query_params(f"{prefix}[{index}]", item, pairs)
+    else:
+        pairs.append(f"{url_quote(prefix)}={url_quote(value)}")
+
+def build_batch_command(method, params):
+    """Строка команды batch "метод?параметры" с проекцией полей метода."""
+    pairs = []
+    flatten_query_params("", apply_field_projection(method, params) or {}, pairs)
+    return f"{method}?{'&'.join(pairs)}"
+
+def call_batch(webhook_url, commands, halt=0):
+    """
+    Выполняет список команд [{"key", "method", "params"}] одним вызовом batch.
+    Команды выполняются по порядку и могут ссылаться на результаты предыдущих
+    через $result[ключ][...]. С halt=1 пакет останавливается на первой ошибке:
+    команды после нее не выполняются и не попадают ни в результаты, ни в ошибки.
+    Возвращает словари результатов и ошибок по ключам.
+    """
+    log_debug("-> call_batch: команд: {}", [len(commands)])
+    cmd = {}
+    for command in commands:
+        cmd[command["key"]] = build_batch_command(command["method"], command["params"])
+    response = b24_post(webhook_url, "batch", {"halt": halt, "cmd": cmd}, timeout=30)
+    response.raise_for_status()
+    result_json = response.json()
+    if "error" in result_json:
+        raise ValueError(result_json.get("error_description") or result_json["error"])
+    batch_result = result_json.get("result", {})
+    results = batch_result.get("result") or {}
+    errors = batch_result.get("result_error") or {}
+    # Пустые результаты Bitrix24 отдает списком, а не словарем
+    if isinstance(results, list):
+        results = {}
+    if isinstance(errors, list):
+        errors = {}
+    log_debug("<- call_batch: успешно: {}, ошибок: {}", [len(results), len(errors)])
+    return {"results": results, "errors": errors}
+
+def load_json_argument(value):
+    """NextBot может передать словарь или список JSON-строкой."""
+    if isinstance(value, str) and value.strip()[:1] in ("{", "["):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+def find_project_template(template):
+    """
+    Возвращает список задач шаблона: переданный в args (список или {"tasks": [...]})
+    или встроенный из PROJECT_TEMPLATES по похожему названию. None, если шаблон не найден.
+    """
+    template = load_json_argument(template)
+    if isinstance(template, dict):
+        template = template.get("tasks")
+    if isinstance(template, list):
+        return [item for item in template if isinstance(item, dict) and item.get("title")]
+    if not isinstance(template, str):
+        return None
+
+    # Название встроенного шаблона сравнивается по ключам слов, как названия проектов
+    query_keys = set()
+    for word in split_words(template):
+        query_keys.update(word_keys(word))
+    best_name = None
+    best_count = 0
+    for name in PROJECT_TEMPLATES:
+        name_keys = set()
+        for word in split_words(name):
+            name_keys.update(word_keys(word))
+        common_count = len(query_keys & name_keys)
+        if common_count > best_count:
+            best_count = common_count
+            best_name = name
+    log_debug("find_project_template: '{}' -> {}", [template, best_name])
+    return PROJECT_TEMPLATES[best_name] if best_name else None
+
+def relative_deadline(days):
+    """Срок через days дней в 18:00 в формате Bitrix24."""
+    deadline_dt = (datetime.datetime.now() + datetime.timedelta(days=int(days))).replace(hour=18, minute=0, second=0)
+    return (f"{deadline_dt.year:04d}-{deadline_dt.month:02d}-{deadline_dt.day:02d}"
+            f"T{deadline_dt.hour:02d}:{deadline_dt.minute:02d}:{deadline_dt.second:02d}")
+
+def resolve_template_roles(webhook_url, template_tasks, roles, owner_id, director_id, warnings):
+    """
+    Сопоставляет роли задач шаблона с ID пользователей по справочнику портала.
+    Неназначенные роли и ненайденные исполнители достаются руководителю проекта.
+    """
+    role_ids = {}
+    for role in OWNER_ROLES:
+        role_ids[role] = owner_id
+    for role in DIRECTOR_ROLES:
+        role_ids[role] = director_id
+
+    users = []
+    if roles:
+        try:
+            users = get_user_directory(webhook_url)
+        except Exception as e:
+            log_warning("resolve_template_roles: справочник пользователей недоступен: {}", [e])
+    for role in roles:
+        user_id = find_user_id_in_directory(users, str(roles[role])) if users else None
+        if user_id:
+            role_ids[str(role).lower().strip()] = user_id
+        else:
+            warnings.append(f"пользователь '{roles[role]}' для роли '{role}' не найден")
+
+    for item in template_tasks:
+        role = str(item.get("role") or "руководитель").lower().strip()
+        if role not in role_ids:
+            warnings.append(f"роль '{role}' не назначена, задачи поставлены руководителю")
+            role_ids[role] = director_id
+    return role_ids
+
+def provision_b24_project(webhook_url, fields, template_tasks, role_ids):
+    """
+    Создает проект и задачи шаблона пакетами batch. Первый пакет создает группу
+    (sonet_group.create) и задачи, ссылающиеся на нее через $result[project];
+    следующие пакеты, если задач больше 49, используют уже известный ID группы.
+    Первый пакет останавливается на первой ошибке (halt=1): если группа не создана,
+    задачи шаблона не создаются вовсе, а не появляются личными задачами без проекта.
+    Возвращает {"project_id", "project_link", "tasks", "warnings"} или None, если проект не создан.
+    """
+    log_debug("-> provision_b24_project: проект '{}', задач шаблона: {}", [fields.get('NAME'), len(template_tasks)])
+    task_commands = []
+    for index in range(len(template_tasks)):
+        item = template_tasks[index]
+        role = str(item.get("role") or "руководитель").lower().strip()
+        task_fields = {
+            "TITLE": item["title"],
+            "DESCRIPTION": item.get("description", ""),
+            "RESPONSIBLE_ID": role_ids[role],
+        }
+        if str(item.get("days", "")).strip().lstrip("-").isdigit():
+            task_fields["DEADLINE"] = relative_deadline(item["days"])
+        task_commands.append({"key": f"task_{index}", "method": "tasks.task.add", "params": {"fields": task_fields}})
+
+    project_id = None
+    created_tasks = []
+    warnings = []
+    chunk = [{"key": "project", "method": "sonet_group.create", "params": {"fields": fields}}]
+    queue = task_commands
+    while True:
+        group_ref = "$result[project]" if project_id is None else project_id
+        while queue and len(chunk) < BATCH_MAX_COMMANDS:
+            command = queue.pop(0)
+            command["params"]["fields"]["GROUP_ID"] = group_ref
+            chunk.append(command)
+        halt = 1 if project_id is None else 0
+        try:
+            batch = call_batch(webhook_url, chunk, halt)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error("<- provision_b24_project: ОШИБКА API: {}", [e])
+            if project_id is None:
+                return None
+            failed_count = len(queue) + len([command for command in chunk if command["method"] == "tasks.task.add"])
+            warnings.append(f"не созданы задачи шаблона: {failed_count}")
+            break
+
+        if project_id is None:
+            project_id = batch["results"].get("project")
+            if not project_id:
+                error = batch["errors"].get("project") or {}
+                log_warning("<- provision_b24_project: проект не создан: {}", [error.get('error_description')])
+                return None
+            patch_project_index(webhook_url, project_id, fields.get("NAME"))
+        skipped = []
+        for command in chunk:
+            if command["method"] != "tasks.task.add":
+                continue
+            task = (batch["results"].get(command["key"]) or {}).get("task") or {}
+            if task.get("id"):
+                created_tasks.append(int(task["id"]))
+                patch_task_index(webhook_url, task)
+            elif halt and command["key"] not in batch["errors"]:
+                # Пакет остановился на ошибке другой задачи: эта уйдет в следующий пакет
+                skipped.append(command)
+            else:
+                warnings.append(f"задача '{command['params']['fields']['TITLE']}' не создана")
+        queue = skipped + queue
+        if not queue:
+            break
+        chunk = []
+
+    portal_url = webhook_url.split('/rest/')[0]
+    project_link = f"{portal_url}/workgroups/group/{project_id}/"
+    log_info("<- provision_b24_project: проект {}, задач создано: {}", [project_id, len(created_tasks)])
+    return {"project_id": project_id, "project_link": project_link, "tasks": created_tasks, "warnings": warnings}
+
 def main(args):
     """Основная функция для создания проекта."""
-    debug("--- Запуск функции create_project ---")
-    debug(f"Получены аргументы от NextBot: {args}")
+    start_log_context("create_project", args)
+    start_latency_budget()
+    log_info("--- Запуск функции create_project ---")
+    log_debug("Получены аргументы от NextBot: {}", [args])
 
     GSHEET_URL = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv"
     user_name = args.get("nameUser")
@@ -143,6 +877,13 @@ def main(args):
         if not team_ids:
             return {"result": "error", "message": "Не удалось найти указанных участников команды."}
 
+    # Шаблон проекта: задачи с относительными сроками и ролями исполнителей
+    template_tasks = None
+    if args.get("template"):
+        template_tasks = find_project_template(args.get("template"))
+        if not template_tasks:
+            return {"result": "error", "message": f"Шаблон проекта '{args.get('template')}' не найден."}
+
     # Создаем проект
     fields = {
         "NAME": project_name,
@@ -158,11 +899,36 @@ def main(args):
         "MEMBERS": director_ids + team_ids
     }
 
+    if template_tasks:
+        warnings = []
+        roles = load_json_argument(args.get("roles")) or {}
+        if not isinstance(roles, dict):
+            roles = {}
+        role_ids = resolve_template_roles(webhook_url, template_tasks, roles, current_user_id, director_ids[0], warnings)
+        for role in roles:
+            role_id = role_ids.get(str(role).lower().strip())
+            if role_id and role_id not in fields["MEMBERS"]:
+                fields["MEMBERS"].append(role_id)
+        provisioned = provision_b24_project(webhook_url, fields, template_tasks, role_ids)
+        if not provisioned:
+            return {"result": "error", "message": "Произошла ошибка при создании проекта в Bitrix24."}
+        invalidate_task_listings(webhook_url)
+        remember_project(webhook_url, user_name, provisioned["project_id"], project_name)
+        warnings.extend(provisioned["warnings"])
+        success_message = (f"✅ Проект «{project_name}» успешно создан!\\n"
+                           f"📋 Задач по шаблону: {len(provisioned['tasks'])} из {len(template_tasks)}"
+                           f"\\n\\n🔗 Ссылка: {provisioned['project_link']}")
+        answer = {"result": "success", "message": success_message, "task_ids": provisioned["tasks"]}
+        if warnings:
+            answer["warnings"] = warnings
+        return answer
+
     project_result = create_b24_project(webhook_url, fields)
     project_id = project_result[0]
     project_link = project_result[1]
     
     if project_id and project_link:
+        remember_project(webhook_url, user_name, project_id, project_name)
         success_message = f"✅ Проект «{project_name}» успешно создан!\\n\\n🔗 Ссылка: {project_link}"
         return {"result": "success", "message": success_message}
     else:
@@ -12,77 +12,544 @@ REVERSE_STATUS_MAP = {v: k for k, v in STATUS_MAP.items()}
 # Я скопировал их из другого файла для согласованности.
 # ...
 
-def get_webhook_from_sheet(sheet_url, user_name):
+# Кеш готовых списков задач (stale-while-revalidate).
+# Пока ответ моложе SHOW_TASK_FRESH_SECONDS, он отдается как есть.
+# До SHOW_TASK_STALE_SECONDS отдается сразу, но ставится в очередь на обновление.
+SHOW_TASK_FRESH_SECONDS = 60
+SHOW_TASK_STALE_SECONDS = 600
+# Если портал недоступен, сохраненный ответ отдается с пометкой до суток
+SHOW_TASK_DEGRADED_SECONDS = 86400
+# Дайджесты «сегодня», «завтра» и «просроченные» заранее строит планировщик
+# резидентного раннера (nextbot_runner.digests); готовый дайджест отдается без
+# обращений к Bitrix24, пока он моложе SHOW_TASK_DIGEST_SECONDS и построен сегодня.
+SHOW_TASK_DIGEST_SECONDS = 1800
+# Необязательные запросы (названия проектов, имена ответственных) выполняются,
+# только пока до конца бюджета команды больше SHOW_TASK_ENRICH_RESERVE_SECONDS;
+# иначе они берутся из кеша прошлых вызовов или пропускаются с пометкой "degraded".
+SHOW_TASK_ENRICH_RESERVE_SECONDS = 3
+
+# Общее хранилище кешей. Резидентный раннер подставляет один и тот же словарь
+# во все скрипты; при обычном запуске на платформе оно живет в пределах вызова.
+try:
+    CACHE_STORE
+except NameError:
+    CACHE_STORE = {}
+
+# Журнал команды. Сообщения пишутся через log_debug/log_info/log_warning/log_error
+# шаблоном с {} и списком значений: значения подставляются и обрезаются до
+# LOG_PAYLOAD_LIMIT символов, только если уровень сообщения включен, поэтому
+# отключенные отладочные сообщения не форматируют аргументы, поля и ответы Bitrix24.
+# Каждая строка помечается ID вызова, по которому собираются сообщения одной команды.
+# Уровень задается аргументом "log_level" или переменной LOG_LEVEL (ее подставляет
+# резидентный раннер по настройке логгера), по умолчанию "info".
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PAYLOAD_LIMIT = 300
+# Сообщения из циклов (log_sampled) пишутся первый раз и затем каждый LOG_SAMPLE_EVERY-й
+LOG_SAMPLE_EVERY = 100
+
+try:
+    LOG_LEVEL
+except NameError:
+    LOG_LEVEL = "info"
+
+LOG_CONTEXT = {"correlation_id": "-", "level": LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["info"]), "samples": {}}
+
+def start_log_context(command, args):
+    """Начинает журнал вызова: уровень из аргументов и новый ID вызова; вызывается в начале main()."""
+    level = str(args.get("log_level") or LOG_LEVEL).lower()
+    LOG_CONTEXT["level"] = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+    counter = CACHE_STORE.setdefault("log_counter", {"value": 0})
+    counter["value"] += 1
+    correlation_id = args.get("correlation_id") or f"{command}-{datetime.datetime.now().strftime('%H%M%S')}-{counter['value']}"
+    LOG_CONTEXT["correlation_id"] = str(correlation_id)
+    LOG_CONTEXT["samples"] = {}
+
+def log_enabled(level):
+    """Проверяет, включен ли уровень; нужна, когда значения для сообщения дорого вычислять."""
+    return LOG_LEVELS[level] >= LOG_CONTEXT["level"]
+
+def log_value(value):
+    """Строка для подстановки в сообщение: словари и списки в JSON, длинные значения обрезаются."""
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > LOG_PAYLOAD_LIMIT:
+        text = text[:LOG_PAYLOAD_LIMIT] + f"... (еще {len(text) - LOG_PAYLOAD_LIMIT} симв.)"
+    return text
+
+def log_message(level, message, values):
+    """Пишет сообщение уровня level, если он включен."""
+    if LOG_LEVELS[level] < LOG_CONTEXT["level"]:
+        return
+    if values:
+        parts = message.split("{}")
+        message = parts[0]
+        for position in range(1, len(parts)):
+            if position <= len(values):
+                message += log_value(values[position - 1])
+            else:
+                message += "{}"
+            message += parts[position]
+    debug(f"[{LOG_CONTEXT['correlation_id']}] {level.upper()} {message}")
+
+def log_debug(message, values=None):
+    log_message("debug", message, values)
+
+def log_info(message, values=None):
+    log_message("info", message, values)
+
+def log_warning(message, values=None):
+    log_message("warning", message, values)
+
+def log_error(message, values=None):
+    log_message("error", message, values)
+
+def log_sampled(key, message, values=None):
+    """Отладочное сообщение из цикла: пишется первое и каждое LOG_SAMPLE_EVERY-е с одним ключом."""
+    if LOG_LEVELS["debug"] < LOG_CONTEXT["level"]:
+        return
+    samples = LOG_CONTEXT["samples"]
+    count = samples.get(key, 0) + 1
+    samples[key] = count
+    if count == 1 or count % LOG_SAMPLE_EVERY == 0:
+        log_message("debug", message + f" [{key}: {count}]", values)
+
+# Проекции полей: для каждого метода Bitrix24 перечислены только те поля,
+# которые скрипт читает из ответа. b24_post подставляет эти параметры
+# в каждый вызов метода, если они не заданы явно.
+B24_FIELD_PROJECTIONS = {
+    "sonet_group.get": {"SELECT": ["ID", "NAME"]},  # названия проектов
+    "user.get": {"SELECT": ["ID", "NAME", "LAST_NAME"]},  # имя ответственного
+    "tasks.task.list": {"select": ["ID", "TITLE", "DESCRIPTION", "DEADLINE", "STATUS", "RESPONSIBLE_ID", "GROUP_ID"]},  # карточки задач в списке
+}
+
+def apply_field_projection(method, params):
+    """Дополняет параметры вызова проекцией полей метода из B24_FIELD_PROJECTIONS."""
+    projection = B24_FIELD_PROJECTIONS.get(method)
+    if not projection:
+        return params
+    projected = dict(params or {})
+    for option in projection:
+        projected.setdefault(option, projection[option])
+    return projected
+
+# Предохранитель (circuit breaker) для каждого портала Bitrix24.
+# После серии ошибок или медленных ответов портал считается недоступным
+# на CIRCUIT_OPEN_SECONDS, запросы к нему сразу завершаются ошибкой,
+# затем пропускается один пробный запрос.
+B24_TIMEOUT = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW = 20
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_SLOW_SECONDS = 8
+CIRCUIT_OPEN_SECONDS = 30
+
+def get_circuit(portal_url):
+    """Возвращает состояние предохранителя портала, создавая его при первом обращении."""
+    circuits = CACHE_STORE.setdefault("circuit_breakers", {})
+    circuit = circuits.get(portal_url)
+    if circuit is None:
+        circuit = {"state": "closed", "failures": 0, "outcomes": [], "opened_at": None, "rejected": 0}
+        circuits[portal_url] = circuit
+    return circuit
+
+def circuit_allows_request(portal_url):
+    """Проверяет, можно ли сейчас отправить запрос на портал."""
+    circuit = get_circuit(portal_url)
+    if circuit["state"] == "closed":
+        return True
+    if circuit["state"] == "open":
+        if datetime.datetime.now() - circuit["opened_at"] >= datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS):
+            log_info("circuit_breaker: пробный запрос к порталу {}", [portal_url])
+            circuit["state"] = "half_open"
+            return True
+        return False
+    # half_open: пробный запрос уже отправлен, остальные ждут его результата
+    return False
+
+def record_circuit_outcome(portal_url, is_ok):
+    """Учитывает результат запроса и при необходимости размыкает или замыкает предохранитель."""
+    circuit = get_circuit(portal_url)
+    outcomes = circuit["outcomes"]
+    outcomes.append(is_ok)
+    if len(outcomes) > CIRCUIT_WINDOW:
+        del outcomes[0]
+
+    if is_ok:
+        circuit["failures"] = 0
+        if circuit["state"] != "closed":
+            log_info("circuit_breaker: портал {} снова доступен.", [portal_url])
+            circuit["state"] = "closed"
+            circuit["outcomes"] = [True]
+        return
+
+    circuit["failures"] += 1
+    error_rate = outcomes.count(False) / len(outcomes)
+    too_many_errors = len(outcomes) >= CIRCUIT_WINDOW // 2 and error_rate >= CIRCUIT_ERROR_RATE
+    if circuit["state"] == "half_open" or circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD or too_many_errors:
+        if circuit["state"] != "open":
+            log_warning("circuit_breaker: портал {} временно отключен (ошибок подряд: {}).", [portal_url, circuit['failures']])
+        circuit["state"] = "open"
+        circuit["opened_at"] = datetime.datetime.now()
+
+# Бюджет времени команды: NextBot ждет ответ скрипта ограниченное время, поэтому
+# вызов main() укладывается в COMMAND_BUDGET_SECONDS. Каждый запрос получает таймаут
+# не больше оставшегося времени, а когда времени не осталось, запрос не отправляется.
+COMMAND_BUDGET_SECONDS = 25
+BUDGET_MIN_TIMEOUT = 0.5
+LATENCY_BUDGET = {"deadline": None}
+
+def start_latency_budget(seconds=COMMAND_BUDGET_SECONDS):
+    """Начинает отсчет бюджета времени команды; вызывается в начале main()."""
+    LATENCY_BUDGET["deadline"] = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+def remaining_budget():
+    """Сколько секунд осталось до конца бюджета команды (None, если бюджет не задан)."""
+    deadline = LATENCY_BUDGET["deadline"]
+    if deadline is None:
+        return None
+    left = deadline - datetime.datetime.now()
+    return left.days * 86400 + left.seconds + left.microseconds / 1000000
+
+def budget_timeout(timeout):
+    """Урезает таймаут запроса до оставшегося бюджета; если бюджет исчерпан, выбрасывает requests.exceptions.Timeout."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining < BUDGET_MIN_TIMEOUT:
+        raise requests.exceptions.Timeout("Бюджет времени команды исчерпан, запрос не отправлен.")
+    return min(timeout, remaining)
+
+def budget_allows(reserve_seconds):
+    """Проверяет, что до конца бюджета команды осталось больше reserve_seconds."""
+    remaining = remaining_budget()
+    return remaining is None or remaining > reserve_seconds
+
+def b24_post(webhook_url, method, params=None, timeout=B24_TIMEOUT, stream=False):
     """
-    Получает вебхук пользователя из опубликованной Google Таблицы CSV.
-    Формат таблицы: A - Имя, B - Вебхук.
+    Вызывает метод REST API Bitrix24 с таймаутом и через предохранитель портала.
+    Если портал временно отключен, сразу выбрасывает requests.exceptions.ConnectionError.
+    При stream=True тело ответа не загружается целиком (см. open_task_stream).
     """
-    # В среде NextBot функция debug() доступна для логирования
-    # debug(f"-> get_webhook_from_sheet: ищем вебхук для '{user_name}'")
+    portal_url = webhook_url.split('/rest/')[0]
+    # Таймаут считается до проверки предохранителя, чтобы не оставить пробный запрос неотправленным
+    timeout = budget_timeout(timeout)
+    if not circuit_allows_request(portal_url):
+        get_circuit(portal_url)["rejected"] += 1
+        raise requests.exceptions.ConnectionError(f"Портал {portal_url} временно недоступен, запрос {method} не отправлен.")
+
+    params = apply_field_projection(method, params)
+    started_at = datetime.datetime.now()
     try:
-        response = requests.get(sheet_url, timeout=5)
-        response.raise_for_status()
-        csv_data = response.text
-        lines = csv_data.strip().splitlines()
-
-        for line in lines:
-            if not line.strip(): continue
-            parts = line.strip().split(',')
-            if len(parts) >= 2:
-                sheet_user = parts[0].strip()
-                webhook = parts[1].strip()
-                webhook = ''.join(c for c in webhook if c.isprintable())
-                
-                if sheet_user == user_name:
-                    # debug(f"<- get_webhook_from_sheet: Вебхук для '{user_name}' найден.")
-                    if not webhook.endswith('/'): webhook += '/'
-                    return webhook
-        
-        # debug(f"<- get_webhook_from_sheet: Пользователь '{user_name}' НЕ найден в таблице.")
+        response = requests.post(f"{webhook_url}{method}.json", json=params, timeout=timeout, stream=stream)
+    except Exception:
+        record_circuit_outcome(portal_url, False)
+        raise
+    is_slow = datetime.datetime.now() - started_at > datetime.timedelta(seconds=CIRCUIT_SLOW_SECONDS)
+    record_circuit_outcome(portal_url, response.status_code < 500 and not is_slow)
+    return response
+
+# Потоковое чтение больших ответов tasks.task.list: задачи разбираются по одной,
+# полный текст ответа и дерево всех задач одновременно в памяти не держатся.
+STREAM_CHUNK_SIZE = 65536
+
+def open_task_stream(response):
+    """
+    Начинает потоковое чтение ответа tasks.task.list.
+    Читает ответ до начала массива задач и возвращает состояние потока.
+    Если массива нет (ответ с ошибкой), в состоянии заполняются error и error_description.
+    """
+    if not response.encoding:
+        response.encoding = "utf-8"
+    stream = {
+        "chunks": response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True),
+        "buffer": "",
+        "error": None,
+        "error_description": None,
+        "has_tasks": False,
+        "finished": False,
+        "decoder": json.JSONDecoder(),
+    }
+    for chunk in stream["chunks"]:
+        stream["buffer"] += chunk
+        match = re.search(r'"result"\s*:\s*\{\s*"tasks"\s*:\s*\[', stream["buffer"])
+        if match:
+            stream["buffer"] = stream["buffer"][match.end():]
+            stream["has_tasks"] = True
+            return stream
+
+    # Массива задач нет: ответ небольшой, разбираем его целиком
+    payload = json.loads(stream["buffer"]) if stream["buffer"].strip() else {}
+    stream["buffer"] = ""
+    if isinstance(payload, dict) and payload.get("error"):
+        stream["error"] = payload.get("error")
+        stream["error_description"] = payload.get("error_description", "Нет описания")
+    return stream
+
+def read_stream_task(stream, fields):
+    """
+    Читает из потока следующую задачу, оставляя в ней только поля из fields.
+    Возвращает None, когда список задач закончился. Позиция чтения хранится
+    в самом состоянии потока, поэтому функция вызывается в обычном цикле while.
+    """
+    if not stream["has_tasks"] or stream["finished"]:
         return None
+    buffer = stream["buffer"]
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if not buffer:
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise json.JSONDecodeError("Ответ оборвался внутри списка задач", "", 0)
+            buffer = chunk
+            continue
+        if buffer[0] == "]":
+            # Хвост ответа (курсор next, total) остается в потоке для read_stream_next
+            stream["buffer"] = buffer[1:]
+            stream["finished"] = True
+            return None
+        try:
+            decoded = stream["decoder"].raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Задача пришла не целиком, дочитываем следующий фрагмент
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise
+            buffer += chunk
+            continue
+        task = decoded[0]
+        stream["buffer"] = buffer[decoded[1]:]
+        return {field: task[field] for field in fields if field in task}
+
+# Ключи для нечеткого поиска с учетом ошибок распознавания речи. Для каждого слова
+# строятся основа без падежного окончания в латинской транслитерации и фонетический
+# код, поэтому "маркетинга", "Маркетинг" и "marketing" совпадают по ключу.
+RUSSIAN_ENDINGS = sorted((
+    "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему", "иях", "ях", "ах", "ов", "ев",
+    "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ию", "ия", "ии", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+TRANSLIT_MAP = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+PHONETIC_REPLACEMENTS = (
+    ("shch", "s"), ("sh", "s"), ("zh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("ph", "f"),
+    ("ck", "k"), ("x", "ks"), ("w", "v"), ("q", "k"), ("j", "i"), ("y", "i"),
+    ("b", "p"), ("v", "f"), ("g", "k"), ("d", "t"), ("z", "s"),
+)
+PHONETIC_VOWELS = "aeiou"
+PROJECT_INDEX_TTL_SECONDS = 300
+
+def split_words(text):
+    """Нормализует текст и разбивает его на слова."""
+    if not isinstance(text, str) or not text:
+        return []
+    return re.sub(r'[^\w\s]', '', text).lower().replace('ё', 'е').split()
+
+def stem_word(word):
+    """Отбрасывает типичное русское окончание, если остается основа не короче трех букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def transliterate_word(word):
+    """Переводит кириллицу в латиницу, латиницу и цифры оставляет как есть."""
+    return ''.join(TRANSLIT_MAP.get(c, c) for c in word)
+
+def phonetic_code(latin_word):
+    """Грубый фонетический код: глухие и звонкие согласные совпадают, гласные после первой буквы отбрасываются."""
+    code = latin_word
+    for replacement in PHONETIC_REPLACEMENTS:
+        code = code.replace(replacement[0], replacement[1])
+    if not code:
+        return ""
+    result_chars = [code[0]]
+    for c in code[1:]:
+        if c not in PHONETIC_VOWELS and c != result_chars[-1]:
+            result_chars.append(c)
+    return ''.join(result_chars)
+
+def word_keys(word):
+    """Ключи слова для индекса: транслитерированная основа и фонетический код (если он не слишком короткий)."""
+    word_keys_cache = CACHE_STORE.setdefault("word_keys", {})
+    keys = word_keys_cache.get(word)
+    if keys is None:
+        latin_stem = transliterate_word(stem_word(word))
+        keys = ["t:" + latin_stem]
+        code = phonetic_code(latin_stem)
+        if len(code) >= 3:
+            keys.append("p:" + code)
+        if len(word_keys_cache) > 50000:
+            word_keys_cache.clear()
+        word_keys_cache[word] = keys
+    return keys
+
+def get_project_index(webhook_url):
+    """
+    Возвращает каталог проектов портала с индексом ключей слов названий.
+    Каталог кешируется в CACHE_STORE на PROJECT_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    project_indexes = CACHE_STORE.setdefault("project_index", {})
+    index = project_indexes.get(portal_url)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=PROJECT_INDEX_TTL_SECONDS):
+        return index
+
+    response = b24_post(webhook_url, "sonet_group.get", {})
+    response.raise_for_status()
+    projects = response.json().get("result", [])
+
+    index = {"names": {}, "position": {}, "keys": {}, "built_at": now}
+    for project in projects:
+        project_name = project.get("NAME")
+        if not isinstance(project_name, str) or not project_name:
+            continue
+        project_id = int(project.get("ID"))
+        index["names"][project_id] = project_name
+        index["position"][project_id] = len(index["position"])
+        for word in set(split_words(project_name)):
+            for key in word_keys(word):
+                index["keys"].setdefault(key, set()).add(project_id)
+    project_indexes[portal_url] = index
+    return index
+
+def match_project_id(index, project_name):
+    """
+    Находит в индексе проект с наибольшим числом совпавших слов запроса.
+    Каждое слово запроса - несколько обращений к словарю ключей, без перебора проектов.
+    При равенстве выигрывает проект, который портал вернул первым.
+    """
+    counts = {}
+    for word in dict.fromkeys(split_words(project_name)):
+        matched_ids = set()
+        for key in word_keys(word):
+            matched_ids.update(index["keys"].get(key, ()))
+        for project_id in matched_ids:
+            counts[project_id] = counts.get(project_id, 0) + 1
+
+    best_match_id = None
+    max_common_count = 0
+    for project_id in counts:
+        common_count = counts[project_id]
+        if common_count > max_common_count or (
+                common_count == max_common_count and index["position"][project_id] < index["position"][best_match_id]):
+            max_common_count = common_count
+            best_match_id = project_id
+    return best_match_id
+
+# Хранилище учетных данных: вебхуки ищутся в локальном индексе
+# CACHE_STORE["credentials"] ({имя: [вебхуки порталов]}). Резидентный раннер
+# заполняет его из своего хранилища (SQLite, JSON, окружение) и тогда таблица
+# не читается вовсе; иначе индекс импортируется из Google Таблицы, не чаще
+# раза в WEBHOOK_SHEET_SYNC_SECONDS.
+WEBHOOK_SHEET_SYNC_SECONDS = 300
+
+def normalize_webhook(webhook):
+    """Убирает непечатаемые символы и добавляет завершающий '/'."""
+    webhook = ''.join(c for c in webhook.strip() if c.isprintable())
+    if not webhook.endswith('/'): webhook += '/'
+    return webhook
+
+def parse_webhook_sheet(csv_data):
+    """
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в словарь {имя: [вебхуки]}.
+    У пользователя, работающего на нескольких порталах, несколько строк;
+    первая строка задает основной портал.
+    """
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        if not line.strip(): continue
+        parts = line.strip().split(',')
+        if len(parts) >= 2:
+            sheet_user = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if sheet_user and webhook != '/':
+                user_webhooks = webhooks.setdefault(sheet_user, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+def get_credential_index():
+    """Возвращает индекс учетных данных, создавая пустой индекс с импортом из таблицы."""
+    credentials = CACHE_STORE.get("credentials")
+    if credentials is None:
+        credentials = {"source": "sheet", "webhooks": {}, "synced_at": None}
+        CACHE_STORE["credentials"] = credentials
+    return credentials
+
+def sync_webhooks_from_sheet(sheet_url, credentials):
+    """Загружает опубликованную Google Таблицу CSV и заменяет ею индекс вебхуков."""
+    response = requests.get(sheet_url, timeout=budget_timeout(5))
+    response.raise_for_status()
+    credentials["webhooks"] = parse_webhook_sheet(response.text)
+    credentials["synced_at"] = datetime.datetime.now()
+
+def find_user_webhooks(sheet_url, user_name):
+    """
+    Возвращает все вебхуки пользователя (основной первым) из хранилища учетных данных.
+    Google Таблица служит только источником для импорта: она читается,
+    если индекс пуст или пользователь не найден, а с прошлой загрузки
+    прошло больше WEBHOOK_SHEET_SYNC_SECONDS.
+    """
+    credentials = get_credential_index()
+    user_webhooks = credentials["webhooks"].get(user_name)
+    if user_webhooks:
+        log_debug("<- find_user_webhooks: Вебхуки для '{}' найдены в индексе ({}).", [user_name, credentials['source']])
+        return user_webhooks
+    if credentials["source"] != "sheet":
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден в хранилище {}.", [user_name, credentials['source']])
+        return []
+
+    synced_at = credentials["synced_at"]
+    if synced_at is not None and datetime.datetime.now() - synced_at < datetime.timedelta(seconds=WEBHOOK_SHEET_SYNC_SECONDS):
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден, таблица загружена недавно.", [user_name])
+        return []
+    try:
+        sync_webhooks_from_sheet(sheet_url, credentials)
     except Exception as e:
-        # debug(f"<- get_webhook_from_sheet: Ошибка при доступе к Google Sheets: {e}")
-        return None
+        log_error("<- find_user_webhooks: Ошибка при доступе к Google Sheets: {}", [e])
+        return []
+
+    user_webhooks = credentials["webhooks"].get(user_name) or []
+    log_debug("<- find_user_webhooks: Для '{}' в таблице найдено вебхуков: {}.", [user_name, len(user_webhooks)])
+    return user_webhooks
+
+def get_webhook_from_sheet(sheet_url, user_name):
+    """Получает основной вебхук пользователя (см. find_user_webhooks)."""
+    log_debug("-> get_webhook_from_sheet: ищем вебхук для '{}'", [user_name])
+    user_webhooks = find_user_webhooks(sheet_url, user_name)
+    if user_webhooks:
+        return user_webhooks[0]
+    return None
 
 def get_project_id(webhook, project_name):
     """
     Находит ID проекта (группы) в Битрикс24 по его названию.
-    Использует нечеткий поиск по совпадению слов.
+    Использует нечеткий поиск по совпадению слов с учетом окончаний,
+    транслитерации и звучания (см. word_keys).
     """
     if not isinstance(project_name, str) or not project_name.strip():
         return None
 
-    url = f"{webhook}sonet_group.get"
     try:
-        response = requests.post(url, json={})
-        response.raise_for_status()
-        projects = response.json().get("result", [])
-        if not projects:
-            return None
-
-        search_words = set(re.sub(r'[^\w\s]', '', project_name).lower().split())
-        if not search_words:
-            return None
-
-        best_match_id = None
-        max_common_count = 0
-
-        for project in projects:
-            current_project_name = project.get("NAME", "")
-            project_words = set(re.sub(r'[^\w\s]', '', current_project_name).lower().split())
-            common_count = len(search_words.intersection(project_words))
-
-            if common_count > max_common_count:
-                max_common_count = common_count
-                best_match_id = int(project.get("ID"))
-
-        return best_match_id if max_common_count > 0 else None
-    except (requests.exceptions.RequestException, json.JSONDecodeError):
+        index = get_project_index(webhook)
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError):
         return None
+    if not index["names"] or not split_words(project_name):
+        return None
+    return match_project_id(index, project_name)
 
-def get_user_name_by_id(webhook, user_id, user_cache):
+def get_user_name_by_id(webhook, user_id, user_cache, degraded=None):
     """
     Получает имя пользователя по его ID, используя кеширование.
+    Если бюджет времени команды на исходе, имя берется из кеша прошлых вызовов,
+    а без него возвращается ID и в degraded отмечается "responsible".
     """
     if user_id in user_cache:
         return user_cache[user_id]
@@ -90,10 +557,17 @@ def get_user_name_by_id(webhook, user_id, user_cache):
     if not user_id:
         return "Не назначен"
 
-    url = f"{webhook}user.get.json"
+    portal_user_names = CACHE_STORE.setdefault("user_names", {}).setdefault(get_portal_url(webhook), {})
+    if not budget_allows(SHOW_TASK_ENRICH_RESERVE_SECONDS):
+        if user_id in portal_user_names:
+            return portal_user_names[user_id]
+        if degraded is not None:
+            degraded.add("responsible")
+        return f"ID: {user_id}"
+
     params = {'ID': user_id}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook, "user.get", params)
         response.raise_for_status()
         result = response.json().get('result', [])
         if result:
@@ -103,27 +577,30 @@ def get_user_name_by_id(webhook, user_id, user_cache):
             last_name = user.get('LAST_NAME', '')
             full_name = f"{name} {last_name}".strip()
             user_cache[user_id] = full_name
+            portal_user_names[user_id] = full_name
             return full_name
         return f"ID: {user_id}"
     except (requests.exceptions.RequestException, json.JSONDecodeError):
         return f"ID: {user_id} (ошибка)"
 
-def get_projects_map(webhook):
+def get_projects_map(webhook, degraded=None):
     """
     Получает все проекты (группы) и возвращает словарь {id: name}.
+    Использует тот же кешируемый каталог проектов, что и get_project_id.
+    Если бюджет времени команды на исходе, каталог не загружается: берется
+    сохраненный (даже устаревший), а без него в degraded отмечается "projectName".
     """
-    url = f"{webhook}sonet_group.get"
-    params = {'ORDER': {'NAME': 'ASC'}}
     project_map = {0: "Личные (без проекта)"} # Для задач без проекта
+    if not budget_allows(SHOW_TASK_ENRICH_RESERVE_SECONDS):
+        index = CACHE_STORE.get("project_index", {}).get(get_portal_url(webhook))
+        if index:
+            project_map.update(index["names"])
+        elif degraded is not None:
+            degraded.add("projectName")
+        return project_map
     try:
-        response = requests.post(url, json=params, timeout=10)
-        response.raise_for_status()
-        projects = response.json().get("result", [])
-        for p in projects:
-            project_id = int(p.get("ID"))
-            project_name = p.get("NAME")
-            if project_id and project_name:
-                project_map[project_id] = project_name
+        index = get_project_index(webhook)
+        project_map.update(index["names"])
         return project_map
     except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError):
         # В случае ошибки вернем базовую карту, чтобы не ломать основной скрипт
@@ -132,8 +609,9 @@ def get_projects_map(webhook):
 def parse_deadline_for_filter(deadline_str):
     """
     Парсит строку с датой и возвращает словарь для фильтра Bitrix24.
-    Поддерживает "сегодня", "завтра", "ДД.ММ.ГГГГ".
-    Возвращает словарь с ключами '>=DEADLINE' и '<=DEADLINE'.
+    Поддерживает "сегодня", "завтра", "ДД.ММ.ГГГГ" и "просроченные".
+    Возвращает словарь с ключами '>=DEADLINE' и '<=DEADLINE'
+    (для просроченных задач — только '<DEADLINE').
     """
     if not deadline_str:
         return {}
@@ -142,6 +620,9 @@ def parse_deadline_for_filter(deadline_str):
     today = datetime.datetime.now()
     filter_date = None
 
+    if "просроч" in deadline_str:
+        now_str = f"{today.year:04d}-{today.month:02d}-{today.day:02d} {today.hour:02d}:{today.minute:02d}:{today.second:02d}"
+        return {'<DEADLINE': now_str}
     if "сегодня" in deadline_str:
         filter_date = today
     elif "завтра" in deadline_str:
@@ -172,105 +653,290 @@ def parse_deadline_for_filter(deadline_str):
 
     return {}
 
-def main(args):
+def get_portal_url(webhook):
+    """Возвращает адрес портала без пути вебхука, он же ключ кеша портала."""
+    return webhook.split('/rest/')[0]
+
+def count_cache_event(cache_name, event):
+    """Считает обращения к кешу (hit, stale, miss) для метрик резидентного раннера."""
+    cache_stats = CACHE_STORE.setdefault("cache_stats", {}).setdefault(cache_name, {})
+    cache_stats[event] = cache_stats.get(event, 0) + 1
+
+def get_cached_listing(webhook, cache_key, max_age_seconds=SHOW_TASK_STALE_SECONDS):
     """
-    Основная функция для получения и форматирования списка задач.
+    Ищет готовый ответ в кеше списков задач.
+    Возвращает {"payload": ..., "stale": bool, "stored_at": datetime} или None,
+    если ответа нет или он старше max_age_seconds.
     """
-    # 1. Получение вебхука
-    user_name = args.get("nameUser")
-    webhook = args.get("webhook")
-    if not webhook:
-        gsheet_url = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv"
-        if not user_name:
-            error_message = {"status": "error", "message": "Ошибка: Не удалось определить пользователя для поиска вебхука."}
-            return json.dumps(error_message, ensure_ascii=False)
-        webhook = get_webhook_from_sheet(gsheet_url, user_name)
+    portal_cache = CACHE_STORE.get("show_task", {}).get(get_portal_url(webhook), {})
+    entry = portal_cache.get(cache_key)
+    if not entry:
+        return None
 
-    if not webhook:
-        error_message = {"status": "error", "message": f"Ошибка: Вебхук для пользователя '{user_name}' не найден."}
-        return json.dumps(error_message, ensure_ascii=False)
-    if not webhook.endswith('/'):
-        webhook += '/'
+    age = datetime.datetime.now() - entry["stored_at"]
+    if age > datetime.timedelta(seconds=max_age_seconds):
+        return None
+    is_stale = age > datetime.timedelta(seconds=SHOW_TASK_FRESH_SECONDS)
+    return {"payload": entry["payload"], "stale": is_stale, "stored_at": entry["stored_at"]}
 
-    # 2. Формирование фильтра
-    task_filter = {'!STATUS': '5'}  # Исключаем завершенные задачи
+def portal_is_unavailable(webhook):
+    """Проверяет, отключен ли портал предохранителем (без перевода его в пробный режим)."""
+    circuit = CACHE_STORE.get("circuit_breakers", {}).get(get_portal_url(webhook))
+    if not circuit or circuit["state"] == "closed":
+        return False
+    if circuit["state"] == "half_open":
+        return True
+    return datetime.datetime.now() - circuit["opened_at"] < datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS)
+
+def get_degraded_listing(webhook, cache_key):
+    """
+    Возвращает сохраненный ответ с пометкой об устаревании для случая, когда портал недоступен.
+    Если сохраненного ответа нет, возвращает None.
+    """
+    cached = get_cached_listing(webhook, cache_key, SHOW_TASK_DEGRADED_SECONDS)
+    if not cached:
+        return None
+
+    stored_at = cached["stored_at"]
+    cached_at = f"{stored_at.day:02d}.{stored_at.month:02d}.{stored_at.year:04d} {stored_at.hour:02d}:{stored_at.minute:02d}"
+    payload = dict(cached["payload"])
+    payload["stale"] = True
+    payload["cachedAt"] = cached_at
+    payload["message"] = f"Bitrix24 временно недоступен. Показаны сохраненные данные на {cached_at}."
+    return payload
+
+def get_listing_generation(webhook):
+    """
+    Номер поколения кеша списков портала; invalidate_task_listings увеличивает его
+    при каждом сбросе кеша после изменения задач.
+    """
+    return CACHE_STORE.get("show_task_generation", {}).get(get_portal_url(webhook), 0)
+
+def store_listing(webhook, cache_key, payload, generation):
+    """
+    Сохраняет готовый ответ в кеш списков задач портала.
+    generation — поколение кеша на момент начала запроса к Bitrix24: если кеш
+    с тех пор сбросили, ответ мог устареть и не сохраняется.
+    """
+    if generation != get_listing_generation(webhook):
+        log_debug("store_listing: кеш портала {} сброшен во время запроса, ответ {} не сохранен.", [get_portal_url(webhook), cache_key])
+        return
+    show_task_cache = CACHE_STORE.setdefault("show_task", {})
+    portal_cache = show_task_cache.setdefault(get_portal_url(webhook), {})
+    portal_cache[cache_key] = {"payload": payload, "stored_at": datetime.datetime.now()}
+    CACHE_STORE.get("show_task_refresh", {}).pop(get_refresh_key(webhook, cache_key), None)
+
+def get_refresh_key(webhook, cache_key):
+    """Ключ очереди обновления: у пользователя с несколькими порталами ключи кеша совпадают."""
+    return f"{get_portal_url(webhook)}|{cache_key}"
+
+def get_listing_cache_key(args):
+    """Ключ кеша списка задач внутри портала: пользователь, проект и срок."""
+    project_key = str(args.get('project_name') or '').lower().strip()
+    deadline_filter = parse_deadline_for_filter(args.get('deadline'))
+    deadline_key = deadline_filter.get('>=DEADLINE', '')
+    if '<DEADLINE' in deadline_filter:
+        deadline_key = 'overdue'
+    return f"{args.get('nameUser')}|{project_key}|{deadline_key}"
+
+def get_digest_kind(args):
+    """
+    Определяет, какой дайджест подходит под фильтры запроса: "today", "tomorrow",
+    "overdue" или None. Дайджесты строятся по всем проектам пользователя.
+    """
+    if args.get('project_name'):
+        return None
+    deadline_str = str(args.get('deadline') or '').lower().strip()
+    if "просроч" in deadline_str:
+        return "overdue"
+    if "послезавтра" in deadline_str:
+        return None
+    if "сегодня" in deadline_str:
+        return "today"
+    if "завтра" in deadline_str:
+        return "tomorrow"
+    return None
+
+def get_digest(webhook, user_name, kind):
+    """Возвращает готовый дайджест пользователя или None, если его нет или он устарел."""
+    entry = CACHE_STORE.get("show_task_digests", {}).get(get_portal_url(webhook), {}).get(user_name, {}).get(kind)
+    if not entry:
+        return None
+    now = datetime.datetime.now()
+    # Дайджест «на сегодня», построенный вчера, уже про другой день
+    if entry["day"] != f"{now.year:04d}-{now.month:02d}-{now.day:02d}":
+        return None
+    if now - entry["stored_at"] > datetime.timedelta(seconds=SHOW_TASK_DIGEST_SECONDS):
+        return None
+    return entry["payload"]
+
+def store_digest(webhook, user_name, kind, payload, generation):
+    """
+    Сохраняет дайджест пользователя; вызывается при построении дайджестов планировщиком.
+    Как и store_listing, не сохраняет дайджест, если кеш портала сбросили во время запроса.
+    """
+    if generation != get_listing_generation(webhook):
+        return
+    now = datetime.datetime.now()
+    portal_digests = CACHE_STORE.setdefault("show_task_digests", {}).setdefault(get_portal_url(webhook), {})
+    portal_digests.setdefault(user_name, {})[kind] = {
+        "payload": payload,
+        "stored_at": now,
+        "day": f"{now.year:04d}-{now.month:02d}-{now.day:02d}",
+    }
+
+def schedule_listing_refresh(cache_key, args, webhook):
+    """
+    Ставит запрос в очередь фонового обновления.
+    Очередь разбирает резидентный раннер, повторно вызывая main() с флагом cache_refresh.
+    """
+    refresh_args = dict(args)
+    refresh_args["webhook"] = webhook
+    refresh_args["cache_refresh"] = True
+    CACHE_STORE.setdefault("show_task_refresh", {})[get_refresh_key(webhook, cache_key)] = refresh_args
+
+def build_task_filter(webhook, args, include_completed=False):
+    """
+    Строит фильтр tasks.task.list по проекту и сроку из args.
+    Возвращает {"filter": фильтр} или {"error": текст ошибки, "missing_project": признак "проект не найден"}.
+    """
+    task_filter = {} if include_completed else {'!STATUS': '5'}  # По умолчанию исключаем завершенные задачи
 
     project_name_arg = args.get('project_name')
     if project_name_arg:
         project_id = get_project_id(webhook, project_name_arg)
-        if project_id:
-            task_filter['GROUP_ID'] = project_id
-        else:
-            error_message = {"status": "error", "message": f"Проект с названием '{project_name_arg}' не найден."}
-            return json.dumps(error_message, ensure_ascii=False)
+        if not project_id:
+            return {"error": f"Проект с названием '{project_name_arg}' не найден.", "missing_project": True}
+        task_filter['GROUP_ID'] = project_id
 
     deadline_str = args.get('deadline')
     if deadline_str:
         deadline_filter = parse_deadline_for_filter(deadline_str)
-        if deadline_filter:
-            task_filter.update(deadline_filter)
-        else:
-            error_message = {"status": "error", "message": f"Не удалось распознать формат крайнего срока: '{deadline_str}'. Используйте 'сегодня', 'завтра' или 'ДД.ММ.ГГГГ'."}
-            return json.dumps(error_message, ensure_ascii=False)
+        if not deadline_filter:
+            return {"error": f"Не удалось распознать формат крайнего срока: '{deadline_str}'. Используйте 'сегодня', 'завтра', 'просроченные' или 'ДД.ММ.ГГГГ'.",
+                    "missing_project": False}
+        task_filter.update(deadline_filter)
+    return {"filter": task_filter}
+
+def clean_task_description(description):
+    """Убирает из описания задачи вложения [DISK FILE ID=...]."""
+    return re.sub(r'\[DISK FILE ID=[^\]]+\]', '', description or '').strip()
+
+def format_task_deadline(deadline):
+    """Форматирует срок задачи из ISO 8601 в "ДД.ММ.ГГГГ ЧЧ:ММ"."""
+    if not deadline:
+        return "Не указан"
+    try:
+        date_part = deadline.split('T')[0]
+        time_part = deadline.split('T')[1].split('+')[0]
+        date_parts = date_part.split('-')
+        year = date_parts[0]
+        month = date_parts[1]
+        day = date_parts[2]
+        time_parts = time_part.split(':')
+        hour = time_parts[0]
+        minute = time_parts[1]
+        return f"{day}.{month}.{year} {hour}:{minute}"
+    except (ValueError, IndexError):
+        return "Неверный формат даты"
+
+def list_portal_tasks(webhook, args, timeout=15, missing_project_ok=False):
+    """
+    Получает и группирует задачи пользователя одного портала.
+    Возвращает словарь ответа (status, projects, ...), который main() сериализует.
+    """
+    project_name_arg = args.get('project_name')
+
+    # Частые запросы «на сегодня», «на завтра» и «просроченные» отдаем из дайджеста
+    digest_kind = get_digest_kind(args)
+    if digest_kind and not args.get("cache_refresh"):
+        digest = get_digest(webhook, args.get("nameUser"), digest_kind)
+        if digest:
+            count_cache_event("show_task_digest", "hit")
+            return digest
+        count_cache_event("show_task_digest", "miss")
+
+    # Повторный запрос с теми же фильтрами отдаем из кеша
+    cache_key = get_listing_cache_key(args)
+    # Поколение запоминаем до запроса к Bitrix24: сброс кеша во время запроса отменит запись
+    generation = get_listing_generation(webhook)
+    if not args.get("cache_refresh"):
+        cached = get_cached_listing(webhook, cache_key)
+        if cached:
+            if cached["stale"]:
+                count_cache_event("show_task", "stale")
+                schedule_listing_refresh(cache_key, args, webhook)
+            else:
+                count_cache_event("show_task", "hit")
+            return cached["payload"]
+        count_cache_event("show_task", "miss")
+
+    # Портал отключен предохранителем: не ждем таймаутов, отвечаем из кеша
+    if portal_is_unavailable(webhook):
+        degraded = get_degraded_listing(webhook, cache_key)
+        if degraded:
+            return degraded
+        error_message = {"status": "error", "message": "Bitrix24 временно недоступен. Попробуйте позже."}
+        return error_message
+
+    # 2. Формирование фильтра
+    built_filter = build_task_filter(webhook, args)
+    if built_filter.get("missing_project") and missing_project_ok:
+        # В сводном режиме проект есть не на каждом портале, это не ошибка
+        return {"status": "success", "projects": []}
+    if "error" in built_filter:
+        error_message = {"status": "error", "message": built_filter["error"]}
+        return error_message
+    task_filter = built_filter["filter"]
 
     # 3. Выполнение запроса к API
-    select_fields = ["ID", "TITLE", "DESCRIPTION", "DEADLINE", "STATUS", "RESPONSIBLE_ID", "GROUP_ID"]
+    # Список полей задачи задает B24_FIELD_PROJECTIONS["tasks.task.list"]
     params = {
         'order': {'ID': 'DESC'},
-        'filter': task_filter,
-        'select': select_fields
+        'filter': task_filter
     }
     
     try:
-        response = requests.post(webhook + 'tasks.task.list', json=params, timeout=15)
+        # Ответ читаем потоково и группируем задачи по мере поступления
+        response = b24_post(webhook, "tasks.task.list", params, timeout=timeout, stream=True)
         response.raise_for_status()
-        result = response.json()
+        stream = open_task_stream(response)
         
-        if 'error' in result and result['error']:
-            error_message = {"status": "error", "message": f"Ошибка API Bitrix24: {result.get('error_description', 'Нет описания')}"}
-            return json.dumps(error_message, ensure_ascii=False)
-
-        tasks = result.get('result', {}).get('tasks', [])
-        
-        if not tasks:
-            success_message = {"status": "success", "projects": [], "message": "Задачи по вашим критериям не найдены."}
-            return json.dumps(success_message, ensure_ascii=False)
+        if stream["error"]:
+            error_message = {"status": "error", "message": f"Ошибка API Bitrix24: {stream['error_description']}"}
+            return error_message
 
         # 4. Группировка задач по проектам
         project_map = None
-        if not project_name_arg: # Если проект не был задан, получаем карту всех проектов
-            project_map = get_projects_map(webhook)
+        project_map_loaded = False
         
         grouped_tasks = {}
         user_cache = {}
-        for task in tasks:
+        # Поля, пропущенные ради бюджета времени: "projectName", "responsible", "tasks"
+        degraded = set()
+        task_fields = ["id", "title", "description", "deadline", "status", "responsibleId", "groupId"]
+        while True:
+            task = read_stream_task(stream, task_fields)
+            if task is None:
+                break
+            if not budget_allows(0):
+                # Бюджет исчерпан посреди ответа: отдаем то, что успели прочитать
+                degraded.add("tasks")
+                break
+            if not project_map_loaded and not project_name_arg:
+                # Если проект не был задан, получаем карту всех проектов
+                project_map = get_projects_map(webhook, degraded)
+                project_map_loaded = True
+
             title = task.get('title', 'Без названия')
-            description = task.get('description', 'Без описания')
-            description = re.sub(r'\[DISK FILE ID=[^\]]+\]', '', description).strip()
-
-            deadline = task.get('deadline')
-            if deadline:
-                try:
-                    date_part = deadline.split('T')[0]
-                    time_part = deadline.split('T')[1].split('+')[0]
-                    date_parts = date_part.split('-')
-                    year = date_parts[0]
-                    month = date_parts[1]
-                    day = date_parts[2]
-                    time_parts = time_part.split(':')
-                    hour = time_parts[0]
-                    minute = time_parts[1]
-                    deadline_formatted = f"{day}.{month}.{year} {hour}:{minute}"
-                except (ValueError, IndexError):
-                    deadline_formatted = "Неверный формат даты"
-            else:
-                deadline_formatted = "Не указан"
+            description = clean_task_description(task.get('description', 'Без описания'))
+            deadline_formatted = format_task_deadline(task.get('deadline'))
                 
             status_id = int(task.get('status', 0))
             status_text = REVERSE_STATUS_MAP.get(status_id, f"Неизвестный статус ({status_id})")
             
             responsible_id = int(task.get('responsibleId', 0))
-            responsible_name = get_user_name_by_id(webhook, responsible_id, user_cache)
+            responsible_name = get_user_name_by_id(webhook, responsible_id, user_cache, degraded)
             
             task_data = {
                 "title": title,
@@ -293,6 +959,25 @@ def main(args):
             if task_project_name not in grouped_tasks:
                 grouped_tasks[task_project_name] = []
             grouped_tasks[task_project_name].append(task_data)
+        response.close()
+
+        if degraded:
+            # Неполный ответ не кешируем, он нужен только чтобы ответить вовремя
+            final_result = {"status": "success", "projects": [], "partial": True, "degraded": sorted(degraded)}
+            for p_name in sorted(grouped_tasks.keys()):
+                final_result["projects"].append({"projectName": p_name, "tasks": grouped_tasks[p_name]})
+            if "tasks" in degraded:
+                final_result["message"] = "Bitrix24 отвечает медленно, показана только часть задач."
+            else:
+                final_result["message"] = "Bitrix24 отвечает медленно, часть названий проектов или имен ответственных не загружена."
+            return final_result
+
+        if not grouped_tasks:
+            success_message = {"status": "success", "projects": [], "message": "Задачи по вашим критериям не найдены."}
+            store_listing(webhook, cache_key, success_message, generation)
+            if digest_kind and args.get("digest_build"):
+                store_digest(webhook, args.get("nameUser"), digest_kind, success_message, generation)
+            return success_message
 
         # 5. Форматирование итогового JSON
         projects_output = []
@@ -304,14 +989,523 @@ def main(args):
             })
             
         final_result = {"status": "success", "projects": projects_output}
-        return json.dumps(final_result, ensure_ascii=False)
+        store_listing(webhook, cache_key, final_result, generation)
+        if digest_kind and args.get("digest_build"):
+            store_digest(webhook, args.get("nameUser"), digest_kind, final_result, generation)
+        return final_result
 
     except requests.exceptions.RequestException as e:
+        degraded = get_degraded_listing(webhook, cache_key)
+        if degraded:
+            return degraded
         error_message = {"status": "error", "message": f"Ошибка сети при обращении к Bitrix24: {e}"}
-        return json.dumps(error_message, ensure_ascii=False)
+        return error_message
     except (json.JSONDecodeError, KeyError) as e:
         error_message = {"status": "error", "message": f"Ошибка обработки ответа от Bitrix24: {e}"}
+        return error_message
+
+# Метод batch Bitrix24 выполняет не больше 50 команд за вызов
+BATCH_MAX_COMMANDS = 50
+URL_SAFE_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.~$[]"
+
+def url_quote(value):
+    """Кодирует значение для строки запроса команды batch (UTF-8, percent-encoding)."""
+    encoded = []
+    for c in str(value):
+        if c in URL_SAFE_CHARS:
+            encoded.append(c)
+        else:
+            for byte in c.encode("utf-8"):
+                encoded.append(f"%{byte:02X}")
+    return "".join(encoded)
+
+def flatten_query_params(prefix, value, pairs):
+    """Разворачивает вложенные параметры в пары вида fields[TITLE]=... для batch."""
+    if isinstance(value, dict):
+        for key in value:
+            flatten_query_params(f"{prefix}[{key}]" if prefix else str(key), value[key], pairs)
+    elif isinstance(value, list):
+        for index in range(len(value)):
+            item = value[index]
+            flatten_query_params(f"{prefix}[{index}]", item, pairs)
+    else:
+        pairs.append(f"{url_quote(prefix)}={url_quote(value)}")
+
+def build_batch_command(method, params):
+    """Строка команды batch "метод?параметры" с проекцией полей метода."""
+    pairs = []
+    flatten_query_params("", apply_field_projection(method, params) or {}, pairs)
+    return f"{method}?{'&'.join(pairs)}"
+
+def call_batch(webhook_url, commands, halt=0):
+    """
+    Выполняет список команд [{"key", "method", "params"}] одним вызовом batch.
+    Команды выполняются по порядку и могут ссылаться на результаты предыдущих
+    через $result[ключ][...]. С halt=1 пакет останавливается на первой ошибке:
+    команды после нее не выполняются и не попадают ни в результаты, ни в ошибки.
+    Возвращает словари результатов и ошибок по ключам.
+    """
+    log_debug("-> call_batch: команд: {}", [len(commands)])
+    cmd = {}
+    for command in commands:
+        cmd[command["key"]] = build_batch_command(command["method"], command["params"])
+    response = b24_post(webhook_url, "batch", {"halt": halt, "cmd": cmd}, timeout=30)
+    response.raise_for_status()
+    result_json = response.json()
+    if "error" in result_json:
+        raise ValueError(result_json.get("error_description") or result_json["error"])
+    batch_result = result_json.get("result", {})
+    results = batch_result.get("result") or {}
+    errors = batch_result.get("result_error") or {}
+    totals = batch_result.get("result_total") or {}
+    # Пустые результаты Bitrix24 отдает списком, а не словарем
+    if isinstance(results, list):
+        results = {}
+    if isinstance(errors, list):
+        errors = {}
+    if isinstance(totals, list):
+        totals = {}
+    log_debug("<- call_batch: успешно: {}, ошибок: {}", [len(results), len(errors)])
+    return {"results": results, "errors": errors, "totals": totals}
+
+# Выгрузка задач для отчетов (args["export"] = "ndjson" или "csv").
+# Задачи читаются страницами tasks.task.list по курсору start в порядке возрастания ID
+# (новые задачи попадают в конец и не сдвигают страницы), и строки каждой страницы
+# сразу пишутся в файл или в ответ. Поэтому память не зависит от
+# числа задач: в ней одна страница, каталог проектов и имена ответственных из общего кеша.
+# Без файла ответ содержит не больше EXPORT_RESPONSE_ROWS строк и курсор next_start,
+# с которым выгрузку продолжает следующий вызов (args["export_start"]). Выгрузка
+# в файл тоже останавливается с курсором, если бюджет времени команды на исходе.
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = ["id", "title", "status", "deadline", "responsible", "project", "description"]
+# Точка с запятой: так CSV открывается в русском Excel без мастера импорта
+EXPORT_CSV_DELIMITER = ";"
+EXPORT_RESPONSE_ROWS = 500
+EXPORT_PAGE_TIMEOUT = 15
+EXPORT_RESERVE_SECONDS = 2
+# Файл выгрузки args["export_path"] - только имя файла. Каталог выгрузок задает
+# резидентный раннер: он подставляет EXPORT_OPEN, которая открывает файл только
+# внутри этого каталога. Без нее (на платформе) выгрузка идет только в ответ.
+try:
+    EXPORT_OPEN
+except NameError:
+    EXPORT_OPEN = None
+
+def is_export_file_name(name):
+    """Проверяет, что name - имя файла без каталогов и переходов вверх ('/', '\\', '..')."""
+    if not isinstance(name, str) or not name.strip():
+        return False
+    return "/" not in name and "\\" not in name and ".." not in name and "\x00" not in name
+
+def resolve_user_names(webhook, user_ids, user_cache):
+    """
+    Дополняет user_cache именами пользователей user_ids. Имена берутся из общего
+    кеша портала CACHE_STORE["user_names"], а недостающие запрашиваются одним вызовом batch.
+    """
+    portal_user_names = CACHE_STORE.setdefault("user_names", {}).setdefault(get_portal_url(webhook), {})
+    missing = []
+    for user_id in user_ids:
+        if user_id in user_cache:
+            continue
+        if not user_id:
+            user_cache[user_id] = "Не назначен"
+        elif user_id in portal_user_names:
+            user_cache[user_id] = portal_user_names[user_id]
+        elif user_id not in missing:
+            missing.append(user_id)
+    for start in range(0, len(missing), BATCH_MAX_COMMANDS):
+        chunk = missing[start:start + BATCH_MAX_COMMANDS]
+        try:
+            batch = call_batch(webhook, [{"key": f"user_{user_id}", "method": "user.get", "params": {"ID": user_id}}
+                                         for user_id in chunk])
+        except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+            log_warning("resolve_user_names: имена не загружены: {}", [e])
+            batch = {"results": {}, "errors": {}}
+        for user_id in chunk:
+            found = batch["results"].get(f"user_{user_id}") or []
+            if found:
+                full_name = f"{found[0].get('NAME', '')} {found[0].get('LAST_NAME', '')}".strip()
+                portal_user_names[user_id] = full_name
+                user_cache[user_id] = full_name
+            else:
+                user_cache[user_id] = f"ID: {user_id}"
+
+def export_task_row(task, project_map, user_cache):
+    """Строка выгрузки из задачи tasks.task.list (колонки EXPORT_COLUMNS)."""
+    status_id = int(task.get('status', 0))
+    group_id = int(task.get('groupId') or 0)
+    return {
+        "id": int(task.get('id', 0)),
+        "title": task.get('title', 'Без названия'),
+        "status": REVERSE_STATUS_MAP.get(status_id, f"Неизвестный статус ({status_id})"),
+        "deadline": format_task_deadline(task.get('deadline')),
+        "responsible": user_cache.get(int(task.get('responsibleId') or 0), ""),
+        "project": project_map.get(group_id, f"Проект ID:{group_id}"),
+        "description": clean_task_description(task.get('description')),
+    }
+
+def csv_value(value):
+    """Значение ячейки CSV: в кавычках, если содержит разделитель, кавычку или перевод строки."""
+    text = "" if value is None else str(value)
+    if EXPORT_CSV_DELIMITER in text or '"' in text or "\n" in text or "\r" in text:
+        text = '"' + text.replace('"', '""') + '"'
+    return text
+
+def format_export_row(row, export_format):
+    """Строка NDJSON или CSV (с переводом строки) для одной задачи."""
+    if export_format == "csv":
+        return EXPORT_CSV_DELIMITER.join(csv_value(row[column]) for column in EXPORT_COLUMNS) + "\r\n"
+    return json.dumps(row, ensure_ascii=False) + "\n"
+
+def export_portal_tasks(webhook, args):
+    """
+    Выгружает задачи портала по фильтрам show_task (проект, срок, args["include_completed"])
+    в формате args["export"]: в файл args["export_path"] каталога выгрузок или частями в ответ.
+    Возвращает сводку {"status", "format", "rows", "total", "next_start", "path" или "data"}.
+    """
+    export_format = str(args.get("export")).lower()
+    if export_format not in EXPORT_FORMATS:
+        return {"status": "error", "message": f"Неизвестный формат выгрузки '{args.get('export')}'. Поддерживаются: {', '.join(EXPORT_FORMATS)}."}
+    if portal_is_unavailable(webhook):
+        return {"status": "error", "message": "Bitrix24 временно недоступен. Попробуйте позже."}
+
+    built_filter = build_task_filter(webhook, args, include_completed=bool(args.get("include_completed")))
+    if "error" in built_filter:
+        return {"status": "error", "message": built_filter["error"]}
+    try:
+        start = int(args.get("export_start") or 0)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": f"Некорректный курсор выгрузки: '{args.get('export_start')}'."}
+
+    export_path = args.get("export_path")
+    if export_path and EXPORT_OPEN is None:
+        return {"status": "error", "message": "Выгрузка в файл недоступна: каталог выгрузок не настроен. Уберите export_path, чтобы получить строки в ответе."}
+    if export_path and not is_export_file_name(export_path):
+        return {"status": "error", "message": f"Некорректное имя файла выгрузки: '{export_path}'. Укажите только имя файла, без каталогов и '..'."}
+    log_info("-> export_portal_tasks: формат {}, с позиции {}, файл: {}", [export_format, start, export_path])
+    project_map = get_projects_map(webhook)
+    user_cache = {}
+    chunks = []
+    rows = 0
+    total = None
+    next_start = None
+    # Продолжение выгрузки дописывается в тот же файл, заголовок CSV пишется один раз
+    try:
+        output = EXPORT_OPEN(export_path, bool(start)) if export_path else None
+    except (ValueError, OSError) as e:
+        log_error("<- export_portal_tasks: файл выгрузки '{}' не открыт: {}", [export_path, e])
+        return {"status": "error", "message": f"Не удалось открыть файл выгрузки '{export_path}': {e}"}
+    try:
+        if export_format == "csv" and not start:
+            header = EXPORT_CSV_DELIMITER.join(EXPORT_COLUMNS) + "\r\n"
+            if output is not None:
+                output.write(header)
+            else:
+                chunks.append(header)
+        while True:
+            params = {'order': {'ID': 'ASC'}, 'filter': built_filter["filter"], 'start': start}
+            response = b24_post(webhook, "tasks.task.list", params, timeout=EXPORT_PAGE_TIMEOUT)
+            response.raise_for_status()
+            page = response.json()
+            if page.get("error"):
+                return {"status": "error", "message": f"Ошибка API Bitrix24: {page.get('error_description', 'Нет описания')}",
+                        "rows": rows, "next_start": start}
+            tasks = page.get("result", {}).get("tasks", [])
+            total = page.get("total", total)
+            resolve_user_names(webhook, [int(task.get('responsibleId') or 0) for task in tasks], user_cache)
+            lines = "".join(format_export_row(export_task_row(task, project_map, user_cache), export_format) for task in tasks)
+            if output is not None:
+                output.write(lines)
+                output.flush()
+            else:
+                chunks.append(lines)
+            rows += len(tasks)
+            log_sampled("export_portal_tasks", "export_portal_tasks: выгружено строк: {}", [rows])
+
+            next_start = page.get("next")
+            if next_start is None:
+                break
+            start = next_start
+            if output is None and rows >= EXPORT_RESPONSE_ROWS:
+                break
+            if not budget_allows(EXPORT_RESERVE_SECONDS):
+                log_warning("export_portal_tasks: бюджет времени исчерпан, выгрузка остановлена на позиции {}", [start])
+                break
+    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        log_error("<- export_portal_tasks: ошибка на позиции {}: {}", [start, e])
+        return {"status": "error", "message": f"Ошибка сети при обращении к Bitrix24: {e}", "rows": rows, "next_start": start}
+    finally:
+        if output is not None:
+            output.close()
+
+    summary = {"status": "success", "format": export_format, "rows": rows, "total": total, "next_start": next_start}
+    if export_path:
+        summary["path"] = export_path
+    else:
+        summary["data"] = "".join(chunks)
+    if next_start is not None:
+        summary["message"] = f"Выгружено строк: {rows} из {total}. Для продолжения передайте export_start={next_start}."
+    else:
+        summary["message"] = f"Выгрузка завершена, строк: {rows}."
+    log_info("<- export_portal_tasks: строк {}, следующая позиция {}", [rows, next_start])
+    return summary
+
+# Сводка по проектам (args["summary"]): сколько открытых задач в каждом проекте,
+# по статусам и сколько из них просрочено, без загрузки карточек задач.
+# Для каждого проекта и статуса в batch уходит tasks.task.list с одним полем ID,
+# а число задач берется из result_total ответа batch. Команды проектов собираются
+# группами по SUMMARY_PROJECTS_PER_BATCH, чтобы уложиться в лимит команд batch.
+SUMMARY_STATUSES = [1, 2, 3, 4, 6]
+SUMMARY_PROJECTS_PER_BATCH = BATCH_MAX_COMMANDS // (len(SUMMARY_STATUSES) + 1)
+
+def summary_commands(project_id, base_filter, now_str):
+    """Команды batch для подсчета задач проекта: по одной на статус и одна на просроченные."""
+    commands = []
+    for status_id in SUMMARY_STATUSES:
+        status_filter = dict(base_filter)
+        status_filter['GROUP_ID'] = project_id
+        status_filter['STATUS'] = status_id
+        commands.append({"key": f"p{project_id}_s{status_id}", "method": "tasks.task.list",
+                         "params": {"filter": status_filter, "select": ["ID"]}})
+    overdue_filter = dict(base_filter)
+    overdue_filter['GROUP_ID'] = project_id
+    overdue_filter['!STATUS'] = '5'
+    overdue_filter['<DEADLINE'] = now_str
+    commands.append({"key": f"p{project_id}_overdue", "method": "tasks.task.list",
+                     "params": {"filter": overdue_filter, "select": ["ID"]}})
+    return commands
+
+def batch_count(batch, key):
+    """Число задач по команде batch: result_total, а без него длина страницы ID."""
+    if key in batch["totals"]:
+        return int(batch["totals"][key])
+    page = batch["results"].get(key) or {}
+    return len(page.get("tasks", [])) if isinstance(page, dict) else 0
+
+def summarize_portal_tasks(webhook, args):
+    """
+    Считает открытые задачи портала по проектам, статусам и просроченные.
+    Учитывает фильтры project_name и deadline. Возвращает словарь ответа
+    {"status", "summary": {"total", "overdue", "projects": [...]}} для main().
+    """
+    cache_key = "summary|" + get_listing_cache_key(args)
+    generation = get_listing_generation(webhook)
+    if not args.get("cache_refresh"):
+        cached = get_cached_listing(webhook, cache_key)
+        if cached:
+            if cached["stale"]:
+                count_cache_event("show_task", "stale")
+                schedule_listing_refresh(cache_key, args, webhook)
+            else:
+                count_cache_event("show_task", "hit")
+            return cached["payload"]
+        count_cache_event("show_task", "miss")
+    if portal_is_unavailable(webhook):
+        degraded = get_degraded_listing(webhook, cache_key)
+        if degraded:
+            return degraded
+        return {"status": "error", "message": "Bitrix24 временно недоступен. Попробуйте позже."}
+
+    built_filter = build_task_filter(webhook, args, include_completed=True)
+    if "error" in built_filter:
+        return {"status": "error", "message": built_filter["error"]}
+    base_filter = built_filter["filter"]
+    if 'GROUP_ID' in base_filter:
+        project_ids = [int(base_filter.pop('GROUP_ID'))]
+    else:
+        try:
+            index = get_project_index(webhook)
+        except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+            return {"status": "error", "message": f"Не удалось загрузить список проектов Bitrix24: {e}"}
+        # Задачи без проекта считаются отдельной строкой (GROUP_ID = 0)
+        project_ids = [0] + list(index["names"].keys())
+    project_map = get_projects_map(webhook)
+
+    today = datetime.datetime.now()
+    now_str = f"{today.year:04d}-{today.month:02d}-{today.day:02d} {today.hour:02d}:{today.minute:02d}:{today.second:02d}"
+    log_debug("-> summarize_portal_tasks: проектов: {}, фильтр: {}", [len(project_ids), base_filter])
+    rows = []
+    partial = False
+    try:
+        for start in range(0, len(project_ids), SUMMARY_PROJECTS_PER_BATCH):
+            if not budget_allows(0):
+                partial = True
+                break
+            group = project_ids[start:start + SUMMARY_PROJECTS_PER_BATCH]
+            commands = []
+            for project_id in group:
+                commands.extend(summary_commands(project_id, base_filter, now_str))
+            batch = call_batch(webhook, commands)
+            for project_id in group:
+                statuses = {}
+                total = 0
+                for status_id in SUMMARY_STATUSES:
+                    count = batch_count(batch, f"p{project_id}_s{status_id}")
+                    if count:
+                        statuses[REVERSE_STATUS_MAP[status_id]] = count
+                        total += count
+                if total:
+                    rows.append({"projectName": project_map.get(project_id, f"Проект ID:{project_id}"), "total": total,
+                                 "overdue": batch_count(batch, f"p{project_id}_overdue"), "statuses": statuses})
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+        degraded = get_degraded_listing(webhook, cache_key)
+        if degraded:
+            return degraded
+        return {"status": "error", "message": f"Ошибка сети при обращении к Bitrix24: {e}"}
+
+    # Проекты с большим числом задач первыми, при равенстве — по названию
+    order = sorted([(-rows[position]["total"], rows[position]["projectName"], position) for position in range(len(rows))])
+    rows = [rows[item[2]] for item in order]
+    summary = {"total": sum(row["total"] for row in rows), "overdue": sum(row["overdue"] for row in rows), "projects": rows}
+    final_result = {"status": "success", "summary": summary}
+    if partial:
+        # Неполную сводку не кешируем
+        final_result["partial"] = True
+        final_result["message"] = "Bitrix24 отвечает медленно, посчитаны не все проекты."
+        return final_result
+    if not rows:
+        final_result["message"] = "Задачи по вашим критериям не найдены."
+    store_listing(webhook, cache_key, final_result, generation)
+    log_debug("<- summarize_portal_tasks: задач: {}, просрочено: {}", [summary["total"], summary["overdue"]])
+    return final_result
+
+# Сводный просмотр всех порталов пользователя (args["all_portals"]).
+# Резидентный раннер подставляет PARALLEL_MAP(функция, списки аргументов, таймаут),
+# и порталы опрашиваются параллельно: ответ ждет самый медленный из уложившихся
+# в SHOW_TASK_MULTI_BUDGET_SECONDS. В песочнице платформы потоков нет, поэтому
+# порталы опрашиваются по очереди, пока не исчерпан тот же бюджет.
+SHOW_TASK_PORTAL_TIMEOUT = 8
+SHOW_TASK_MULTI_BUDGET_SECONDS = 12
+
+try:
+    PARALLEL_MAP
+except NameError:
+    PARALLEL_MAP = None
+
+def get_portal_label(webhook):
+    """Подпись портала в сводном списке: домен без схемы."""
+    return get_portal_url(webhook).split('//')[-1]
+
+def fetch_portal_listing(webhook, args):
+    """Список задач одного портала для сводного режима; ошибка портала не прерывает опрос остальных."""
+    try:
+        return list_portal_tasks(webhook, args, timeout=SHOW_TASK_PORTAL_TIMEOUT, missing_project_ok=True)
+    except Exception as e:
+        log_warning("fetch_portal_listing: ошибка портала {}: {}", [get_portal_label(webhook), e])
+        return {"status": "error", "message": f"Ошибка при обращении к Bitrix24: {e}"}
+
+def collect_portal_listings(user_webhooks, args):
+    """
+    Опрашивает порталы и возвращает ответы в порядке user_webhooks.
+    Портал, не ответивший в пределах бюджета, представлен значением None.
+    """
+    # Ожидание порталов не выходит за бюджет всей команды (секунда остается на сборку ответа)
+    wait_seconds = SHOW_TASK_MULTI_BUDGET_SECONDS
+    remaining = remaining_budget()
+    if remaining is not None:
+        wait_seconds = max(min(wait_seconds, remaining - 1), 0)
+
+    if PARALLEL_MAP is not None:
+        calls = [[webhook, args] for webhook in user_webhooks]
+        return PARALLEL_MAP(fetch_portal_listing, calls, wait_seconds)
+
+    started_at = datetime.datetime.now()
+    budget = datetime.timedelta(seconds=wait_seconds)
+    listings = []
+    for webhook in user_webhooks:
+        if datetime.datetime.now() - started_at > budget:
+            log_warning("collect_portal_listings: бюджет исчерпан, портал {} пропущен", [get_portal_label(webhook)])
+            listings.append(None)
+        else:
+            listings.append(fetch_portal_listing(webhook, args))
+    return listings
+
+def list_all_portals(user_webhooks, args):
+    """
+    Сводный список задач со всех порталов пользователя; проекты подписаны порталом.
+    Если часть порталов не ответила вовремя или с ошибкой, возвращаются задачи
+    остальных (и сохраненные данные отставших, если есть) с пометкой "partial": true.
+    """
+    user_webhooks = [normalize_webhook(webhook) for webhook in user_webhooks]
+    listings = collect_portal_listings(user_webhooks, args)
+    cache_key = get_listing_cache_key(args)
+
+    projects_output = []
+    portals_status = []
+    lagging_portals = []
+    for index in range(len(user_webhooks)):
+        webhook = user_webhooks[index]
+        portal = get_portal_label(webhook)
+        listing = listings[index]
+        portal_status = {"portal": portal, "status": "ok"}
+        if listing is None:
+            portal_status["status"] = "timeout"
+            listing = get_degraded_listing(webhook, cache_key)
+        elif listing.get("status") != "success":
+            portal_status["status"] = "error"
+            portal_status["message"] = listing.get("message")
+            listing = None
+        if listing and listing.get("stale"):
+            portal_status["cachedAt"] = listing.get("cachedAt")
+            if portal_status["status"] == "ok":
+                portal_status["status"] = "stale"
+        if listing and listing.get("degraded") and portal_status["status"] == "ok":
+            portal_status["status"] = "partial"
+            portal_status["degraded"] = listing["degraded"]
+        if portal_status["status"] != "ok":
+            lagging_portals.append(portal)
+        portals_status.append(portal_status)
+
+        if listing:
+            for project in listing.get("projects", []):
+                projects_output.append({
+                    "projectName": f"{portal}: {project['projectName']}",
+                    "portal": portal,
+                    "tasks": project["tasks"]
+                })
+
+    if len(lagging_portals) == len(user_webhooks) and not projects_output:
+        return {"status": "error", "message": "Порталы Bitrix24 не ответили. Попробуйте позже.", "portals": portals_status}
+
+    final_result = {"status": "success", "projects": projects_output, "portals": portals_status}
+    if lagging_portals:
+        final_result["partial"] = True
+        final_result["message"] = f"Не ответили вовремя или недоступны: {', '.join(lagging_portals)}. Показаны задачи остальных порталов."
+    elif not projects_output:
+        final_result["message"] = "Задачи по вашим критериям не найдены."
+    return final_result
+
+def main(args):
+    """
+    Основная функция для получения и форматирования списка задач.
+    """
+    start_log_context("show_task", args)
+    start_latency_budget()
+    # 1. Получение вебхука
+    user_name = args.get("nameUser")
+    webhook = args.get("webhook")
+    if not webhook:
+        gsheet_url = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv"
+        if not user_name:
+            error_message = {"status": "error", "message": "Ошибка: Не удалось определить пользователя для поиска вебхука."}
+            return json.dumps(error_message, ensure_ascii=False)
+        if args.get("all_portals") and not args.get("export") and not args.get("summary"):
+            user_webhooks = find_user_webhooks(gsheet_url, user_name)
+            if len(user_webhooks) > 1:
+                return json.dumps(list_all_portals(user_webhooks, args), ensure_ascii=False)
+        webhook = get_webhook_from_sheet(gsheet_url, user_name)
+
+    if not webhook:
+        error_message = {"status": "error", "message": f"Ошибка: Вебхук для пользователя '{user_name}' не найден."}
         return json.dumps(error_message, ensure_ascii=False)
+    if not webhook.endswith('/'):
+        webhook += '/'
+
+    if args.get("export"):
+        return json.dumps(export_portal_tasks(webhook, args), ensure_ascii=False)
+    if args.get("summary"):
+        return json.dumps(summarize_portal_tasks(webhook, args), ensure_ascii=False)
+    return json.dumps(list_portal_tasks(webhook, args), ensure_ascii=False)
 
 
 # Точка входа для платформы NextBot
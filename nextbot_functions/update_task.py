@@ -1,116 +1,848 @@
+# Общее хранилище кешей. Резидентный раннер подставляет один и тот же словарь
+# во все скрипты; при обычном запуске на платформе оно живет в пределах вызова.
+try:
+    CACHE_STORE
+except NameError:
+    CACHE_STORE = {}
 
+# Журнал команды. Сообщения пишутся через log_debug/log_info/log_warning/log_error
+# шаблоном с {} и списком значений: значения подставляются и обрезаются до
+# LOG_PAYLOAD_LIMIT символов, только если уровень сообщения включен, поэтому
+# отключенные отладочные сообщения не форматируют аргументы, поля и ответы Bitrix24.
+# Каждая строка помечается ID вызова, по которому собираются сообщения одной команды.
+# Уровень задается аргументом "log_level" или переменной LOG_LEVEL (ее подставляет
+# резидентный раннер по настройке логгера), по умолчанию "info".
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PAYLOAD_LIMIT = 300
+# Сообщения из циклов (log_sampled) пишутся первый раз и затем каждый LOG_SAMPLE_EVERY-й
+LOG_SAMPLE_EVERY = 100
 
-def get_webhook_from_sheet(sheet_url, user_name):
+try:
+    LOG_LEVEL
+except NameError:
+    LOG_LEVEL = "info"
+
+LOG_CONTEXT = {"correlation_id": "-", "level": LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["info"]), "samples": {}}
+
+def start_log_context(command, args):
+    """Начинает журнал вызова: уровень из аргументов и новый ID вызова; вызывается в начале main()."""
+    level = str(args.get("log_level") or LOG_LEVEL).lower()
+    LOG_CONTEXT["level"] = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+    counter = CACHE_STORE.setdefault("log_counter", {"value": 0})
+    counter["value"] += 1
+    correlation_id = args.get("correlation_id") or f"{command}-{datetime.datetime.now().strftime('%H%M%S')}-{counter['value']}"
+    LOG_CONTEXT["correlation_id"] = str(correlation_id)
+    LOG_CONTEXT["samples"] = {}
+
+def log_enabled(level):
+    """Проверяет, включен ли уровень; нужна, когда значения для сообщения дорого вычислять."""
+    return LOG_LEVELS[level] >= LOG_CONTEXT["level"]
+
+def log_value(value):
+    """Строка для подстановки в сообщение: словари и списки в JSON, длинные значения обрезаются."""
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    if len(text) > LOG_PAYLOAD_LIMIT:
+        text = text[:LOG_PAYLOAD_LIMIT] + f"... (еще {len(text) - LOG_PAYLOAD_LIMIT} симв.)"
+    return text
+
+def log_message(level, message, values):
+    """Пишет сообщение уровня level, если он включен."""
+    if LOG_LEVELS[level] < LOG_CONTEXT["level"]:
+        return
+    if values:
+        parts = message.split("{}")
+        message = parts[0]
+        for position in range(1, len(parts)):
+            if position <= len(values):
+                message += log_value(values[position - 1])
+            else:
+                message += "{}"
+            message += parts[position]
+    debug(f"[{LOG_CONTEXT['correlation_id']}] {level.upper()} {message}")
+
+def log_debug(message, values=None):
+    log_message("debug", message, values)
+
+def log_info(message, values=None):
+    log_message("info", message, values)
+
+def log_warning(message, values=None):
+    log_message("warning", message, values)
+
+def log_error(message, values=None):
+    log_message("error", message, values)
+
+def log_sampled(key, message, values=None):
+    """Отладочное сообщение из цикла: пишется первое и каждое LOG_SAMPLE_EVERY-е с одним ключом."""
+    if LOG_LEVELS["debug"] < LOG_CONTEXT["level"]:
+        return
+    samples = LOG_CONTEXT["samples"]
+    count = samples.get(key, 0) + 1
+    samples[key] = count
+    if count == 1 or count % LOG_SAMPLE_EVERY == 0:
+        log_message("debug", message + f" [{key}: {count}]", values)
+
+# Проекции полей: для каждого метода Bitrix24 перечислены только те поля,
+# которые скрипт читает из ответа. b24_post подставляет эти параметры
+# в каждый вызов метода, если они не заданы явно.
+B24_FIELD_PROJECTIONS = {
+    "sonet_group.get": {"SELECT": ["ID", "NAME"]},  # каталог проектов для нечеткого поиска
+    "user.search": {"SELECT": ["ID"]},  # ID нового исполнителя
+    "tasks.task.list": {"select": ["ID", "TITLE", "STATUS", "GROUP_ID"]},  # индекс названий задач
+    "tasks.task.update": {"select": ["ID", "CREATED_BY", "TITLE", "STATUS", "GROUP_ID"]},  # ссылка на задачу и запись индекса
+}
+
+def apply_field_projection(method, params):
+    """Дополняет параметры вызова проекцией полей метода из B24_FIELD_PROJECTIONS."""
+    projection = B24_FIELD_PROJECTIONS.get(method)
+    if not projection:
+        return params
+    projected = dict(params or {})
+    for option in projection:
+        projected.setdefault(option, projection[option])
+    return projected
+
+# Предохранитель (circuit breaker) для каждого портала Bitrix24.
+# После серии ошибок или медленных ответов портал считается недоступным
+# на CIRCUIT_OPEN_SECONDS, запросы к нему сразу завершаются ошибкой,
+# затем пропускается один пробный запрос.
+B24_TIMEOUT = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW = 20
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_SLOW_SECONDS = 8
+CIRCUIT_OPEN_SECONDS = 30
+
+def get_circuit(portal_url):
+    """Возвращает состояние предохранителя портала, создавая его при первом обращении."""
+    circuits = CACHE_STORE.setdefault("circuit_breakers", {})
+    circuit = circuits.get(portal_url)
+    if circuit is None:
+        circuit = {"state": "closed", "failures": 0, "outcomes": [], "opened_at": None, "rejected": 0}
+        circuits[portal_url] = circuit
+    return circuit
+
+def circuit_allows_request(portal_url):
+    """Проверяет, можно ли сейчас отправить запрос на портал."""
+    circuit = get_circuit(portal_url)
+    if circuit["state"] == "closed":
+        return True
+    if circuit["state"] == "open":
+        if datetime.datetime.now() - circuit["opened_at"] >= datetime.timedelta(seconds=CIRCUIT_OPEN_SECONDS):
+            log_info("circuit_breaker: пробный запрос к порталу {}", [portal_url])
+            circuit["state"] = "half_open"
+            return True
+        return False
+    # half_open: пробный запрос уже отправлен, остальные ждут его результата
+    return False
+
+def record_circuit_outcome(portal_url, is_ok):
+    """Учитывает результат запроса и при необходимости размыкает или замыкает предохранитель."""
+    circuit = get_circuit(portal_url)
+    outcomes = circuit["outcomes"]
+    outcomes.append(is_ok)
+    if len(outcomes) > CIRCUIT_WINDOW:
+        del outcomes[0]
+
+    if is_ok:
+        circuit["failures"] = 0
+        if circuit["state"] != "closed":
+            log_info("circuit_breaker: портал {} снова доступен.", [portal_url])
+            circuit["state"] = "closed"
+            circuit["outcomes"] = [True]
+        return
+
+    circuit["failures"] += 1
+    error_rate = outcomes.count(False) / len(outcomes)
+    too_many_errors = len(outcomes) >= CIRCUIT_WINDOW // 2 and error_rate >= CIRCUIT_ERROR_RATE
+    if circuit["state"] == "half_open" or circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD or too_many_errors:
+        if circuit["state"] != "open":
+            log_warning("circuit_breaker: портал {} временно отключен (ошибок подряд: {}).", [portal_url, circuit['failures']])
+        circuit["state"] = "open"
+        circuit["opened_at"] = datetime.datetime.now()
+
+# Бюджет времени команды: NextBot ждет ответ скрипта ограниченное время, поэтому
+# вызов main() укладывается в COMMAND_BUDGET_SECONDS. Каждый запрос получает таймаут
+# не больше оставшегося времени, а когда времени не осталось, запрос не отправляется.
+COMMAND_BUDGET_SECONDS = 25
+BUDGET_MIN_TIMEOUT = 0.5
+LATENCY_BUDGET = {"deadline": None}
+
+def start_latency_budget(seconds=COMMAND_BUDGET_SECONDS):
+    """Начинает отсчет бюджета времени команды; вызывается в начале main()."""
+    LATENCY_BUDGET["deadline"] = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+def remaining_budget():
+    """Сколько секунд осталось до конца бюджета команды (None, если бюджет не задан)."""
+    deadline = LATENCY_BUDGET["deadline"]
+    if deadline is None:
+        return None
+    left = deadline - datetime.datetime.now()
+    return left.days * 86400 + left.seconds + left.microseconds / 1000000
+
+def budget_timeout(timeout):
+    """Урезает таймаут запроса до оставшегося бюджета; если бюджет исчерпан, выбрасывает requests.exceptions.Timeout."""
+    remaining = remaining_budget()
+    if remaining is None:
+        return timeout
+    if remaining < BUDGET_MIN_TIMEOUT:
+        raise requests.exceptions.Timeout("Бюджет времени команды исчерпан, запрос не отправлен.")
+    return min(timeout, remaining)
+
+def b24_post(webhook_url, method, params=None, timeout=B24_TIMEOUT, stream=False):
     """
-    Получает вебхук пользователя из опубликованной Google Таблицы CSV.
-    Формат таблицы: A - Имя, B - Вебхук.
+    Вызывает метод REST API Bitrix24 с таймаутом и через предохранитель портала.
+    Если портал временно отключен, сразу выбрасывает requests.exceptions.ConnectionError.
+    При stream=True тело ответа не загружается целиком (см. open_task_stream).
     """
-    debug(f"-> get_webhook_from_sheet: ищем вебхук для '{user_name}'")
+    portal_url = webhook_url.split('/rest/')[0]
+    # Таймаут считается до проверки предохранителя, чтобы не оставить пробный запрос неотправленным
+    timeout = budget_timeout(timeout)
+    if not circuit_allows_request(portal_url):
+        get_circuit(portal_url)["rejected"] += 1
+        raise requests.exceptions.ConnectionError(f"Портал {portal_url} временно недоступен, запрос {method} не отправлен.")
+
+    params = apply_field_projection(method, params)
+    started_at = datetime.datetime.now()
     try:
-        response = requests.get(sheet_url, timeout=5)
+        response = requests.post(f"{webhook_url}{method}.json", json=params, timeout=timeout, stream=stream)
+    except Exception:
+        record_circuit_outcome(portal_url, False)
+        raise
+    is_slow = datetime.datetime.now() - started_at > datetime.timedelta(seconds=CIRCUIT_SLOW_SECONDS)
+    record_circuit_outcome(portal_url, response.status_code < 500 and not is_slow)
+    return response
+
+# Потоковое чтение больших ответов tasks.task.list: задачи разбираются по одной,
+# полный текст ответа и дерево всех задач одновременно в памяти не держатся.
+STREAM_CHUNK_SIZE = 65536
+
+def open_task_stream(response):
+    """
+    Начинает потоковое чтение ответа tasks.task.list.
+    Читает ответ до начала массива задач и возвращает состояние потока.
+    Если массива нет (ответ с ошибкой), в состоянии заполняются error и error_description.
+    """
+    if not response.encoding:
+        response.encoding = "utf-8"
+    stream = {
+        "chunks": response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True),
+        "buffer": "",
+        "error": None,
+        "error_description": None,
+        "has_tasks": False,
+        "finished": False,
+        "decoder": json.JSONDecoder(),
+    }
+    for chunk in stream["chunks"]:
+        stream["buffer"] += chunk
+        match = re.search(r'"result"\s*:\s*\{\s*"tasks"\s*:\s*\[', stream["buffer"])
+        if match:
+            stream["buffer"] = stream["buffer"][match.end():]
+            stream["has_tasks"] = True
+            return stream
+
+    # Массива задач нет: ответ небольшой, разбираем его целиком
+    payload = json.loads(stream["buffer"]) if stream["buffer"].strip() else {}
+    stream["buffer"] = ""
+    if isinstance(payload, dict) and payload.get("error"):
+        stream["error"] = payload.get("error")
+        stream["error_description"] = payload.get("error_description", "Нет описания")
+    return stream
+
+def read_stream_task(stream, fields):
+    """
+    Читает из потока следующую задачу, оставляя в ней только поля из fields.
+    Возвращает None, когда список задач закончился. Позиция чтения хранится
+    в самом состоянии потока, поэтому функция вызывается в обычном цикле while.
+    """
+    if not stream["has_tasks"] or stream["finished"]:
+        return None
+    buffer = stream["buffer"]
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if not buffer:
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise json.JSONDecodeError("Ответ оборвался внутри списка задач", "", 0)
+            buffer = chunk
+            continue
+        if buffer[0] == "]":
+            # Хвост ответа (курсор next, total) остается в потоке для read_stream_next
+            stream["buffer"] = buffer[1:]
+            stream["finished"] = True
+            return None
+        try:
+            decoded = stream["decoder"].raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Задача пришла не целиком, дочитываем следующий фрагмент
+            chunk = next(stream["chunks"], None)
+            if chunk is None:
+                raise
+            buffer += chunk
+            continue
+        task = decoded[0]
+        stream["buffer"] = buffer[decoded[1]:]
+        return {field: task[field] for field in fields if field in task}
+
+def read_stream_next(stream):
+    """
+    Дочитывает ответ tasks.task.list после списка задач и возвращает курсор
+    следующей страницы ("next") или None, если страница последняя.
+    """
+    tail = stream["buffer"]
+    for chunk in stream["chunks"]:
+        tail += chunk
+    stream["buffer"] = ""
+    match = re.search(r'"next"\s*:\s*(\d+)', tail)
+    return int(match.group(1)) if match else None
+
+# Ключи для нечеткого поиска с учетом ошибок распознавания речи. Для каждого слова
+# строятся основа без падежного окончания в латинской транслитерации и фонетический
+# код, поэтому "маркетинга", "Маркетинг" и "marketing" совпадают по ключу.
+RUSSIAN_ENDINGS = sorted((
+    "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему", "иях", "ях", "ах", "ов", "ев",
+    "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ию", "ия", "ии", "ью", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь", "й",
+), key=len, reverse=True)
+TRANSLIT_MAP = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh",
+    "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+PHONETIC_REPLACEMENTS = (
+    ("shch", "s"), ("sh", "s"), ("zh", "s"), ("ch", "c"), ("kh", "k"), ("ts", "s"), ("ph", "f"),
+    ("ck", "k"), ("x", "ks"), ("w", "v"), ("q", "k"), ("j", "i"), ("y", "i"),
+    ("b", "p"), ("v", "f"), ("g", "k"), ("d", "t"), ("z", "s"),
+)
+PHONETIC_VOWELS = "aeiou"
+PROJECT_INDEX_TTL_SECONDS = 300
+
+def split_words(text):
+    """Нормализует текст и разбивает его на слова."""
+    if not isinstance(text, str) or not text:
+        return []
+    return re.sub(r'[^\w\s]', '', text).lower().replace('ё', 'е').split()
+
+def stem_word(word):
+    """Отбрасывает типичное русское окончание, если остается основа не короче трех букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def transliterate_word(word):
+    """Переводит кириллицу в латиницу, латиницу и цифры оставляет как есть."""
+    return ''.join(TRANSLIT_MAP.get(c, c) for c in word)
+
+def phonetic_code(latin_word):
+    """Грубый фонетический код: глухие и звонкие согласные совпадают, гласные после первой буквы отбрасываются."""
+    code = latin_word
+    for replacement in PHONETIC_REPLACEMENTS:
+        code = code.replace(replacement[0], replacement[1])
+    if not code:
+        return ""
+    result_chars = [code[0]]
+    for c in code[1:]:
+        if c not in PHONETIC_VOWELS and c != result_chars[-1]:
+            result_chars.append(c)
+    return ''.join(result_chars)
+
+def word_keys(word):
+    """Ключи слова для индекса: транслитерированная основа и фонетический код (если он не слишком короткий)."""
+    word_keys_cache = CACHE_STORE.setdefault("word_keys", {})
+    keys = word_keys_cache.get(word)
+    if keys is None:
+        latin_stem = transliterate_word(stem_word(word))
+        keys = ["t:" + latin_stem]
+        code = phonetic_code(latin_stem)
+        if len(code) >= 3:
+            keys.append("p:" + code)
+        if len(word_keys_cache) > 50000:
+            word_keys_cache.clear()
+        word_keys_cache[word] = keys
+    return keys
+
+def build_query_index(text):
+    """Индекс ключей поискового запроса: ключ -> номера слов запроса."""
+    words = list(dict.fromkeys(split_words(text)))
+    keys = {}
+    for index in range(len(words)):
+        word = words[index]
+        for key in word_keys(word):
+            keys.setdefault(key, set()).add(index)
+    return {"size": len(words), "keys": keys}
+
+def count_matched_words(query, words):
+    """Сколько слов запроса совпало со словами текста хотя бы по одному ключу."""
+    matched = set()
+    for word in words:
+        for key in word_keys(word):
+            indexes = query["keys"].get(key)
+            if indexes:
+                matched.update(indexes)
+    return len(matched)
+
+def get_project_index(webhook_url):
+    """
+    Возвращает каталог проектов портала с индексом ключей слов названий.
+    Каталог кешируется в CACHE_STORE на PROJECT_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    project_indexes = CACHE_STORE.setdefault("project_index", {})
+    index = project_indexes.get(portal_url)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=PROJECT_INDEX_TTL_SECONDS):
+        return index
+
+    response = b24_post(webhook_url, "sonet_group.get", {})
+    response.raise_for_status()
+    projects = response.json().get("result", [])
+
+    index = {"names": {}, "position": {}, "keys": {}, "built_at": now}
+    for project in projects:
+        project_name = project.get("NAME")
+        if not isinstance(project_name, str) or not project_name:
+            continue
+        project_id = int(project.get("ID"))
+        index["names"][project_id] = project_name
+        index["position"][project_id] = len(index["position"])
+        for word in set(split_words(project_name)):
+            for key in word_keys(word):
+                index["keys"].setdefault(key, set()).add(project_id)
+    project_indexes[portal_url] = index
+    return index
+
+def match_project_id(index, project_name):
+    """
+    Находит в индексе проект с наибольшим числом совпавших слов запроса.
+    Каждое слово запроса - несколько обращений к словарю ключей, без перебора проектов.
+    При равенстве выигрывает проект, который портал вернул первым.
+    """
+    counts = {}
+    for word in dict.fromkeys(split_words(project_name)):
+        matched_ids = set()
+        for key in word_keys(word):
+            matched_ids.update(index["keys"].get(key, ()))
+        for project_id in matched_ids:
+            counts[project_id] = counts.get(project_id, 0) + 1
+
+    best_match_id = None
+    max_common_count = 0
+    for project_id in counts:
+        common_count = counts[project_id]
+        if common_count > max_common_count or (
+                common_count == max_common_count and index["position"][project_id] < index["position"][best_match_id]):
+            max_common_count = common_count
+            best_match_id = project_id
+    return best_match_id
+
+# Индекс названий задач портала для нечеткого поиска: все задачи (кроме
+# удаленных в корзину) с разобранными словами названий, статусом и проектом.
+# Строится потоковым проходом по всем страницам tasks.task.list и живет в CACHE_STORE
+# TASK_INDEX_TTL_SECONDS. Изменения задач не сбрасывают индекс, а исправляют его
+# записи на месте по данным из ответа Bitrix24 (write-through).
+# Запись задачи - компактный кортеж (название, слова, статус, проект): слова
+# названий общие для всех порталов (одна строка на слово), статус и проект -
+# целые числа, остальные поля ответа не хранятся. Поэтому один резидентный
+# процесс держит в памяти индексы нескольких больших порталов.
+TASK_INDEX_TTL_SECONDS = 300
+# Индекс только незавершенных задач (фильтр "!STATUS": 5) кешируется под отдельным ключом
+TASK_INDEX_OPEN_SUFFIX = "|open"
+TASK_TITLE = 0
+TASK_WORDS = 1
+TASK_STATUS = 2
+TASK_GROUP = 3
+INTERNED_WORDS_LIMIT = 200000
+
+def intern_words(words):
+    """Кортеж слов, в котором одинаковые слова всех названий - один и тот же объект строки."""
+    interned = CACHE_STORE.setdefault("interned_words", {})
+    if len(interned) > INTERNED_WORDS_LIMIT:
+        interned.clear()
+    return tuple(interned.setdefault(word, word) for word in words)
+
+def put_task_record(index, task):
+    """Добавляет задачу в индекс или обновляет ее запись полями, которые есть в task."""
+    task_id = int(task.get("id"))
+    record = index["tasks"].get(task_id) or ("", (), 0, 0)
+    title = record[TASK_TITLE]
+    words = record[TASK_WORDS]
+    status = record[TASK_STATUS]
+    group_id = record[TASK_GROUP]
+    if task.get("title") is not None:
+        title = task["title"]
+        words = intern_words(split_words(title))
+    if task.get("status") is not None:
+        status = int(task["status"])
+    if task.get("groupId") is not None:
+        group_id = int(task["groupId"] or 0)
+    # Запись заменяется целиком: читатели индекса видят либо старую, либо новую версию
+    index["tasks"][task_id] = (title, words, status, group_id)
+
+def get_task_index(webhook_url, open_only=False):
+    """
+    Возвращает индекс названий задач портала {"tasks": {id: запись}, "built_at"}.
+    open_only=True - индекс только незавершенных задач, он хранится отдельно от полного.
+    Индекс кешируется в CACHE_STORE на TASK_INDEX_TTL_SECONDS.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    index_key = portal_url + TASK_INDEX_OPEN_SUFFIX if open_only else portal_url
+    task_indexes = CACHE_STORE.setdefault("task_index", {})
+    index = task_indexes.get(index_key)
+    now = datetime.datetime.now()
+    if index and now - index["built_at"] < datetime.timedelta(seconds=TASK_INDEX_TTL_SECONDS):
+        return index
+
+    task_filter = {"ZOMBIE": "N"}
+    if open_only:
+        task_filter["!STATUS"] = 5
+    index = {"tasks": {}, "built_at": now}
+    start = 0
+    # Bitrix24 отдает список страницами по 50 задач: идем по курсору next до последней
+    # страницы, каждую читаем потоково (в памяти одновременно только одна задача ответа)
+    while start is not None:
+        params = {"order": {"ID": "ASC"}, "filter": task_filter, "start": start}
+        response = b24_post(webhook_url, "tasks.task.list", params, stream=True)
         response.raise_for_status()
-        csv_data = response.text
-        lines = csv_data.strip().splitlines()
-
-        for line in lines:
-            if not line.strip(): continue
-            parts = line.strip().split(',')
-            if len(parts) >= 2:
-                sheet_user = parts[0].strip()
-                webhook = parts[1].strip()
-                webhook = ''.join(c for c in webhook if c.isprintable())
-                
-                if sheet_user == user_name:
-                    debug(f"<- get_webhook_from_sheet: Вебхук для '{user_name}' найден.")
-                    if not webhook.endswith('/'): webhook += '/'
-                    return webhook
-        
-        debug(f"<- get_webhook_from_sheet: Пользователь '{user_name}' НЕ найден в таблице.")
+        stream = open_task_stream(response)
+        if stream["error"]:
+            response.close()
+            raise ValueError(stream["error_description"])
+        while True:
+            task = read_stream_task(stream, ["id", "title", "status", "groupId"])
+            if task is None:
+                break
+            put_task_record(index, task)
+        start = read_stream_next(stream)
+        response.close()
+    log_debug("get_task_index: в индексе портала {} задач: {}", [index_key, len(index["tasks"])])
+    task_indexes[index_key] = index
+    return index
+
+def patch_task_index(webhook_url, task=None, deleted_task_id=None):
+    """
+    Исправляет индекс названий задач после изменения (write-through): task — задача
+    из ответа tasks.task.add/update, deleted_task_id — ID удаленной задачи.
+    Если индекс портала еще не построен, исправлять нечего.
+    """
+    portal_url = webhook_url.split('/rest/')[0]
+    task_indexes = CACHE_STORE.get("task_index", {})
+    # Полный индекс и индекс незавершенных задач исправляются одинаково
+    for index_key in (portal_url, portal_url + TASK_INDEX_OPEN_SUFFIX):
+        index = task_indexes.get(index_key)
+        if not index:
+            continue
+        if deleted_task_id is not None:
+            index["tasks"].pop(int(deleted_task_id), None)
+            log_debug("patch_task_index: задача {} удалена из индекса {}.", [deleted_task_id, index_key])
+        if task and task.get("id"):
+            put_task_record(index, task)
+            if index_key != portal_url and index["tasks"][int(task["id"])][TASK_STATUS] == 5:
+                # Завершенная задача уходит из индекса незавершенных
+                index["tasks"].pop(int(task["id"]))
+            log_debug("patch_task_index: задача {} обновлена в индексе {}.", [task.get('id'), index_key])
+
+# Контекст диалога: недавно созданные и измененные задачи и проекты пользователя
+# (CACHE_STORE["session_context"]). Уточняющие команды вроде «поставь ей высокий
+# приоритет» или «перенеси эту задачу на завтра» находят задачу по нему, без
+# загрузки списка задач портала.
+SESSION_CONTEXT_TTL_SECONDS = 1800
+SESSION_CONTEXT_SIZE = 5
+# Указательные слова и местоимения: только они делают фразу ссылкой на предмет разговора
+CONTEXT_REFERENCE_WORDS = {
+    "эта", "эту", "этой", "этот", "этого", "этом", "это", "та", "ту", "той", "тот", "том", "то",
+    "она", "ее", "ей", "нее", "ней", "он", "его", "ему", "него", "нему", "туда", "там",
+}
+# Слова, допустимые рядом с указательным («эту задачу», «тот же проект»), но не ссылка сами по себе
+CONTEXT_REFERENCE_COMPANIONS = {
+    "же", "задача", "задачу", "задаче", "задачей", "задачи", "проект", "проекта", "проекте", "проекту", "проектом",
+}
+
+def get_session_context(webhook_url, user_name):
+    """Возвращает контекст диалога пользователя на портале {"tasks": [...], "projects": [...]}."""
+    context_key = f"{webhook_url.split('/rest/')[0]}|{user_name}"
+    return CACHE_STORE.setdefault("session_context", {}).setdefault(context_key, {"tasks": [], "projects": []})
+
+def push_context_entry(entries, entry):
+    """
+    Ставит запись первой, дополняя ее пустые поля из прежней записи с тем же ID.
+    Возвращает новый список не длиннее SESSION_CONTEXT_SIZE: контекст могут читать параллельные команды.
+    """
+    for item in entries:
+        if item["id"] == entry["id"]:
+            for field in item:
+                if not entry.get(field):
+                    entry[field] = item[field]
+    entry["touched_at"] = datetime.datetime.now()
+    return ([entry] + [item for item in entries if item["id"] != entry["id"]])[:SESSION_CONTEXT_SIZE]
+
+def remember_project(webhook_url, user_name, project_id, project_name=None):
+    """Запоминает проект как последний упомянутый в диалоге."""
+    context = get_session_context(webhook_url, user_name)
+    context["projects"] = push_context_entry(context["projects"], {"id": int(project_id), "name": project_name or ""})
+
+def remember_task(webhook_url, user_name, task_id, title=None, project_id=None):
+    """Запоминает созданную или измененную задачу (и ее проект) как последнюю в диалоге."""
+    if project_id is not None and str(project_id) in ("", "0"):
+        project_id = None
+    context = get_session_context(webhook_url, user_name)
+    entry = {"id": int(task_id), "title": title or "", "project_id": int(project_id) if project_id else None}
+    context["tasks"] = push_context_entry(context["tasks"], entry)
+    if project_id:
+        remember_project(webhook_url, user_name, project_id)
+
+def forget_task(webhook_url, user_name, task_id):
+    """Убирает удаленную задачу из контекста диалога."""
+    context = get_session_context(webhook_url, user_name)
+    context["tasks"] = [item for item in context["tasks"] if item["id"] != int(task_id)]
+
+def recent_context_entries(entries):
+    """Записи контекста моложе SESSION_CONTEXT_TTL_SECONDS, последние первыми."""
+    now = datetime.datetime.now()
+    return [item for item in entries if now - item["touched_at"] < datetime.timedelta(seconds=SESSION_CONTEXT_TTL_SECONDS)]
+
+def is_context_reference(text):
+    """Проверяет, что текст только указывает на предмет разговора («её», «эту задачу», «тот же проект»)."""
+    words = split_words(text)
+    if not any(word in CONTEXT_REFERENCE_WORDS for word in words):
+        return False
+    return all(word in CONTEXT_REFERENCE_WORDS or word in CONTEXT_REFERENCE_COMPANIONS for word in words)
+
+def resolve_task_from_context(webhook_url, user_name, title, project_id=None):
+    """
+    Ищет задачу в контексте диалога: последнюю, если title только указывает на нее
+    («её», «эту задачу»), либо недавнюю задачу с точно таким же названием.
+    Пустой title - не ссылка: без названия контекст не используется.
+    Если задан project_id, подходят только задачи этого проекта.
+    Возвращает запись {"id", "title", "project_id"} или None.
+    """
+    tasks = recent_context_entries(get_session_context(webhook_url, user_name)["tasks"])
+    if project_id is not None:
+        # Явно названный проект важнее контекста: задача из другого проекта не подходит
+        tasks = [task for task in tasks if task["project_id"] == int(project_id)]
+    if not title or not tasks:
         return None
-    except Exception as e:
-        debug(f"<- get_webhook_from_sheet: Ошибка при доступе к Google Sheets: {e}")
+    if is_context_reference(title):
+        return tasks[0]
+    words = split_words(title)
+    for task in tasks:
+        if split_words(task["title"]) == words:
+            return task
+    return None
+
+def resolve_project_from_context(webhook_url, user_name, project_name):
+    """
+    Возвращает ID последнего проекта диалога, если project_name только указывает на него
+    («тот же проект», «туда») и на портале нет проекта с буквально таким названием.
+    """
+    if not is_context_reference(project_name):
         return None
+    try:
+        index = get_project_index(webhook_url)
+        words = split_words(project_name)
+        if any(split_words(name) == words for name in index["names"].values()):
+            # Настоящее название проекта важнее контекста, его найдет обычный поиск
+            return None
+    except (requests.exceptions.RequestException, json.JSONDecodeError, ValueError) as e:
+        log_warning("resolve_project_from_context: каталог проектов недоступен: {}", [e])
+    projects = recent_context_entries(get_session_context(webhook_url, user_name)["projects"])
+    return projects[0]["id"] if projects else None
+
+# Хранилище учетных данных: вебхуки ищутся в локальном индексе
+# CACHE_STORE["credentials"] ({имя: [вебхуки порталов]}). Резидентный раннер
+# заполняет его из своего хранилища (SQLite, JSON, окружение) и тогда таблица
+# не читается вовсе; иначе индекс импортируется из Google Таблицы, не чаще
+# раза в WEBHOOK_SHEET_SYNC_SECONDS.
+WEBHOOK_SHEET_SYNC_SECONDS = 300
 
-def find_task_id_by_title(webhook_url, title, project_id=None):
+def normalize_webhook(webhook):
+    """Убирает непечатаемые символы и добавляет завершающий '/'."""
+    webhook = ''.join(c for c in webhook.strip() if c.isprintable())
+    if not webhook.endswith('/'): webhook += '/'
+    return webhook
+
+def parse_webhook_sheet(csv_data):
     """
-    Ищет ID задачи в Bitrix24 по наиболее похожему названию (метод 'мешка слов').
-    Завершенные задачи (статус 5) исключаются из поиска.
-    Если указан project_id, ищет только в этом проекте.
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в словарь {имя: [вебхуки]}.
+    У пользователя, работающего на нескольких порталах, несколько строк;
+    первая строка задает основной портал.
     """
-    debug(f"-> find_task_id_by_title (fuzzy): '{title}', project_id: {project_id}")
-    url = f"{webhook_url}tasks.task.list.json"
-    
-    # Формируем фильтр
-    task_filter = {"ZOMBIE": "N", "!STATUS": 5}
-    if project_id is not None:
-        task_filter["GROUP_ID"] = project_id
-        
-    # Получаем все активные и не завершенные задачи
-    params = {"filter": task_filter, "select": ["ID", "TITLE"]}
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        if not line.strip(): continue
+        parts = line.strip().split(',')
+        if len(parts) >= 2:
+            sheet_user = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if sheet_user and webhook != '/':
+                user_webhooks = webhooks.setdefault(sheet_user, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+def get_credential_index():
+    """Возвращает индекс учетных данных, создавая пустой индекс с импортом из таблицы."""
+    credentials = CACHE_STORE.get("credentials")
+    if credentials is None:
+        credentials = {"source": "sheet", "webhooks": {}, "synced_at": None}
+        CACHE_STORE["credentials"] = credentials
+    return credentials
+
+def sync_webhooks_from_sheet(sheet_url, credentials):
+    """Загружает опубликованную Google Таблицу CSV и заменяет ею индекс вебхуков."""
+    response = requests.get(sheet_url, timeout=budget_timeout(5))
+    response.raise_for_status()
+    credentials["webhooks"] = parse_webhook_sheet(response.text)
+    credentials["synced_at"] = datetime.datetime.now()
 
+def find_user_webhooks(sheet_url, user_name):
+    """
+    Возвращает все вебхуки пользователя (основной первым) из хранилища учетных данных.
+    Google Таблица служит только источником для импорта: она читается,
+    если индекс пуст или пользователь не найден, а с прошлой загрузки
+    прошло больше WEBHOOK_SHEET_SYNC_SECONDS.
+    """
+    credentials = get_credential_index()
+    user_webhooks = credentials["webhooks"].get(user_name)
+    if user_webhooks:
+        log_debug("<- find_user_webhooks: Вебхуки для '{}' найдены в индексе ({}).", [user_name, credentials['source']])
+        return user_webhooks
+    if credentials["source"] != "sheet":
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден в хранилище {}.", [user_name, credentials['source']])
+        return []
+
+    synced_at = credentials["synced_at"]
+    if synced_at is not None and datetime.datetime.now() - synced_at < datetime.timedelta(seconds=WEBHOOK_SHEET_SYNC_SECONDS):
+        log_debug("<- find_user_webhooks: Пользователь '{}' НЕ найден, таблица загружена недавно.", [user_name])
+        return []
     try:
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        tasks = response.json().get("result", {}).get("tasks", [])
+        sync_webhooks_from_sheet(sheet_url, credentials)
+    except Exception as e:
+        log_error("<- find_user_webhooks: Ошибка при доступе к Google Sheets: {}", [e])
+        return []
 
-        if not tasks:
-            debug("<- find_task_id_by_title (fuzzy): Не найдено ни одной активной задачи.")
-            return None
+    user_webhooks = credentials["webhooks"].get(user_name) or []
+    log_debug("<- find_user_webhooks: Для '{}' в таблице найдено вебхуков: {}.", [user_name, len(user_webhooks)])
+    return user_webhooks
 
-        # Нормализация и разбиение на слова поискового запроса
-        if not isinstance(title, str) or not title:
-            search_words = set()
-        else:
-            cleaned_title = re.sub(r'[^\w\s]', '', title).lower()
-            search_words = set(cleaned_title.split())
+def get_webhook_from_sheet(sheet_url, user_name):
+    """Получает основной вебхук пользователя (см. find_user_webhooks)."""
+    log_debug("-> get_webhook_from_sheet: ищем вебхук для '{}'", [user_name])
+    user_webhooks = find_user_webhooks(sheet_url, user_name)
+    if user_webhooks:
+        return user_webhooks[0]
+    return None
 
-        if not search_words:
-            debug("<- find_task_id_by_title (fuzzy): Поисковый запрос пуст после нормализации.")
-            return None
+# Ранжированный поиск задач: сколько кандидатов возвращать и насколько близкими
+# (по доле общих слов) должны быть оценки, чтобы переспросить пользователя
+TASK_CANDIDATES_TOP_K = 3
+TASK_AMBIGUITY_MARGIN = 0.15
 
-        best_match_id = None
-        max_common_count = 0
+def push_top_candidate(top, candidate, top_k):
+    """Вставляет кандидата в список, упорядоченный по убыванию оценки, сохраняя не более top_k элементов."""
+    rank = (candidate["score"], candidate["similarity"])
+    index = len(top)
+    while index > 0 and (top[index - 1]["score"], top[index - 1]["similarity"]) < rank:
+        index -= 1
+    if index < top_k:
+        top.insert(index, candidate)
+        if len(top) > top_k:
+            top.pop()
 
-        for task in tasks:
-            task_title = task.get("title")
-            
-            # Нормализация и разбиение на слова названия задачи
-            if not isinstance(task_title, str) or not task_title:
-                task_words = set()
-            else:
-                cleaned_task_title = re.sub(r'[^\w\s]', '', task_title).lower()
-                task_words = set(cleaned_task_title.split())
-            
-            common_count = len(search_words.intersection(task_words))
-            
-            # Мы ищем задачу, у которой больше всего общих слов с поисковым запросом
-            if common_count > max_common_count:
-                max_common_count = common_count
-                best_match_id = int(task.get("id"))
-                debug(f"Новый лучший кандидат: ID {best_match_id} ('{task_title}') с {common_count} совпадениями.")
-
-        if best_match_id and max_common_count > 0:
-            debug(f"<- find_task_id_by_title (fuzzy): Найдена наиболее похожая задача ID: {best_match_id}")
-        else:
-            debug(f"<- find_task_id_by_title (fuzzy): Не найдено похожих задач для '{title}'.")
-            best_match_id = None
-        
-        return best_match_id
+def rank_tasks_by_title(webhook_url, title, project_id=None, top_k=TASK_CANDIDATES_TOP_K):
+    """
+    Ранжирует задачи Bitrix24 по похожести названия (метод 'мешка слов') по индексу названий задач.
+    Завершенные задачи (статус 5) исключаются из поиска.
+    Если указан project_id, ищет только в этом проекте.
+    Возвращает до top_k кандидатов {"id", "title", "score", "similarity"} по убыванию оценки:
+    score - число общих слов, similarity - доля общих слов (коэффициент Жаккара).
+    """
+    log_debug("-> rank_tasks_by_title (fuzzy): '{}', project_id: {}", [title, project_id])
+    # Ключи слов поискового запроса (основа, транслитерация, звучание)
+    query = build_query_index(title)
+    if not query["size"]:
+        log_debug("<- rank_tasks_by_title (fuzzy): Поисковый запрос пуст после нормализации.")
+        return []
 
+    try:
+        index = get_task_index(webhook_url, open_only=True)
     except requests.exceptions.RequestException as e:
-        debug(f"<- find_task_id_by_title: ОШИБКА API: {e}")
+        log_error("<- rank_tasks_by_title: ОШИБКА API: {}", [e])
+        return []
     except Exception as e:
-        debug(f"<- find_task_id_by_title: Непредвиденная ошибка: {e}")
-    return None
+        log_error("<- rank_tasks_by_title: Непредвиденная ошибка: {}", [e])
+        return []
+
+    candidates = []
+    tasks_seen = 0
+    group_id = int(project_id) if project_id is not None else None
+    # Совпадения в цикле пишутся выборочно и только при включенном отладочном уровне
+    trace = log_enabled("debug")
+    # Снимок записей: индекс могут исправлять параллельные команды
+    for item in list(index["tasks"].items()):
+        record = item[1]
+        # Завершенные задачи в поиске не участвуют
+        if record[TASK_STATUS] == 5:
+            continue
+        if group_id is not None and record[TASK_GROUP] != group_id:
+            continue
+        tasks_seen += 1
+
+        # Слова задачи сравниваются с запросом по ключам, без учета окончаний и раскладки
+        common_count = count_matched_words(query, record[TASK_WORDS])
+        if common_count == 0:
+            continue
+
+        similarity = common_count / (query["size"] + len(set(record[TASK_WORDS])) - common_count)
+        candidate = {"id": item[0], "title": record[TASK_TITLE], "score": common_count, "similarity": similarity}
+        push_top_candidate(candidates, candidate, top_k)
+        if trace:
+            log_sampled("rank_tasks_by_title", "rank_tasks_by_title: совпадение с задачей {} (общих слов: {})", [item[0], common_count])
+
+    if not tasks_seen:
+        log_debug("<- rank_tasks_by_title (fuzzy): Не найдено ни одной задачи.")
+        return []
+
+    if candidates:
+        if log_enabled("debug"):
+            log_debug("<- rank_tasks_by_title (fuzzy): Кандидаты: {}", [[(c['id'], c['score']) for c in candidates]])
+    else:
+        log_debug("<- rank_tasks_by_title (fuzzy): Не найдено похожих задач для '{}'.", [title])
+    return candidates
+
+def select_close_candidates(candidates):
+    """
+    Оставляет кандидатов, неотличимых от лучшего: с тем же числом общих слов
+    и долей совпадения не ниже лучшей более чем на TASK_AMBIGUITY_MARGIN.
+    Если таких больше одного, пользователя нужно переспросить.
+    """
+    if not candidates:
+        return []
+    best = candidates[0]
+    return [c for c in candidates
+            if c["score"] == best["score"] and best["similarity"] - c["similarity"] <= TASK_AMBIGUITY_MARGIN]
+
+def format_candidates_message(candidates):
+    """Формирует короткий список похожих задач для уточнения."""
+    lines = ["Нашлось несколько похожих задач:"]
+    for index in range(1, len(candidates) + 1):
+        candidate = candidates[index - 1]
+        lines.append(f"{index}. #{candidate['id']} «{candidate['title']}»")
+    lines.append("Уточните, какую из них выбрать.")
+    return "\n".join(lines)
 
 
 def update_b24_task(webhook_url, task_id, fields):
     """Обновляет задачу в Bitrix24 и возвращает ее ID и ссылку."""
-    debug(f"-> update_b24_task: ID={task_id}, Поля={fields}")
-    url = f"{webhook_url}tasks.task.update.json"
+    log_debug("-> update_b24_task: ID={}, Поля={}", [task_id, fields])
     params = {"taskId": task_id, "fields": fields}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook_url, "tasks.task.update", params)
         response.raise_for_status()
         result_json = response.json()
         if "result" in result_json and "task" in result_json["result"]:
@@ -120,22 +852,23 @@ def update_b24_task(webhook_url, task_id, fields):
                 portal_url = webhook_url.split('/rest/')[0]
                 creator_id = task.get("createdBy")
                 task_link = f"{portal_url}/company/personal/user/{creator_id}/tasks/task/view/{updated_id}/"
-                debug(f"<- update_b24_task: Задача обновлена, ID: {updated_id}")
+                log_debug("<- update_b24_task: Задача обновлена, ID: {}", [updated_id])
+                patch_task_index(webhook_url, task)
                 return int(updated_id), task_link
     except requests.exceptions.RequestException as e:
-        debug(f"<- update_b24_task: ОШИБКА API: {e}")
+        log_error("<- update_b24_task: ОШИБКА API: {}", [e])
         if 'response' in locals() and hasattr(response, 'text'):
-            debug(f"Ответ от сервера: {response.text}")
+            log_error("Ответ от сервера: {}", [response.text])
     except Exception as e:
-        debug(f"<- update_b24_task: Непредвиденная ошибка: {e}")
+        log_error("<- update_b24_task: Непредвиденная ошибка: {}", [e])
     
-    debug("<- update_b24_task: Не удалось обновить задачу.")
+    log_debug("<- update_b24_task: Не удалось обновить задачу.")
     return None, None
 
 
 def parse_deadline(deadline_str):
     """Преобразует текстовое описание срока в формат Bitrix24."""
-    debug(f"-> parse_deadline: '{deadline_str}'")
+    log_debug("-> parse_deadline: '{}'", [deadline_str])
     deadline_str = deadline_str.lower().strip()
     now = datetime.datetime.now()
     deadline_dt = None
@@ -175,7 +908,7 @@ def parse_deadline(deadline_str):
                     minute = int(time_parts[1])
             deadline_dt = datetime.datetime(year, month, day, hour, minute)
         except (ValueError, IndexError):
-            debug(f"Не удалось преобразовать '{deadline_str}' в дату и время.")
+            log_debug("Не удалось преобразовать '{}' в дату и время.", [deadline_str])
             deadline_dt = None
 
     if deadline_dt:
@@ -187,79 +920,48 @@ def parse_deadline(deadline_str):
         mi = deadline_dt.minute
         s = deadline_dt.second
         result_dt = f"{y:04d}-{m:02d}-{d:02d}T{h:02d}:{mi:02d}:{s:02d}"
-        debug(f"<- parse_deadline: возвращает '{result_dt}'")
+        log_debug("<- parse_deadline: возвращает '{}'", [result_dt])
         return result_dt
 
-    debug(f"<- parse_deadline: не удалось распознать срок, возвращает None")
+    log_debug("<- parse_deadline: не удалось распознать срок, возвращает None")
     return None
 
 
 def find_project_id_by_name(webhook_url, project_name):
-    """Ищет ID проекта (рабочей группы) в Bitrix24 по наиболее похожему названию (метод 'мешка слов')."""
-    debug(f"-> find_project_id_by_name (fuzzy): '{project_name}'")
-    url = f"{webhook_url}sonet_group.get.json"
-    # Получаем все проекты
-    params = {} 
-
+    """
+    Ищет ID проекта (рабочей группы) в Bitrix24 по наиболее похожему названию (метод 'мешка слов').
+    Слова сравниваются по ключам основы, транслитерации и звучания, поэтому поиск
+    переживает падежные окончания и ошибки распознавания речи.
+    """
+    log_debug("-> find_project_id_by_name (fuzzy): '{}'", [project_name])
     try:
-        response = requests.post(url, json=params)
-        response.raise_for_status()
-        projects = response.json().get("result", [])
-
-        if not projects:
-            debug("<- find_project_id_by_name (fuzzy): Список проектов пуст.")
-            return None
-            
-        # Нормализация и разбиение на слова поискового запроса
-        if not isinstance(project_name, str) or not project_name:
-            search_words = set()
-        else:
-            cleaned_project_name = re.sub(r'[^\w\s]', '', project_name).lower()
-            search_words = set(cleaned_project_name.split())
-        
-        if not search_words:
-            debug("<- find_project_id_by_name (fuzzy): Название проекта пустое после нормализации.")
-            return None
+        index = get_project_index(webhook_url)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log_error("<- find_project_id_by_name (fuzzy): ОШИБКА API: {}", [e])
+        return None
 
-        best_match_id = None
-        max_common_count = 0
+    if not index["names"]:
+        log_debug("<- find_project_id_by_name (fuzzy): Список проектов пуст.")
+        return None
 
-        for project in projects:
-            current_project_name = project.get("NAME")
+    if not split_words(project_name):
+        log_debug("<- find_project_id_by_name (fuzzy): Название проекта пустое после нормализации.")
+        return None
 
-            # Нормализация и разбиение на слова названия проекта
-            if not isinstance(current_project_name, str) or not current_project_name:
-                project_words = set()
-            else:
-                cleaned_current_project_name = re.sub(r'[^\w\s]', '', current_project_name).lower()
-                project_words = set(cleaned_current_project_name.split())
-            
-            common_count = len(search_words.intersection(project_words))
-            
-            if common_count > max_common_count:
-                max_common_count = common_count
-                best_match_id = int(project.get("ID"))
-                debug(f"Новый лучший кандидат на проект: ID {best_match_id} ('{current_project_name}') с {common_count} совпадениями.")
-
-        # Считаем совпадение успешным, если нашлось хотя бы одно общее слово
-        if best_match_id and max_common_count > 0:
-            debug(f"<- find_project_id_by_name (fuzzy): Найден наиболее похожий проект ID: {best_match_id}")
-            return best_match_id
-        else:
-            debug(f"<- find_project_id_by_name (fuzzy): Не найдено достаточно похожего проекта для '{project_name}'.")
-            return None
+    best_match_id = match_project_id(index, project_name)
+    if best_match_id:
+        log_debug("<- find_project_id_by_name (fuzzy): Найден наиболее похожий проект ID: {} ('{}')", [best_match_id, index['names'][best_match_id]])
+        return best_match_id
 
-    except requests.exceptions.RequestException as e:
-        debug(f"<- find_project_id_by_name (fuzzy): ОШИБКА API: {e}")
+    log_debug("<- find_project_id_by_name (fuzzy): Не найдено достаточно похожего проекта для '{}'.", [project_name])
     return None
 
 
 def find_user_id_by_name(webhook_url, user_name):
     """Ищет ID пользователя в Bitrix24 по имени/фамилии."""
-    url = f"{webhook_url}user.search.json"
     params = {"FILTER": {"FIND": user_name}}
     try:
-        response = requests.post(url, json=params)
+        response = b24_post(webhook_url, "user.search", params)
         response.raise_for_status()
         result_json = response.json()
         if result_json.get("result") and len(result_json["result"]) > 0:
@@ -268,6 +970,16 @@ def find_user_id_by_name(webhook_url, user_name):
         pass
     return None
 
+def invalidate_task_listings(webhook_url):
+    """Сбрасывает кеш списков задач и дайджесты show_task для портала после изменения задач."""
+    portal_url = webhook_url.split('/rest/')[0]
+    CACHE_STORE.get("show_task", {}).pop(portal_url, None)
+    CACHE_STORE.get("show_task_digests", {}).pop(portal_url, None)
+    # Новое поколение не дает фоновым обновлениям, начатым до сброса, записать старый ответ
+    generations = CACHE_STORE.setdefault("show_task_generation", {})
+    generations[portal_url] = generations.get(portal_url, 0) + 1
+    log_debug("invalidate_task_listings: кеш списков задач портала {} сброшен.", [portal_url])
+
 # --- Основная функция, которую вызывает платформа ---
 
 def main(args):
@@ -275,44 +987,75 @@ def main(args):
     Основная логика обновления существующей задачи в Bitrix24.
     Ищет задачу по 'find_title', а затем обновляет переданные поля.
     """
-    debug("--- Запуск функции update_task ---")
-    debug(f"Получены аргументы от NextBot: {args}")
+    start_log_context("update_task", args)
+    start_latency_budget()
+    log_info("--- Запуск функции update_task ---")
+    log_debug("Получены аргументы от NextBot: {}", [args])
 
     GSHEET_URL = "https://docs.google.com/spreadsheets/d/YOUR_SHEET_ID/pub?gid=0&single=true&output=csv" 
 
     user_name = args.get("nameUser")
     if not user_name:
         msg = {"result": "error", "message": "Техническая ошибка: не было передано имя пользователя (nameUser)."}
-        debug(f"ОШИБКА: {msg['message']}")
+        log_warning("ОШИБКА: {}", [msg['message']])
         return json.dumps(msg, ensure_ascii=False)
 
     webhook_url = get_webhook_from_sheet(GSHEET_URL, user_name)
     if not webhook_url:
         msg = {"result": "error", "message": f"Не удалось найти вебхук для пользователя '{user_name}'. Убедитесь, что вы внесены в базу и таблица опубликована."}
-        debug(f"ОШИБКА: {msg['message']}")
+        log_warning("ОШИБКА: {}", [msg['message']])
         return json.dumps(msg, ensure_ascii=False)
     
     find_title = args.get("find_title")
-
-    if not find_title:
+    # ID задачи, выбранной пользователем из списка уточнения
+    selected_task_id = args.get("task_id")
+    if selected_task_id and not str(selected_task_id).strip().isdigit():
+        msg = {"result": "error", "message": f"Некорректный ID задачи: '{selected_task_id}'."}
+        log_warning("ОШИБКА: {}", [msg['message']])
+        return json.dumps(msg, ensure_ascii=False)
+    if not find_title and not selected_task_id:
         msg = {"result": "error", "message": "Необходимо указать 'find_title' для поиска задачи."}
-        debug(f"ОШИБКА: {msg['message']}")
+        log_warning("ОШИБКА: {}", [msg['message']])
         return json.dumps(msg, ensure_ascii=False)
 
     project_name = args.get("project")
     project_id = None
 
     if project_name:
-        debug(f"Поиск проекта по названию: '{project_name}'")
-        project_id = find_project_id_by_name(webhook_url, project_name)
+        log_debug("Поиск проекта по названию: '{}'", [project_name])
+        project_id = resolve_project_from_context(webhook_url, user_name, project_name)
+        if not project_id:
+            project_id = find_project_id_by_name(webhook_url, project_name)
         if not project_id:
             msg = {"result": "error", "message": f"Проект с названием, похожим на '{project_name}', не найден. Обновление отменено."}
-            debug(f"ОШИБКА: {msg['message']}")
+            log_warning("ОШИБКА: {}", [msg['message']])
             return json.dumps(msg, ensure_ascii=False)
-        debug(f"Проект найден. ID: {project_id}. Поиск задачи будет в этом проекте.")
+        log_debug("Проект найден. ID: {}. Поиск задачи будет в этом проекте.", [project_id])
+
+    # «Поставь ей высокий приоритет»: задача из контекста диалога (в названном проекте), без поиска по списку
+    context_task = None
+    if not selected_task_id:
+        context_task = resolve_task_from_context(webhook_url, user_name, find_title, project_id)
 
-    debug(f"Поиск задачи по названию: '{find_title}'")
-    task_id = find_task_id_by_title(webhook_url, find_title, project_id)
+    task_title = None
+    if selected_task_id:
+        task_id = int(str(selected_task_id).strip())
+        log_debug("Задача выбрана пользователем из списка уточнения. ID: {}", [task_id])
+    elif context_task:
+        task_id = context_task["id"]
+        task_title = context_task["title"]
+        log_debug("Задача найдена в контексте диалога. ID: {}", [task_id])
+    else:
+        log_debug("Поиск задачи по названию: '{}'", [find_title])
+        candidates = rank_tasks_by_title(webhook_url, find_title, project_id)
+        close_candidates = select_close_candidates(candidates)
+        if len(close_candidates) > 1:
+            msg = {"result": "clarify", "message": format_candidates_message(close_candidates),
+                   "candidates": [{"id": c["id"], "title": c["title"]} for c in close_candidates]}
+            log_debug("Несколько похожих задач, требуется уточнение: {}", [msg['candidates']])
+            return json.dumps(msg, ensure_ascii=False)
+        task_id = candidates[0]["id"] if candidates else None
+        task_title = candidates[0]["title"] if candidates else None
     
     if not task_id:
         if project_name:
@@ -320,10 +1063,10 @@ def main(args):
         else:
             msg_text = f"Задача с названием, похожим на '{find_title}', не найдена."
         msg = {"result": "error", "message": msg_text}
-        debug(f"ОШИБКА: {msg['message']}")
+        log_warning("ОШИБКА: {}", [msg['message']])
         return json.dumps(msg, ensure_ascii=False)
     
-    debug(f"Задача найдена. ID: {task_id}")
+    log_debug("Задача найдена. ID: {}", [task_id])
 
     fields_to_update = {}
 
@@ -340,14 +1083,14 @@ def main(args):
         if responsible_id:
             fields_to_update["RESPONSIBLE_ID"] = responsible_id
         else:
-            debug(f"ПРЕДУПРЕЖДЕНИЕ: Ответственный '{args['responsible']}' не найден. Поле не будет обновлено.")
+            log_warning("ПРЕДУПРЕЖДЕНИЕ: Ответственный '{}' не найден. Поле не будет обновлено.", [args['responsible']])
 
     if "deadline" in args:
         deadline = parse_deadline(args["deadline"])
         if deadline:
             fields_to_update["DEADLINE"] = deadline
         else:
-            debug(f"ПРЕДУПРЕЖДЕНИЕ: Срок '{args['deadline']}' не распознан. Поле не будет обновлено.")
+            log_warning("ПРЕДУПРЕЖДЕНИЕ: Срок '{}' не распознан. Поле не будет обновлено.", [args['deadline']])
 
     if "status" in args:
         status_name = str(args["status"]).lower().strip()
@@ -361,10 +1104,10 @@ def main(args):
         status_id = status_map.get(status_name)
         if status_id:
             fields_to_update["STATUS"] = status_id
-            debug(f"Поле для обновления: Статус = {status_name} (ID: {status_id})")
+            log_debug("Поле для обновления: Статус = {} (ID: {})", [status_name, status_id])
         else:
             valid_statuses = ", ".join(status_map.keys())
-            debug(f"ПРЕДУПРЕЖДЕНИЕ: Статус '{args['status']}' не распознан. Допустимые значения: {valid_statuses}. Поле не будет обновлено.")
+            log_warning("ПРЕДУПРЕЖДЕНИЕ: Статус '{}' не распознан. Допустимые значения: {}. Поле не будет обновлено.", [args['status'], valid_statuses])
 
     if "priority" in args:
         priority_arg = args["priority"]
@@ -372,28 +1115,31 @@ def main(args):
         priority_value = priority_map.get(str(priority_arg).lower().strip())
         if priority_value:
             fields_to_update["PRIORITY"] = priority_value
-            debug(f"Поле для обновления: Приоритет = {priority_arg} (ID: {priority_value})")
+            log_debug("Поле для обновления: Приоритет = {} (ID: {})", [priority_arg, priority_value])
         else:
-            debug(f"ПРЕДУПРЕЖДЕНИЕ: Приоритет '{priority_arg}' не распознан. Поле не будет обновлено.")
+            log_warning("ПРЕДУПРЕЖДЕНИЕ: Приоритет '{}' не распознан. Поле не будет обновлено.", [priority_arg])
 
     if not fields_to_update:
         msg = {"result": "error", "message": "Не передано ни одного поля для обновления (title, description, project, responsible, deadline, status, priority)."}
-        debug(f"ОШИБКА: {msg['message']}")
+        log_warning("ОШИБКА: {}", [msg['message']])
         return json.dumps(msg, ensure_ascii=False)
 
-    debug(f"Итоговые поля для обновления задачи ID {task_id}: {fields_to_update}")
+    log_debug("Итоговые поля для обновления задачи ID {}: {}", [task_id, fields_to_update])
 
     task_result = update_b24_task(webhook_url, task_id, fields_to_update)
     
     if task_result:
         updated_task_id, task_link = task_result
         if updated_task_id and task_link:
+            invalidate_task_listings(webhook_url)
+            remember_task(webhook_url, user_name, updated_task_id, fields_to_update.get("TITLE") or task_title,
+                          fields_to_update.get("GROUP_ID"))
             success_message = {"result": "success", "message": f"✅ Задача #{updated_task_id} успешно обновлена!\n\n🔗 Ссылка: {task_link}"}
-            debug(f"Задача {updated_task_id} успешно обновлена.")
+            log_info("Задача {} успешно обновлена.", [updated_task_id])
             return json.dumps(success_message, ensure_ascii=False)
 
     error_message = {"result": "error", "message": f"Произошла ошибка при обновлении задачи #{task_id} в Bitrix24."}
-    debug(f"ОШИБКА: {error_message['message']}")
+    log_warning("ОШИБКА: {}", [error_message['message']])
     return json.dumps(error_message, ensure_ascii=False)
 
 # --- Точка входа для платформы NextBot ---
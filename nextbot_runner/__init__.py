@@ -0,0 +1,11 @@
+"""Локальный запуск скриптов NextBot вне платформы."""
+from .credentials import CredentialStore, open_credential_store
+from .digests import DigestScheduler
+from .engine import AsyncEngine
+from .metrics import Metrics, serve_metrics
+from .runner import COMMANDS, SCRIPTS_DIR, ScriptRunner
+
+__all__ = [
+    "COMMANDS", "SCRIPTS_DIR", "AsyncEngine", "CredentialStore", "DigestScheduler", "Metrics", "ScriptRunner",
+    "open_credential_store", "serve_metrics",
+]
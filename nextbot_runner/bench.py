@@ -0,0 +1,535 @@
+"""
+Микробенчмарки нечеткого поиска и разбора сроков без сети.
+
+Функции берутся из самих скриптов NextBot: скрипт исполняется без строки
+`result = main(args)`, а вместо b24_post подставляется функция, отдающая
+синтетический портал из памяти. Поэтому индексы строятся тем же кодом, что
+и на платформе, а запросы к Bitrix24 не уходят.
+
+Измеряются:
+
+* поиск задачи по названию (rank_tasks_by_title из update_task.py) на
+  синтетических порталах из 1k, 10k и 100k русских названий задач;
+* поиск проекта по названию (find_project_id_by_name из add_new_task.py) на
+  каталогах в десять раз меньше;
+* разбор сроков parse_deadline (add_new_task, update_task, batch_tasks) и
+  parse_deadline_for_filter (show_task) на тысячах фраз.
+
+Для каждого случая отчет содержит время построения индекса и его размер,
+задержку на запрос (среднее, p50, p95), пик выделенной памяти на запрос по
+данным tracemalloc и точность: доля запросов, на которые функция ответила
+ожидаемой задачей, проектом или датой. Запросы к поиску — названия из
+корпуса с искажениями, типичными для распознавания речи (другой падеж,
+слово латиницей, пропущенное слово).
+
+Результат сохраняется в JSON (--save) и сравнивается с сохраненным (--baseline):
+
+    python -m nextbot_runner.bench --save benchmarks/baseline.json
+    python -m nextbot_runner.bench --baseline benchmarks/baseline.json
+"""
+import argparse
+import ast
+import datetime
+import inspect
+import json
+import os
+import platform
+import random
+import re
+import time
+import tracemalloc
+
+from .loadgen import percentile
+from .mock_portal import TASK_OBJECTS, TASK_VERBS
+from .payloads import change_percent
+from .runner import SCRIPTS_DIR, debug, script_log_level
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+BENCH_WEBHOOK = "https://bench.bitrix24.ru/rest/1/bench/"
+# Размер страницы tasks.task.list в Bitrix24
+B24_PAGE_SIZE = 50
+
+TITLE_VERBS = TASK_VERBS + ("Оплатить", "Перенести", "Распечатать", "Заказать", "Обсудить",
+                            "Исправить", "Оформить")
+TITLE_OBJECTS = TASK_OBJECTS + ("акт", "претензию", "заявку", "спецификацию", "накладную", "прайс",
+                                "анкету", "доверенность", "техзадание", "каталог", "визитки", "стенд",
+                                "вебинар", "контракт", "график")
+TITLE_CLIENTS = (
+    "Ромашки", "Альфа", "Вектора", "Меридиана", "Горизонта", "Полюса", "Сатурна", "Кристалла", "Гранита",
+    "Прогресса", "Авангарда", "Импульса", "Спектра", "Магистрали", "Ориона", "Сигмы", "Атланта", "Байкала",
+    "Восхода", "Зенита", "Лотоса", "Маяка", "Нептуна", "Олимпа", "Пегаса", "Радуги", "Северстали", "Темпа",
+    "Уралсиба", "Феникса", "Циркона", "Электрона", "Юпитера", "Янтаря", "Балтики", "Волги", "Дельты",
+    "Енисея", "Жемчуга", "Квазара",
+)
+TITLE_DETAILS = ("для клиента", "по проекту", "на квартал", "для отдела", "к встрече", "по продажам",
+                 "на сайт", "до пятницы", "для бухгалтерии", "по закупкам", "на склад", "для директора")
+PROJECT_ADJECTIVES = (
+    "Новый", "Главный", "Городской", "Цифровой", "Северный", "Южный", "Западный", "Восточный", "Внутренний",
+    "Внешний", "Срочный", "Годовой", "Весенний", "Летний", "Осенний", "Зимний", "Пилотный", "Общий",
+    "Сетевой", "Региональный",
+)
+PROJECT_AREAS = (
+    "маркетинг", "сайт", "склад", "офис", "ремонт", "запуск", "аудит", "переезд", "бюджет", "портал",
+    "магазин", "филиал", "тендер", "отчет", "форум", "каталог", "архив", "контроль", "найм", "проект",
+    "сервис", "колл-центр", "документооборот", "релиз", "семинар",
+)
+PROJECT_CITIES = (
+    "Москва", "Казань", "Самара", "Пермь", "Омск", "Томск", "Тула", "Тверь", "Сочи", "Уфа", "Курск",
+    "Рязань", "Липецк", "Иркутск", "Барнаул", "Калуга", "Орел", "Брянск", "Чита", "Вологда", "Кострома",
+    "Смоленск", "Псков", "Ярославль", "Владимир", "Иваново", "Пенза", "Саратов", "Тамбов", "Белгород",
+)
+# Окончания, на которые заменяется окончание слова в запросе («презентацию» -> «презентация»)
+QUERY_ENDINGS = ("а", "у", "ы", "е", "ом", "ой")
+QUERY_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c", "ч": "ch", "ш": "sh",
+    "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+QUERY_DISTORTIONS = ("exact", "inflection", "translit", "partial")
+# Допустимое расхождение ожидаемого и разобранного срока (для «через N часов» время берется от now)
+DEADLINE_TOLERANCE = datetime.timedelta(minutes=2)
+
+
+class OfflineRequests:
+    """Обертка над requests, запрещающая сетевые вызовы во время замеров."""
+
+    def __init__(self, requests_module=None):
+        self.requests_module = requests_module
+
+    def __getattr__(self, name):
+        if self.requests_module is None:
+            import requests
+            self.requests_module = requests
+        return getattr(self.requests_module, name)
+
+    def post(self, url, **kwargs):
+        raise RuntimeError(f"Бенчмарк не обращается к сети: POST {url}")
+
+    def get(self, url, **kwargs):
+        raise RuntimeError(f"Бенчмарк не обращается к сети: GET {url}")
+
+
+class OfflineResponse:
+    """Ответ Bitrix24 из памяти с тем же интерфейсом, что у requests.Response."""
+
+    def __init__(self, payload):
+        self.text = json.dumps(payload, ensure_ascii=False)
+        self.encoding = "utf-8"
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.text), chunk_size):
+            yield self.text[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class OfflinePortal:
+    """
+    Синтетический портал: отвечает на sonet_group.get и tasks.task.list из памяти.
+    Список задач, как в Bitrix24 и mock_portal, отдается страницами по B24_PAGE_SIZE
+    с курсором next, поэтому построение индекса проходит все страницы.
+    """
+
+    def __init__(self, projects=(), tasks=()):
+        self.projects = list(projects)
+        self.tasks = list(tasks)
+
+    def b24_post(self, webhook_url, method, params=None, timeout=None, stream=False):
+        if method == "sonet_group.get":
+            return OfflineResponse({"result": [{"ID": str(project_id), "NAME": name}
+                                               for project_id, name in self.projects]})
+        if method == "tasks.task.list":
+            start = int((params or {}).get("start", 0) or 0)
+            body = {"result": {"tasks": [
+                {"id": str(task_id), "title": title, "status": "2", "groupId": "0"}
+                for task_id, title in self.tasks[start:start + B24_PAGE_SIZE]
+            ]}, "total": len(self.tasks)}
+            if start + B24_PAGE_SIZE < len(self.tasks):
+                body["next"] = start + B24_PAGE_SIZE
+            return OfflineResponse(body)
+        raise RuntimeError(f"Метод {method} в бенчмарке не поддерживается")
+
+
+def load_script(command, store, scripts_dir=None, requests_module=None):
+    """
+    Исполняет скрипт команды без вызова main и возвращает его пространство имен.
+    Глобальные имена подставляются так же, как в ScriptRunner.
+    """
+    path = os.path.join(scripts_dir or SCRIPTS_DIR, f"{command}.py")
+    with open(path, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), path)
+    tree.body = [
+        node for node in tree.body
+        if not (isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "result"
+                                                     for target in node.targets))
+    ]
+    namespace = {
+        "__name__": f"nextbot_{command}",
+        "requests": OfflineRequests(requests_module),
+        "json": json,
+        "re": re,
+        "datetime": datetime,
+        "debug": debug,
+        "LOG_LEVEL": script_log_level(),
+        "args": {},
+        "CACHE_STORE": store,
+    }
+    exec(compile(tree, path, "exec"), namespace)
+    return namespace
+
+
+def task_corpus(size, rng):
+    """Список (ID, название) синтетических задач портала."""
+    return [
+        (task_id, f"{rng.choice(TITLE_VERBS)} {rng.choice(TITLE_OBJECTS)} {rng.choice(TITLE_CLIENTS)} "
+                  f"{rng.choice(TITLE_DETAILS)}")
+        for task_id in range(1, size + 1)
+    ]
+
+
+def project_corpus(size, rng):
+    """Список (ID, название) синтетических проектов портала."""
+    return [
+        (project_id, f"{rng.choice(PROJECT_ADJECTIVES)} {rng.choice(PROJECT_AREAS)} {rng.choice(PROJECT_CITIES)}")
+        for project_id in range(1, size + 1)
+    ]
+
+
+def distort_query(text, distortion, rng):
+    """Искажает название так, как его может исказить распознавание речи."""
+    words = text.split()
+    if distortion == "inflection":
+        positions = [index for index, word in enumerate(words) if len(word) > 5]
+        if positions:
+            index = rng.choice(positions)
+            words[index] = words[index][:-1] + rng.choice(QUERY_ENDINGS)
+    elif distortion == "translit":
+        index = rng.randrange(len(words))
+        words[index] = "".join(QUERY_TRANSLIT.get(c, c) for c in words[index].lower())
+    elif distortion == "partial" and len(words) > 2:
+        del words[rng.randrange(len(words))]
+    return " ".join(words)
+
+
+def make_queries(corpus, count, rng):
+    """Запросы к поиску: (искаженное название, исходное название, вид искажения)."""
+    queries = []
+    for number in range(count):
+        title = rng.choice(corpus)[1]
+        distortion = QUERY_DISTORTIONS[number % len(QUERY_DISTORTIONS)]
+        queries.append((distort_query(title, distortion, rng), title, distortion))
+    return queries
+
+
+def deadline_phrases(count, rng, now):
+    """Фразы срока для parse_deadline: (фраза, вид, ожидаемый срок или None)."""
+    evening = now.replace(hour=18, minute=0, second=0, microsecond=0)
+    phrases = []
+    for number in range(count):
+        kind = number % 10
+        if kind == 0:
+            phrases.append((rng.choice(("завтра", "Завтра", "до завтра", "завтра вечером")), "tomorrow",
+                            evening + datetime.timedelta(days=1)))
+        elif kind == 1:
+            phrases.append(("послезавтра", "day_after_tomorrow", evening + datetime.timedelta(days=2)))
+        elif kind == 2:
+            phrases.append(("через неделю", "next_week", evening + datetime.timedelta(weeks=1)))
+        elif kind == 3:
+            days = rng.randint(1, 30)
+            unit = "день" if days % 10 == 1 and days != 11 else ("дня" if days % 10 in (2, 3, 4) and days not in (12, 13, 14) else "дней")
+            phrases.append((f"через {days} {unit}", "in_days", evening + datetime.timedelta(days=days)))
+        elif kind == 4:
+            hours = rng.randint(1, 48)
+            unit = rng.choice(("час", "часа", "часов"))
+            phrases.append((f"через {hours} {unit}", "in_hours", now + datetime.timedelta(hours=hours)))
+        elif kind in (5, 6):
+            day = (now + datetime.timedelta(days=rng.randint(0, 365))).replace(hour=18, minute=0, second=0,
+                                                                               microsecond=0)
+            phrases.append((f"{day.day:02d}.{day.month:02d}.{day.year}", "date", day))
+        elif kind == 7:
+            moment = (now + datetime.timedelta(days=rng.randint(0, 365))).replace(
+                hour=rng.randint(8, 20), minute=rng.choice((0, 15, 30, 45)), second=0, microsecond=0)
+            phrases.append((f"{moment.day:02d}.{moment.month:02d}.{moment.year} {moment.hour:02d}:{moment.minute:02d}",
+                            "date_time", moment))
+        elif kind == 8:
+            day = (now + datetime.timedelta(days=rng.randint(0, 365))).replace(hour=18, minute=0, second=0,
+                                                                               microsecond=0)
+            phrases.append((f"до {day.day:02d}.{day.month:02d}.{day.year}", "date_with_preposition", day))
+        else:
+            phrases.append((rng.choice(("когда получится", "как можно скорее", "32.13.2026", "в следующем месяце")),
+                            "unknown", None))
+    return phrases
+
+
+def filter_phrases(count, rng, now):
+    """Фразы срока для parse_deadline_for_filter: (фраза, вид, ожидаемый фильтр)."""
+    def day_filter(day):
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        return {">=DEADLINE": start, "<=DEADLINE": start.replace(hour=23, minute=59, second=59)}
+
+    phrases = []
+    for number in range(count):
+        kind = number % 5
+        if kind == 0:
+            phrases.append((rng.choice(("сегодня", "на сегодня")), "today", day_filter(now)))
+        elif kind == 1:
+            phrases.append((rng.choice(("завтра", "на завтра")), "tomorrow", day_filter(now + datetime.timedelta(days=1))))
+        elif kind == 2:
+            phrases.append((rng.choice(("просроченные", "просрочка")), "overdue", {"<DEADLINE": now}))
+        elif kind == 3:
+            day = now + datetime.timedelta(days=rng.randint(-30, 365))
+            phrases.append((f"{day.day:02d}.{day.month:02d}.{day.year}", "date", day_filter(day)))
+        else:
+            phrases.append((rng.choice(("когда-нибудь", "31.02.2026")), "unknown", {}))
+    return phrases
+
+
+def parse_bitrix_datetime(value):
+    """Разбирает срок Bitrix24 ("2026-03-05T18:00:00" или "2026-03-05 18:00:00")."""
+    return datetime.datetime.strptime(value.replace("T", " ")[:19], "%Y-%m-%d %H:%M:%S")
+
+
+def deadline_matches(parsed, expected):
+    if expected is None or parsed is None:
+        return parsed is None and expected is None
+    return abs(parse_bitrix_datetime(parsed) - expected) <= DEADLINE_TOLERANCE
+
+
+def filter_matches(parsed, expected):
+    if set(parsed) != set(expected):
+        return False
+    return all(abs(parse_bitrix_datetime(parsed[key]) - expected[key]) <= DEADLINE_TOLERANCE for key in expected)
+
+
+def time_calls(function, inputs):
+    """Вызывает function(*arguments) для каждого входа; возвращает результаты и задержки в секундах."""
+    results = []
+    latencies = []
+    for arguments in inputs:
+        started = time.perf_counter()
+        results.append(function(*arguments))
+        latencies.append(time.perf_counter() - started)
+    return results, latencies
+
+
+def peak_allocation(function, inputs):
+    """Средний пик памяти, выделенной одним вызовом function(*arguments), в байтах."""
+    if not inputs:
+        return 0
+    tracemalloc.start()
+    try:
+        total = 0
+        for arguments in inputs:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            function(*arguments)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / len(inputs)
+
+
+def build_index(function, webhook_url, **options):
+    """Строит индекс функцией скрипта; возвращает время построения и объем индекса в памяти."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        function(webhook_url, **options)
+        seconds = time.perf_counter() - started
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return seconds, retained
+
+
+def latency_stats(latencies):
+    return {
+        "queries": len(latencies),
+        "mean_ms": round(sum(latencies) * 1000 / len(latencies), 4) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 4),
+    }
+
+
+def accuracy_by_kind(kinds, hits):
+    totals = {}
+    for kind, hit in zip(kinds, hits):
+        counts = totals.setdefault(kind, [0, 0])
+        counts[0] += 1
+        counts[1] += 1 if hit else 0
+    return {kind: round(counts[1] / counts[0], 4) for kind, counts in sorted(totals.items())}
+
+
+def bench_task_search(size, queries_count, rng, scripts_dir=None, alloc_queries=50):
+    """Поиск задачи по названию (update_task.rank_tasks_by_title) на портале из size задач."""
+    corpus = task_corpus(size, rng)
+    namespace = load_script("update_task", {}, scripts_dir)
+    namespace["b24_post"] = OfflinePortal(tasks=corpus).b24_post
+    # rank_tasks_by_title ищет по индексу незавершенных задач, его и строим заранее
+    # (скрипты из --scripts-dir старых версий держат один индекс)
+    options = {"open_only": True} if "open_only" in inspect.signature(namespace["get_task_index"]).parameters else {}
+    build_seconds, index_bytes = build_index(namespace["get_task_index"], BENCH_WEBHOOK, **options)
+
+    queries = make_queries(corpus, queries_count, rng)
+    inputs = [(BENCH_WEBHOOK, query[0]) for query in queries]
+    results, latencies = time_calls(namespace["rank_tasks_by_title"], inputs)
+    hits = [bool(candidates) and candidates[0]["title"] == query[1] for candidates, query in zip(results, queries)]
+    ambiguous = sum(1 for candidates in results if len(namespace["select_close_candidates"](candidates)) > 1)
+
+    report = {"size": size, "build_ms": round(build_seconds * 1000, 2), "index_kib": round(index_bytes / 1024, 1)}
+    report.update(latency_stats(latencies))
+    report["alloc_kib"] = round(peak_allocation(namespace["rank_tasks_by_title"], inputs[:alloc_queries]) / 1024, 2)
+    report["accuracy"] = round(sum(hits) / len(hits), 4)
+    report["ambiguous"] = round(ambiguous / len(results), 4)
+    report["by_kind"] = accuracy_by_kind([query[2] for query in queries], hits)
+    return report
+
+
+def bench_project_search(size, queries_count, rng, scripts_dir=None, alloc_queries=200):
+    """Поиск проекта по названию (add_new_task.find_project_id_by_name) в каталоге из size проектов."""
+    corpus = project_corpus(size, rng)
+    names = dict(corpus)
+    namespace = load_script("add_new_task", {}, scripts_dir)
+    namespace["b24_post"] = OfflinePortal(projects=corpus).b24_post
+    build_seconds, index_bytes = build_index(namespace["get_project_index"], BENCH_WEBHOOK)
+
+    queries = make_queries(corpus, queries_count, rng)
+    inputs = [(BENCH_WEBHOOK, query[0]) for query in queries]
+    results, latencies = time_calls(namespace["find_project_id_by_name"], inputs)
+    hits = [project_id is not None and names[project_id] == query[1] for project_id, query in zip(results, queries)]
+
+    report = {"size": size, "build_ms": round(build_seconds * 1000, 2), "index_kib": round(index_bytes / 1024, 1)}
+    report.update(latency_stats(latencies))
+    report["alloc_kib"] = round(peak_allocation(namespace["find_project_id_by_name"], inputs[:alloc_queries]) / 1024, 2)
+    report["accuracy"] = round(sum(hits) / len(hits), 4)
+    report["by_kind"] = accuracy_by_kind([query[2] for query in queries], hits)
+    return report
+
+
+def bench_deadlines(command, function_name, phrases, matches, scripts_dir=None, alloc_phrases=500):
+    """Разбор фраз срока функцией function_name скрипта command."""
+    namespace = load_script(command, {}, scripts_dir)
+    function = namespace[function_name]
+    inputs = [(phrase[0],) for phrase in phrases]
+    results, latencies = time_calls(function, inputs)
+    hits = [matches(parsed, phrase[2]) for parsed, phrase in zip(results, phrases)]
+
+    report = latency_stats(latencies)
+    report["alloc_kib"] = round(peak_allocation(function, inputs[:alloc_phrases]) / 1024, 2)
+    report["accuracy"] = round(sum(hits) / len(hits), 4)
+    report["by_kind"] = accuracy_by_kind([phrase[1] for phrase in phrases], hits)
+    return report
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, queries=200, phrases=5000, seed=1, scripts_dir=None):
+    """Выполняет все замеры и возвращает отчет {"meta": ..., "results": {случай: метрики}}."""
+    results = {}
+    for size in sizes:
+        results[f"task_search/{size}"] = bench_task_search(size, queries, random.Random(seed), scripts_dir)
+        project_size = max(size // 10, 10)
+        results[f"project_search/{project_size}"] = bench_project_search(project_size, queries,
+                                                                         random.Random(seed), scripts_dir)
+
+    now = datetime.datetime.now()
+    deadline_cases = [
+        ("add_new_task", "parse_deadline"),
+        ("update_task", "parse_deadline"),
+        ("batch_tasks", "parse_deadline"),
+    ]
+    for command, function_name in deadline_cases:
+        results[f"{function_name}/{command}"] = bench_deadlines(
+            command, function_name, deadline_phrases(phrases, random.Random(seed), now), deadline_matches, scripts_dir)
+    results["parse_deadline_for_filter/show_task"] = bench_deadlines(
+        "show_task", "parse_deadline_for_filter", filter_phrases(phrases, random.Random(seed), now),
+        filter_matches, scripts_dir)
+
+    meta = {
+        "created_at": now.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": seed,
+        "queries": queries,
+        "phrases": phrases,
+    }
+    return {"meta": meta, "results": results}
+
+
+# Метрики, которые сравниваются с базовым отчетом; для точности изменение в процентных пунктах
+COMPARED_METRICS = ("mean_ms", "p95_ms", "alloc_kib", "build_ms", "index_kib")
+
+
+def format_bench_report(current, baseline=None):
+    """Текстовое представление отчета; при наличии baseline — сравнение с ним."""
+    lines = [f"{'случай':<38}{'сред. мс':>10}{'p95 мс':>10}{'КиБ/запр':>10}{'индекс мс':>11}{'индекс КиБ':>12}{'точность':>10}"]
+    for name, stats in current["results"].items():
+        lines.append(
+            f"{name:<38}{stats['mean_ms']:>10.4f}{stats['p95_ms']:>10.4f}{stats['alloc_kib']:>10.2f}"
+            f"{stats.get('build_ms', 0):>11.1f}{stats.get('index_kib', 0):>12.1f}{stats['accuracy'] * 100:>9.1f}%"
+        )
+        weak_kinds = [f"{kind} {value * 100:.0f}%" for kind, value in stats["by_kind"].items() if value < 1]
+        if weak_kinds:
+            lines.append(f"  {'неточно: ' + ', '.join(weak_kinds)}")
+    if baseline is None:
+        return "\n".join(lines)
+
+    lines.append("")
+    lines.append(f"Сравнение с базовым отчетом от {baseline['meta'].get('created_at', '?')}:")
+    for name, stats in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append(f"{name:<38} нет в базовом отчете")
+            continue
+        changes = [
+            f"{metric} {change_percent(before[metric], stats[metric]):+.1f}%"
+            for metric in COMPARED_METRICS if metric in stats and metric in before
+        ]
+        accuracy_change = (stats["accuracy"] - before["accuracy"]) * 100
+        changes.append(f"точность {accuracy_change:+.1f} п.п.")
+        lines.append(f"{name:<38} " + ", ".join(changes))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки нечеткого поиска и разбора сроков.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="размеры корпусов названий задач (каталог проектов в 10 раз меньше)")
+    parser.add_argument("--queries", type=int, default=200, help="запросов поиска на корпус")
+    parser.add_argument("--phrases", type=int, default=5000, help="фраз срока на функцию разбора")
+    parser.add_argument("--scripts-dir", help="каталог со скриптами (по умолчанию nextbot_functions)")
+    parser.add_argument("--baseline", help="JSON базового отчета для сравнения")
+    parser.add_argument("--save", help="записать отчет в JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    options = parser.parse_args(argv)
+
+    current = run_benchmarks(options.sizes, options.queries, options.phrases, options.seed, options.scripts_dir)
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as source:
+            baseline = json.load(source)
+    if options.save:
+        directory = os.path.dirname(options.save)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(options.save, "w", encoding="utf-8") as output:
+            json.dump(current, output, ensure_ascii=False, indent=2)
+            output.write("\n")
+
+    if options.json:
+        print(json.dumps({"current": current, "baseline": baseline}, ensure_ascii=False, indent=2))
+    else:
+        print(format_bench_report(current, baseline))
+    return current
+
+
+if __name__ == "__main__":
+    main()
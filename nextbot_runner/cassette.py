@@ -0,0 +1,285 @@
+"""
+Запись и воспроизведение обменов с Bitrix24 и таблицей вебхуков (кассеты).
+
+CassetteRequests подставляется в раннер вместо модуля requests:
+
+* в режиме "record" запросы уходят в сеть (или в мок), а каждый обмен —
+  метод, адрес, тело запроса, статус, заголовок Content-Type, тело ответа
+  и время ответа — записывается в кассету (JSON Lines, один обмен в строке);
+* в режиме "replay" сеть не нужна: ответ берется из кассеты по методу,
+  адресу и телу запроса. Одинаковые запросы получают записанные ответы по
+  порядку, последний ответ повторяется. Если тело запроса не совпало
+  (например, в фильтре текущее время), берется следующий ответ на тот же
+  метод и адрес.
+
+Секреты вебхуков (/rest/<ID>/<секрет>/) и ID Google Таблицы заменяются
+на "scrubbed" и в адресах, и в телах запросов и ответов (в таблице вебхуков
+они тоже есть). При воспроизведении адреса обезличиваются так же, поэтому
+скрипты, прочитавшие вебхуки из записанной таблицы, находят свои ответы.
+
+Задержка воспроизведения: None — мгновенно, "recorded" — записанное время
+ответа, число — одинаковая синтетическая задержка в секундах.
+
+Пример:
+    python -m nextbot_runner.cassette record cassettes/mock.jsonl --mock --ops 200
+    python -m nextbot_runner.cassette replay cassettes/mock.jsonl --ops 200 --latency recorded
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .loadgen import SheetRedirectRequests, build_report, format_report, load_trace, synthetic_trace
+from .metrics import command_outcome
+from .mock_portal import MockPortalServer
+from .runner import ScriptRunner
+
+SCRUBBED = "scrubbed"
+SECRET_PATTERNS = (
+    (re.compile(r"(/rest/\d+/)[A-Za-z0-9_]+(?=/)"), r"\g<1>" + SCRUBBED),
+    (re.compile(r"(/spreadsheets/d/)[A-Za-z0-9_-]+"), r"\g<1>" + SCRUBBED),
+)
+
+logger = logging.getLogger("nextbot_runner")
+
+
+def scrub_secrets(text):
+    """Заменяет секреты вебхуков и ID таблицы в строке на "scrubbed"."""
+    if not text:
+        return text
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def request_body(kwargs):
+    """Тело запроса в каноническом виде (JSON с сортировкой ключей), уже обезличенное."""
+    for name in ("json", "data", "params"):
+        if kwargs.get(name) is not None:
+            value = kwargs[name]
+            if isinstance(value, (bytes, bytearray)):
+                value = value.decode("utf-8", "replace")
+            return scrub_secrets(json.dumps(value, ensure_ascii=False, sort_keys=True))
+    return ""
+
+
+class CassetteResponse:
+    """Ответ из кассеты с интерфейсом requests.Response, нужным скриптам."""
+
+    def __init__(self, interaction, requests_module):
+        self.requests_module = requests_module
+        self.url = interaction["url"]
+        self.status_code = interaction["status"]
+        self.headers = dict(interaction.get("headers") or {})
+        self.text = interaction["text"]
+        self.encoding = "utf-8"
+        self.content = self.text.encode("utf-8")
+        self.headers["Content-Length"] = str(len(self.content))
+        self.ok = self.status_code < 400
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise self.requests_module.exceptions.HTTPError(f"{self.status_code} для {self.url}", response=self)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        data = self.text if decode_unicode else self.content
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class CassetteRequests:
+    """Обертка над requests, записывающая обмены в кассету или воспроизводящая их."""
+
+    def __init__(self, path, mode="replay", requests_module=None, latency=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Неизвестный режим кассеты: {mode}")
+        if requests_module is None:
+            import requests as requests_module
+        self.requests_module = requests_module
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.interactions = []
+        self.exact = {}
+        self.loose = {}
+        self.misses = 0
+        if mode == "replay":
+            self.load()
+
+    def __getattr__(self, name):
+        return getattr(self.requests_module, name)
+
+    def load(self):
+        """Читает кассету и раскладывает ответы по очередям запросов."""
+        with open(self.path, encoding="utf-8") as source:
+            for line in source:
+                if line.strip():
+                    self.interactions.append(json.loads(line))
+        for interaction in self.interactions:
+            self.exact.setdefault((interaction["method"], interaction["url"], interaction["body"]), []).append(interaction)
+            self.loose.setdefault((interaction["method"], interaction["url"]), []).append(interaction)
+        # Позиции в очередях: сколько ответов на ключ уже выдано
+        self.positions = {}
+
+    def save(self):
+        """Записывает обмены в кассету (режим "record")."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            lines = [json.dumps(interaction, ensure_ascii=False) + "\n" for interaction in self.interactions]
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as output:
+            output.writelines(lines)
+        os.replace(temporary_path, self.path)
+        return len(lines)
+
+    def next_interaction(self, queues, key):
+        """Следующий ответ из очереди ключа; когда очередь кончилась, повторяется последний."""
+        queue = queues.get(key)
+        if not queue:
+            return None
+        position_key = (id(queues), key)
+        position = self.positions.get(position_key, 0)
+        self.positions[position_key] = position + 1
+        return queue[min(position, len(queue) - 1)]
+
+    def replay(self, method, url, kwargs):
+        key_url = scrub_secrets(url)
+        body = request_body(kwargs)
+        with self.lock:
+            interaction = self.next_interaction(self.exact, (method, key_url, body))
+            if interaction is None:
+                interaction = self.next_interaction(self.loose, (method, key_url))
+            if interaction is None:
+                self.misses += 1
+        if interaction is None:
+            logger.warning("Кассета %s: нет ответа на %s %s", self.path, method, key_url)
+            # Для скрипта промах выглядит как недоступная сеть
+            raise self.requests_module.exceptions.ConnectionError(f"Нет ответа в кассете: {method} {key_url}")
+
+        delay = interaction["elapsed"] if self.latency == "recorded" else self.latency
+        if delay:
+            timeout = kwargs.get("timeout")
+            if isinstance(timeout, (int, float)) and delay > timeout:
+                time.sleep(timeout)
+                raise self.requests_module.exceptions.Timeout(f"Таймаут {timeout} с: {method} {key_url}")
+            time.sleep(delay)
+        return CassetteResponse(interaction, self.requests_module)
+
+    def record(self, function, method, url, kwargs):
+        started = time.perf_counter()
+        response = function(url, **kwargs)
+        # Потоковый ответ читается целиком, скрипт получает его копию из кассеты
+        text = response.content.decode(response.encoding or "utf-8", "replace")
+        interaction = {
+            "method": method,
+            "url": scrub_secrets(url),
+            "body": request_body(kwargs),
+            "status": response.status_code,
+            "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+            "text": scrub_secrets(text),
+            "elapsed": round(time.perf_counter() - started, 4),
+        }
+        response.close()
+        with self.lock:
+            self.interactions.append(interaction)
+        replayed = dict(interaction)
+        replayed["text"] = text
+        return CassetteResponse(replayed, self.requests_module)
+
+    def post(self, url, **kwargs):
+        if self.mode == "record":
+            return self.record(self.requests_module.post, "POST", url, kwargs)
+        return self.replay("POST", url, kwargs)
+
+    def get(self, url, **kwargs):
+        if self.mode == "record":
+            return self.record(self.requests_module.get, "GET", url, kwargs)
+        return self.replay("GET", url, kwargs)
+
+
+def parse_latency(value):
+    if value in (None, "", "none", "0"):
+        return None
+    if value == "recorded":
+        return value
+    return float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Запись и воспроизведение обменов NextBot с Bitrix24.")
+    parser.add_argument("action", choices=("record", "replay"))
+    parser.add_argument("cassette", help="файл кассеты (JSON Lines)")
+    parser.add_argument("--trace", help="файл JSON Lines с командами; без него поток генерируется")
+    parser.add_argument("--ops", type=int, default=200, help="число синтетических команд")
+    parser.add_argument("--users", type=int, default=20, help="пользователи синтетического потока и мока")
+    parser.add_argument("--mock", action="store_true", help="записывать обмены с локальным моком Bitrix24")
+    parser.add_argument("--portals", type=int, default=2, help="число мок-порталов для --mock")
+    parser.add_argument("--tasks", type=int, default=300, help="задач на мок-портале для --mock")
+    parser.add_argument("--latency", default=None,
+                        help='задержка воспроизведения: "recorded" или секунды (по умолчанию без задержки)')
+    parser.add_argument("--warm", action="store_true", help="общий CACHE_STORE на все команды (по умолчанию пустой)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    options = parser.parse_args(argv)
+
+    import requests
+
+    user_names = [f"user{index}" for index in range(options.users)]
+    trace = load_trace(options.trace) if options.trace else synthetic_trace(options.ops, user_names, seed=options.seed)
+    mock = None
+    requests_module = requests
+    if options.action == "record" and options.mock:
+        mock = MockPortalServer(portals=options.portals, users=options.users, tasks_per_portal=options.tasks,
+                                seed=options.seed).start()
+        requests_module = SheetRedirectRequests(requests, mock.sheet_url)
+    cassette = CassetteRequests(options.cassette, mode=options.action, requests_module=requests_module,
+                                latency=parse_latency(options.latency))
+    try:
+        shared_runner = ScriptRunner(requests_module=cassette)
+
+        def run_command(command, args):
+            runner = shared_runner if options.warm else ScriptRunner(requests_module=cassette)
+            return runner.run(command, dict(args))
+
+        # Команды идут строго по одной: порядок запросов при записи и воспроизведении совпадает
+        records = []
+        started_at = time.perf_counter()
+        for item in trace:
+            started = time.perf_counter()
+            try:
+                outcome = command_outcome(run_command(item["command"], item["args"]))
+            except Exception:
+                outcome = "exception"
+            elapsed = time.perf_counter() - started
+            records.append({"command": item["command"], "outcome": outcome, "latency": elapsed, "service_time": elapsed})
+        run = {"records": records, "duration": time.perf_counter() - started_at}
+    finally:
+        if mock is not None:
+            mock.stop()
+    if options.action == "record":
+        print(f"Записано обменов: {cassette.save()} в {options.cassette}")
+    else:
+        print(f"Воспроизведено из {options.cassette}, промахов: {cassette.misses}")
+
+    report = build_report(run)
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Хранилища вебхуков пользователей для резидентного раннера.
+
+Скрипты ищут вебхук в индексе CACHE_STORE["credentials"]; раннер кладет туда
+словарь выбранного хранилища, поэтому поиск — обращение к словарю в памяти, а
+Google Таблица на пути команды не участвует. Таблица остается способом
+администрирования: ее CSV импортируется в локальное хранилище командой
+
+    python -m nextbot_runner.credentials --store sqlite:webhooks.db import-sheet <url CSV>
+
+Хранилища задаются строкой: "sqlite:<путь>", "json:<путь>" или "env"
+(JSON-объект {"имя": "вебхук"} или {"имя": ["вебхук", ...]} в переменной
+окружения NEXTBOT_WEBHOOKS). У пользователя может быть несколько порталов:
+первый вебхук основной, остальные используются сводным просмотром задач.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+ENV_VARIABLE = "NEXTBOT_WEBHOOKS"
+
+
+def normalize_webhook(webhook):
+    """Убирает непечатаемые символы и добавляет завершающий '/' (как в скриптах)."""
+    webhook = "".join(c for c in str(webhook).strip() if c.isprintable())
+    if not webhook.endswith("/"):
+        webhook += "/"
+    return webhook
+
+
+def parse_sheet_csv(csv_data):
+    """
+    Разбирает CSV таблицы вебхуков (A - Имя, B - Вебхук) в {имя: [вебхуки]}.
+    Пользователь с несколькими порталами занимает несколько строк; первая задает основной портал.
+    """
+    webhooks = {}
+    for line in csv_data.strip().splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2:
+            user_name = parts[0].strip()
+            webhook = normalize_webhook(parts[1])
+            if user_name and webhook != "/":
+                user_webhooks = webhooks.setdefault(user_name, [])
+                if webhook not in user_webhooks:
+                    user_webhooks.append(webhook)
+    return webhooks
+
+
+def normalize_webhook_list(webhooks):
+    """Приводит значение хранилища (строку или список) к списку нормализованных вебхуков без повторов."""
+    if isinstance(webhooks, str):
+        webhooks = [webhooks]
+    result = []
+    for webhook in webhooks or []:
+        webhook = normalize_webhook(webhook)
+        if webhook not in result:
+            result.append(webhook)
+    return result
+
+
+class CredentialStore:
+    """Индекс {имя: [вебхуки]} в памяти; подклассы сохраняют изменения на диск."""
+
+    name = "memory"
+
+    def __init__(self, webhooks=None):
+        self.lock = threading.Lock()
+        self.webhooks = {}
+        # Индексы CACHE_STORE["credentials"], в которые установлено хранилище (install)
+        self.installed = []
+        for user_name, user_webhooks in (webhooks or {}).items():
+            user_webhooks = normalize_webhook_list(user_webhooks)
+            if user_webhooks:
+                self.webhooks[user_name] = user_webhooks
+
+    def get(self, user_name):
+        """Основной вебхук пользователя."""
+        user_webhooks = self.webhooks.get(user_name)
+        return user_webhooks[0] if user_webhooks else None
+
+    def get_all(self, user_name):
+        return list(self.webhooks.get(user_name) or [])
+
+    def items(self):
+        return sorted(self.webhooks.items())
+
+    def check_writable(self):
+        """
+        Вызывается перед каждым изменением: хранилище только для чтения отклоняет его
+        здесь (ValueError), до того как индекс в памяти изменится.
+        """
+
+    def set(self, user_name, webhook):
+        """Задает единственный вебхук пользователя."""
+        self.check_writable()
+        with self.lock:
+            self.webhooks[user_name] = [normalize_webhook(webhook)]
+            self.save()
+
+    def add(self, user_name, webhook):
+        """Добавляет пользователю еще один портал."""
+        self.check_writable()
+        with self.lock:
+            user_webhooks = self.webhooks.get(user_name) or []
+            webhook = normalize_webhook(webhook)
+            if webhook not in user_webhooks:
+                # Новый список, а не append: скрипты могут читать старый параллельно
+                self.webhooks[user_name] = user_webhooks + [webhook]
+                self.save()
+
+    def delete(self, user_name, webhook=None):
+        """Удаляет пользователя целиком или только один его вебхук."""
+        self.check_writable()
+        with self.lock:
+            user_webhooks = self.webhooks.get(user_name)
+            if not user_webhooks:
+                return False
+            if webhook is None:
+                del self.webhooks[user_name]
+            else:
+                webhook = normalize_webhook(webhook)
+                if webhook not in user_webhooks:
+                    return False
+                remaining = [item for item in user_webhooks if item != webhook]
+                if remaining:
+                    self.webhooks[user_name] = remaining
+                else:
+                    del self.webhooks[user_name]
+            self.save()
+            return True
+
+    def replace(self, webhooks):
+        """
+        Заменяет содержимое хранилища целиком (импорт таблицы). Новый словарь строится
+        отдельно и подменяет старый одной ссылкой, поэтому скрипты, читающие индекс
+        параллельно, видят либо прежний, либо новый набор вебхуков, но не пустой.
+        """
+        self.check_writable()
+        replacement = {}
+        for user_name, user_webhooks in webhooks.items():
+            user_webhooks = normalize_webhook_list(user_webhooks)
+            if user_webhooks:
+                replacement[user_name] = user_webhooks
+        with self.lock:
+            self.webhooks = replacement
+            for index in self.installed:
+                index["webhooks"] = replacement
+            self.save()
+
+    def save(self):
+        pass
+
+    def install(self, store):
+        """Подставляет индекс в общий CACHE_STORE раннера; изменения хранилища видны скриптам сразу."""
+        index = {"source": self.name, "webhooks": self.webhooks, "synced_at": None}
+        self.installed.append(index)
+        store["credentials"] = index
+
+
+class JsonCredentialStore(CredentialStore):
+    """Вебхуки в JSON-файле {"имя": ["вебхук", ...]} (одиночная строка тоже допускается)."""
+
+    name = "json"
+
+    def __init__(self, path):
+        self.path = path
+        webhooks = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as source:
+                webhooks = json.load(source)
+        super().__init__(webhooks)
+
+    def save(self):
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as output:
+            json.dump(self.webhooks, output, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+
+class SqliteCredentialStore(CredentialStore):
+    """
+    Вебхуки в таблице SQLite user_webhooks (по строке на портал пользователя);
+    при запуске таблица целиком читается в индекс. Таблица webhooks прежней
+    версии (один вебхук на пользователя) переносится при первом открытии.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS user_webhooks (user_name TEXT NOT NULL, webhook TEXT NOT NULL, "
+            "position INTEGER NOT NULL, PRIMARY KEY (user_name, webhook))"
+        )
+        legacy = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'webhooks'"
+        ).fetchone()
+        if legacy:
+            self.connection.execute("INSERT OR IGNORE INTO user_webhooks (user_name, webhook, position) "
+                                    "SELECT user_name, webhook, 0 FROM webhooks")
+            self.connection.execute("DROP TABLE webhooks")
+        self.connection.commit()
+        rows = self.connection.execute(
+            "SELECT user_name, webhook FROM user_webhooks ORDER BY user_name, position"
+        ).fetchall()
+        webhooks = {}
+        for row in rows:
+            webhooks.setdefault(row[0], []).append(row[1])
+        super().__init__(webhooks)
+
+    def save(self):
+        rows = []
+        for user_name, user_webhooks in self.webhooks.items():
+            for position, webhook in enumerate(user_webhooks):
+                rows.append((user_name, webhook, position))
+        self.connection.execute("DELETE FROM user_webhooks")
+        self.connection.executemany("INSERT INTO user_webhooks (user_name, webhook, position) VALUES (?, ?, ?)", rows)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class EnvCredentialStore(CredentialStore):
+    """Вебхуки из переменной окружения NEXTBOT_WEBHOOKS (JSON-объект); только для чтения."""
+
+    name = "env"
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        super().__init__(json.loads(environ.get(ENV_VARIABLE) or "{}"))
+
+    def check_writable(self):
+        raise ValueError(f"Хранилище env только для чтения, измените переменную {ENV_VARIABLE}.")
+
+
+def open_credential_store(spec):
+    """Открывает хранилище по строке "sqlite:<путь>", "json:<путь>" или "env"."""
+    if spec == "env":
+        return EnvCredentialStore()
+    kind, separator, path = spec.partition(":")
+    if not separator or not path:
+        raise ValueError(f"Неизвестное хранилище вебхуков: {spec}")
+    if kind == "sqlite":
+        return SqliteCredentialStore(path)
+    if kind == "json":
+        return JsonCredentialStore(path)
+    raise ValueError(f"Неизвестное хранилище вебхуков: {spec}")
+
+
+def import_sheet(credential_store, sheet_url, requests_module=None, timeout=30):
+    """Загружает опубликованную таблицу CSV и заменяет ею содержимое хранилища."""
+    if requests_module is None:
+        import requests as requests_module
+    response = requests_module.get(sheet_url, timeout=timeout)
+    response.raise_for_status()
+    webhooks = parse_sheet_csv(response.text)
+    credential_store.replace(webhooks)
+    return len(webhooks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Управление хранилищем вебхуков NextBot.")
+    parser.add_argument("--store", required=True, help='"sqlite:<путь>", "json:<путь>" или "env"')
+    commands = parser.add_subparsers(dest="action", required=True)
+    import_parser = commands.add_parser("import-sheet", help="импортировать опубликованную таблицу CSV")
+    import_parser.add_argument("url")
+    set_parser = commands.add_parser("set", help="задать единственный вебхук пользователя")
+    set_parser.add_argument("user_name")
+    set_parser.add_argument("webhook")
+    add_parser = commands.add_parser("add", help="добавить пользователю еще один портал")
+    add_parser.add_argument("user_name")
+    add_parser.add_argument("webhook")
+    delete_parser = commands.add_parser("delete", help="удалить пользователя или один его вебхук")
+    delete_parser.add_argument("user_name")
+    delete_parser.add_argument("webhook", nargs="?")
+    commands.add_parser("list", help="показать пользователей и порталы")
+    options = parser.parse_args(argv)
+
+    credential_store = open_credential_store(options.store)
+    if options.action == "import-sheet":
+        print(f"Импортировано пользователей: {import_sheet(credential_store, options.url)}")
+    elif options.action == "set":
+        credential_store.set(options.user_name, options.webhook)
+    elif options.action == "add":
+        credential_store.add(options.user_name, options.webhook)
+    elif options.action == "delete":
+        if not credential_store.delete(options.user_name, options.webhook):
+            print(f"Пользователь {options.user_name} или его вебхук не найден.")
+    elif options.action == "list":
+        for user_name, user_webhooks in credential_store.items():
+            # Секрет вебхука не печатаем, только порталы
+            print(f"{user_name}\t" + ", ".join(webhook.split('/rest/')[0] for webhook in user_webhooks))
+
+
+if __name__ == "__main__":
+    main()
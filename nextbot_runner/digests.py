@@ -0,0 +1,172 @@
+"""
+Планировщик дайджестов show_task.
+
+Самые частые запросы — «задачи на сегодня», «на завтра» и «просроченные».
+Планировщик заранее строит их для каждого пользователя из индекса вебхуков:
+вызывает show_task с флагом digest_build, и скрипт сохраняет готовый ответ
+(группировка по проектам, имена ответственных) в CACHE_STORE["show_task_digests"].
+Запрос пользователя с теми же фильтрами отдается из дайджеста без обращений
+к Bitrix24.
+
+Все дайджесты перестраиваются раз в interval секунд и при смене дня. Изменение
+задач сбрасывает дайджесты портала, и планировщик достраивает недостающие на
+ближайшем проходе (раз в poll секунд). С параметром path дайджесты сохраняются
+в JSON-файл и читаются при старте, поэтому утренний всплеск после перезапуска
+раннера тоже обходится без запросов к порталам.
+
+Пример:
+    scheduler = DigestScheduler(ScriptRunner(credentials=store), path="digests.json")
+    scheduler.start()
+"""
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import threading
+
+# Вид дайджеста -> срок, с которым его строит show_task
+DIGEST_DEADLINES = {"today": "сегодня", "tomorrow": "завтра", "overdue": "просроченные"}
+
+logger = logging.getLogger("nextbot_runner")
+
+
+def day_key(moment):
+    return f"{moment.year:04d}-{moment.month:02d}-{moment.day:02d}"
+
+
+class DigestScheduler:
+    """Периодически строит дайджесты show_task для пользователей индекса вебхуков."""
+
+    def __init__(self, runner, interval=900, poll=30, workers=4, path=None, users=None):
+        self.runner = runner
+        self.interval = interval
+        self.poll = poll
+        self.workers = workers
+        self.path = path
+        self.users = users
+        self.last_full_run = None
+        self.save_lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def digest_targets(self):
+        """Пары (пользователь, вебхук) по всем порталам пользователей индекса."""
+        credentials = self.runner.store.get("credentials")
+        if not credentials:
+            return []
+        user_names = self.users if self.users is not None else sorted(credentials["webhooks"])
+        targets = []
+        for user_name in user_names:
+            for webhook in credentials["webhooks"].get(user_name) or []:
+                targets.append((user_name, webhook))
+        return targets
+
+    def has_digest(self, user_name, webhook, kind):
+        """Проверяет, есть ли у пользователя дайджест, построенный сегодня."""
+        portal_digests = self.runner.store.get("show_task_digests", {}).get(webhook.split("/rest/")[0], {})
+        entry = portal_digests.get(user_name, {}).get(kind)
+        return bool(entry) and entry["day"] == day_key(datetime.datetime.now())
+
+    def build(self, user_name, webhook, kind):
+        """Строит один дайджест вызовом show_task; возвращает True при успехе."""
+        args = {
+            "nameUser": user_name,
+            "webhook": webhook,
+            "deadline": DIGEST_DEADLINES[kind],
+            "cache_refresh": True,
+            "digest_build": True,
+        }
+        try:
+            answer = json.loads(self.runner.run("show_task", args))
+        except Exception as e:
+            logger.warning("Дайджест %s для '%s' не построен: %s", kind, user_name, e)
+            return False
+        return answer.get("status") == "success"
+
+    def run_once(self, only_missing=False):
+        """Строит дайджесты (все или только недостающие) и возвращает число построенных."""
+        jobs = []
+        for target in self.digest_targets():
+            for kind in DIGEST_DEADLINES:
+                if not only_missing or not self.has_digest(target[0], target[1], kind):
+                    jobs.append((target[0], target[1], kind))
+        if not jobs:
+            return 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="nextbot-digest") as executor:
+            built = sum(executor.map(lambda job: self.build(*job), jobs))
+        if built and self.path:
+            self.save()
+        return built
+
+    def tick(self):
+        """Один проход планировщика: полная перестройка по расписанию, иначе только недостающие."""
+        now = datetime.datetime.now()
+        if (self.last_full_run is None or day_key(now) != day_key(self.last_full_run)
+                or now - self.last_full_run >= datetime.timedelta(seconds=self.interval)):
+            self.last_full_run = now
+            return self.run_once()
+        return self.run_once(only_missing=True)
+
+    def save(self):
+        """Записывает дайджесты в JSON-файл path."""
+        digests = self.runner.store.get("show_task_digests", {})
+        serialized = {}
+        for portal_url, portal_digests in list(digests.items()):
+            for user_name, user_digests in list(portal_digests.items()):
+                for kind, entry in list(user_digests.items()):
+                    serialized.setdefault(portal_url, {}).setdefault(user_name, {})[kind] = {
+                        "payload": entry["payload"],
+                        "stored_at": entry["stored_at"].isoformat(),
+                        "day": entry["day"],
+                    }
+        with self.save_lock:
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as output:
+                json.dump(serialized, output, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+
+    def load(self):
+        """Читает сохраненные дайджесты в CACHE_STORE; устаревшие отсеет сам show_task."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding="utf-8") as source:
+            serialized = json.load(source)
+        digests = self.runner.store.setdefault("show_task_digests", {})
+        loaded = 0
+        for portal_url, portal_digests in serialized.items():
+            for user_name, user_digests in portal_digests.items():
+                for kind, entry in user_digests.items():
+                    digests.setdefault(portal_url, {}).setdefault(user_name, {})[kind] = {
+                        "payload": entry["payload"],
+                        "stored_at": datetime.datetime.fromisoformat(entry["stored_at"]),
+                        "day": entry["day"],
+                    }
+                    loaded += 1
+        return loaded
+
+    def start(self):
+        """Загружает сохраненные дайджесты и запускает фоновый поток планировщика."""
+        if self.thread is not None:
+            return self.thread
+        self.load()
+
+        def loop():
+            while not self.stop_event.is_set():
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.warning("Проход планировщика дайджестов не удался: %s", e)
+                self.stop_event.wait(self.poll)
+
+        self.thread = threading.Thread(target=loop, name="show-task-digests", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Останавливает фоновый поток планировщика."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
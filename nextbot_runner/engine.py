@@ -0,0 +1,85 @@
+"""
+Асинхронный движок команд NextBot.
+
+Скрипты NextBot остаются синхронными (в песочнице платформы нет asyncio и
+явных импортов), поэтому движок выполняет их в пуле потоков, а планирование,
+ожидание и ограничения живут в одном цикле событий asyncio:
+
+* много команд пользователей выполняются параллельно, пока их запросы
+  к Bitrix24 ждут сеть;
+* на каждый портал одновременно выполняется не больше per_portal команд,
+  остальные ждут своей очереди в цикле событий, не занимая потоки;
+* портал команды определяется заранее по индексу вебхуков
+  (CACHE_STORE["credentials"]); если пользователя в индексе нет (например, до
+  первой синхронизации таблицы), команда не делит ни с кем семафор портала:
+  ее ограничивает только пул потоков max_concurrency, а вебхук разрешит сам скрипт.
+
+Семафоры порталов принадлежат циклу событий, в котором созданы (на Python
+до 3.10 они привязываются к нему навсегда), поэтому движок хранит их отдельно
+для каждого цикла: один движок можно использовать из нескольких asyncio.run().
+
+Пример:
+    engine = AsyncEngine(ScriptRunner(credentials=store), per_portal=4)
+    results = asyncio.run(engine.run_many([("show_task", {"nameUser": "user1"})]))
+"""
+import asyncio
+import concurrent.futures
+
+
+class AsyncEngine:
+    """Выполняет команды ScriptRunner в цикле событий с ограничением параллельности на портал."""
+
+    def __init__(self, runner, per_portal=4, max_concurrency=64):
+        self.runner = runner
+        self.per_portal = per_portal
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency,
+                                                              thread_name_prefix="nextbot-command")
+        # {цикл событий: {портал: семафор}}
+        self.semaphores = {}
+
+    def portal_semaphore(self, portal_url):
+        # Семафоры создаются лениво внутри текущего цикла событий, которому принадлежат
+        loop = asyncio.get_running_loop()
+        loop_semaphores = self.semaphores.get(loop)
+        if loop_semaphores is None:
+            # Семафоры закрытых циклов больше не нужны
+            for closed_loop in [known for known in self.semaphores if known.is_closed()]:
+                del self.semaphores[closed_loop]
+            loop_semaphores = self.semaphores.setdefault(loop, {})
+        semaphore = loop_semaphores.get(portal_url)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_portal)
+            loop_semaphores[portal_url] = semaphore
+        return semaphore
+
+    def resolve_webhook(self, user_name):
+        """Ищет основной вебхук пользователя в индексе раннера без обращения к сети."""
+        credentials = self.runner.store.get("credentials")
+        if not credentials or not user_name:
+            return None
+        user_webhooks = credentials["webhooks"].get(user_name)
+        return user_webhooks[0] if user_webhooks else None
+
+    def resolve_portal(self, args):
+        """Портал команды по индексу вебхуков или None, если пользователь в индексе не найден."""
+        webhook = self.resolve_webhook(args.get("nameUser"))
+        if not webhook:
+            return None
+        return webhook.split("/rest/")[0]
+
+    async def run(self, command, args):
+        """Выполняет команду и возвращает значение result скрипта."""
+        portal_url = self.resolve_portal(args)
+        loop = asyncio.get_running_loop()
+        if portal_url is None:
+            # Портал неизвестен: общий семафор связал бы команды всех порталов
+            return await loop.run_in_executor(self.executor, self.runner.run, command, args)
+        async with self.portal_semaphore(portal_url):
+            return await loop.run_in_executor(self.executor, self.runner.run, command, args)
+
+    async def run_many(self, commands):
+        """Выполняет пары (команда, args) параллельно; исключение команды возвращается на ее месте."""
+        return await asyncio.gather(*(self.run(command, args) for command, args in commands), return_exceptions=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
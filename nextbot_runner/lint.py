@@ -0,0 +1,52 @@
+"""
+Статическая проверка скриптов NextBot (pyflakes).
+
+Скрипты исполняются в песочнице, которая сама подставляет requests, json, re,
+datetime, debug и args, а резидентный раннер — еще CACHE_STORE, PARALLEL_MAP,
+LOG_LEVEL и EXPORT_OPEN. Эти имена передаются pyflakes как встроенные, поэтому
+в отчете остаются настоящие ошибки: неопределенные имена, опечатки,
+неиспользуемые переменные. Код выхода 1, если найдено хотя бы одно замечание.
+
+Пример:
+    python -m nextbot_runner.lint
+    python -m nextbot_runner.lint nextbot_functions/show_task.py
+"""
+import argparse
+import ast
+import glob
+import os
+import sys
+
+from .runner import SCRIPTS_DIR
+
+SANDBOX_GLOBALS = ("requests", "json", "re", "datetime", "debug", "args", "CACHE_STORE", "PARALLEL_MAP", "LOG_LEVEL", "EXPORT_OPEN")
+
+
+def lint_paths(paths):
+    """Проверяет файлы pyflakes с глобальными именами песочницы; возвращает число замечаний."""
+    from pyflakes.checker import Checker
+
+    warnings = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as source:
+            tree = ast.parse(source.read(), filename=path)
+        checker = Checker(tree, filename=path, builtins=SANDBOX_GLOBALS)
+        for message in sorted(checker.messages, key=lambda message: message.lineno):
+            print(message)
+            warnings += 1
+    return warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка скриптов NextBot через pyflakes.")
+    parser.add_argument("paths", nargs="*", help="файлы скриптов (по умолчанию все скрипты nextbot_functions)")
+    options = parser.parse_args(argv)
+    paths = options.paths or sorted(glob.glob(os.path.join(SCRIPTS_DIR, "*.py")))
+    warnings = lint_paths(paths)
+    if warnings:
+        print(f"Замечаний: {warnings}")
+    return 1 if warnings else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Нагрузочный прогон команд NextBot по записанному или синтетическому потоку args.
+
+Команды выполняются резидентным раннером против локального мока Bitrix24
+и таблицы вебхуков (mock_portal.MockPortalServer) с заданной частотой и
+параллельностью. Отчет: пропускная способность, доля ошибок, хвосты
+задержек по командам и частота запросов к каждому порталу.
+
+Пример:
+    python -m nextbot_runner.loadgen --ops 2000 --rate 100 --concurrency 32 --portals 5 --users 200
+
+Формат файла трассы (--trace): JSON Lines, по одной команде в строке:
+    {"command": "show_task", "args": {"nameUser": "user1", "deadline": "завтра"}}
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import threading
+import time
+
+from .credentials import CredentialStore, parse_sheet_csv
+from .engine import AsyncEngine
+from .metrics import command_outcome
+from .mock_portal import PROJECT_NAMES, MockPortalServer, make_task_title
+from .runner import ScriptRunner
+
+DEFAULT_MIX = {
+    "show_task": 0.45,
+    "add_new_task": 0.25,
+    "update_task": 0.2,
+    "delete_task": 0.05,
+    "create_project": 0.05,
+}
+
+
+class SheetRedirectRequests:
+    """Обертка над requests, перенаправляющая загрузку Google Таблицы на мок."""
+
+    def __init__(self, requests_module, sheet_url):
+        self.requests_module = requests_module
+        self.sheet_url = sheet_url
+
+    def __getattr__(self, name):
+        return getattr(self.requests_module, name)
+
+    def get(self, url, **kwargs):
+        if url.startswith("https://docs.google.com/spreadsheets/"):
+            url = self.sheet_url
+        return self.requests_module.get(url, **kwargs)
+
+
+def synthetic_args(command, user_name, rng):
+    """Строит правдоподобные аргументы NextBot для команды."""
+    args = {"nameUser": user_name}
+    if command == "show_task":
+        if rng.random() < 0.3:
+            args["project_name"] = rng.choice(PROJECT_NAMES)
+        if rng.random() < 0.3:
+            args["deadline"] = rng.choice(("сегодня", "завтра"))
+    elif command == "add_new_task":
+        args["title"] = make_task_title(rng)
+        if rng.random() < 0.5:
+            args["project"] = rng.choice(PROJECT_NAMES)
+        if rng.random() < 0.3:
+            args["deadline"] = rng.choice(("завтра", "послезавтра", "через 3 дня"))
+        args["priority"] = rng.choice(("высокий", "средний", "низкий"))
+    elif command == "update_task":
+        args["find_title"] = make_task_title(rng)
+        if rng.random() < 0.5:
+            args["status"] = rng.choice(("выполняется", "ждет выполнения", "отложена"))
+        else:
+            args["priority"] = rng.choice(("высокий", "низкий"))
+    elif command == "delete_task":
+        args["title"] = make_task_title(rng)
+    elif command == "create_project":
+        args["name"] = f"Проект {rng.randint(1, 100000)}"
+    elif command == "batch_tasks":
+        project = rng.choice(PROJECT_NAMES)
+        args["operations"] = [
+            {"action": "create", "title": make_task_title(rng), "project": project},
+            {"action": "create", "title": make_task_title(rng), "project": project, "deadline": "завтра"},
+            {"action": "update", "find_title": make_task_title(rng), "deadline": "послезавтра"},
+        ]
+    return args
+
+
+def synthetic_trace(count, user_names, mix=None, seed=1):
+    """Генерирует поток команд с заданной долей каждой команды."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    commands = list(mix)
+    weights = [mix[command] for command in commands]
+    trace = []
+    for _ in range(count):
+        command = rng.choices(commands, weights)[0]
+        trace.append({"command": command, "args": synthetic_args(command, rng.choice(user_names), rng)})
+    return trace
+
+
+def load_trace(path):
+    """Читает трассу команд из файла JSON Lines."""
+    trace = []
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            if line.strip():
+                trace.append(json.loads(line))
+    return trace
+
+
+def percentile(values, fraction):
+    """Перцентиль методом ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_load(trace, run_command, rate=None, concurrency=16):
+    """
+    Выполняет трассу и возвращает записи о каждой команде.
+    При заданной частоте команды отправляются по расписанию (открытая модель),
+    и задержка считается от запланированного момента, включая ожидание в очереди.
+    Без частоты вся трасса ставится в очередь сразу (пиковый всплеск).
+    """
+    records = []
+    records_lock = threading.Lock()
+
+    def execute(item, scheduled_at):
+        started = time.perf_counter()
+        try:
+            outcome = command_outcome(run_command(item["command"], item["args"]))
+        except Exception:
+            outcome = "exception"
+        finished = time.perf_counter()
+        record = {
+            "command": item["command"],
+            "outcome": outcome,
+            "latency": finished - scheduled_at,
+            "service_time": finished - started,
+        }
+        with records_lock:
+            records.append(record)
+
+    started_at = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, item in enumerate(trace):
+            scheduled_at = time.perf_counter()
+            if rate:
+                scheduled_at = started_at + index / rate
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(execute, item, scheduled_at)
+    duration = time.perf_counter() - started_at
+    return {"records": records, "duration": duration}
+
+
+async def run_load_async(trace, engine, rate=None):
+    """То же, что run_load, но команды планируются в цикле событий через AsyncEngine."""
+    records = []
+
+    async def execute(item, scheduled_at):
+        started = time.perf_counter()
+        try:
+            outcome = command_outcome(await engine.run(item["command"], dict(item["args"])))
+        except Exception:
+            outcome = "exception"
+        finished = time.perf_counter()
+        records.append({
+            "command": item["command"],
+            "outcome": outcome,
+            "latency": finished - scheduled_at,
+            "service_time": finished - started,
+        })
+
+    started_at = time.perf_counter()
+    pending = []
+    for index, item in enumerate(trace):
+        scheduled_at = time.perf_counter()
+        if rate:
+            scheduled_at = started_at + index / rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        pending.append(asyncio.create_task(execute(item, scheduled_at)))
+    await asyncio.gather(*pending)
+    duration = time.perf_counter() - started_at
+    return {"records": records, "duration": duration}
+
+
+def build_report(run, request_counts=None):
+    """Сводит записи прогона в отчет."""
+    records = run["records"]
+    duration = run["duration"] or 1e-9
+    report = {
+        "operations": len(records),
+        "duration_seconds": round(duration, 3),
+        "throughput_ops": round(len(records) / duration, 2),
+        "commands": {},
+        "portals": {},
+    }
+    by_command = {}
+    for record in records:
+        by_command.setdefault(record["command"], []).append(record)
+    by_command["ALL"] = records
+    for command, command_records in sorted(by_command.items()):
+        latencies = [record["latency"] for record in command_records]
+        errors = [record for record in command_records if record["outcome"] in ("error", "exception", "unknown")]
+        report["commands"][command] = {
+            "count": len(command_records),
+            "error_rate": round(len(errors) / len(command_records), 4) if command_records else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        }
+    for key, count in sorted((request_counts or {}).items()):
+        portal = key[0]
+        method = key[1]
+        portal_report = report["portals"].setdefault(portal, {"requests": 0, "requests_per_second": 0.0, "methods": {}})
+        portal_report["requests"] += count
+        portal_report["methods"][method] = count
+    for portal_report in report["portals"].values():
+        portal_report["requests_per_second"] = round(portal_report["requests"] / duration, 2)
+    return report
+
+
+def format_report(report):
+    """Текстовое представление отчета."""
+    lines = [
+        f"Операций: {report['operations']} за {report['duration_seconds']} с, "
+        f"пропускная способность {report['throughput_ops']} оп/с",
+        "",
+        f"{'команда':<16}{'кол-во':>8}{'ошибки':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'max мс':>9}",
+    ]
+    for command, stats in report["commands"].items():
+        lines.append(
+            f"{command:<16}{stats['count']:>8}{stats['error_rate'] * 100:>8.1f}%"
+            f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}"
+        )
+    if report["portals"]:
+        lines.append("")
+        lines.append(f"{'портал':<16}{'запросов':>10}{'в секунду':>11}")
+        for portal, stats in report["portals"].items():
+            lines.append(f"{portal:<16}{stats['requests']:>10}{stats['requests_per_second']:>11}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон команд NextBot против мока Bitrix24.")
+    parser.add_argument("--trace", help="файл JSON Lines с командами; без него поток генерируется")
+    parser.add_argument("--ops", type=int, default=1000, help="число синтетических команд")
+    parser.add_argument("--rate", type=float, default=None, help="команд в секунду (по умолчанию без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=16, help="число параллельных исполнителей")
+    parser.add_argument("--async-engine", action="store_true",
+                        help="выполнять команды через AsyncEngine (цикл событий и лимит на портал)")
+    parser.add_argument("--per-portal", type=int, default=4, help="команд на портал одновременно для --async-engine")
+    parser.add_argument("--portals", type=int, default=3, help="число мок-порталов")
+    parser.add_argument("--users", type=int, default=50, help="число пользователей в таблице вебхуков")
+    parser.add_argument("--tasks", type=int, default=300, help="задач на каждом портале")
+    parser.add_argument("--latency-ms", type=float, default=20, help="задержка ответа мока")
+    parser.add_argument("--cold", action="store_true", help="без общего CACHE_STORE, как при запуске на платформе")
+    parser.add_argument("--local-credentials", action="store_true",
+                        help="вебхуки из локального хранилища (таблица мока импортируется один раз при старте)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    options = parser.parse_args(argv)
+    if options.cold and options.async_engine:
+        # AsyncEngine работает с одним резидентным раннером, холодный запуск в нем не воспроизвести
+        parser.error("--cold нельзя сочетать с --async-engine: движок исполняет команды в общем раннере")
+
+    import requests
+
+    mock = MockPortalServer(portals=options.portals, users=options.users, tasks_per_portal=options.tasks,
+                            latency_ms=options.latency_ms, seed=options.seed).start()
+    try:
+        requests_module = SheetRedirectRequests(requests, mock.sheet_url)
+        if options.trace:
+            trace = load_trace(options.trace)
+        else:
+            trace = synthetic_trace(options.ops, mock.user_names, seed=options.seed)
+
+        credentials = None
+        if options.local_credentials:
+            credentials = CredentialStore(parse_sheet_csv(mock.sheet_csv()))
+        shared_runner = ScriptRunner(requests_module=requests_module, credentials=credentials)
+
+        def run_command(command, args):
+            runner = shared_runner
+            if options.cold:
+                runner = ScriptRunner(requests_module=requests_module, credentials=credentials)
+            return runner.run(command, dict(args))
+
+        if options.async_engine:
+            engine = AsyncEngine(shared_runner, per_portal=options.per_portal, max_concurrency=options.concurrency)
+            try:
+                run = asyncio.run(run_load_async(trace, engine, rate=options.rate))
+            finally:
+                engine.close()
+        else:
+            run = run_load(trace, run_command, rate=options.rate, concurrency=options.concurrency)
+        report = build_report(run, mock.request_counts)
+    finally:
+        mock.stop()
+
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+    return report
+
+
+if __name__ == "__main__":
+    main()
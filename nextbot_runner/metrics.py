@@ -0,0 +1,224 @@
+"""
+Метрики резидентного раннера в текстовом формате Prometheus.
+
+Раннер замеряет время каждой команды, а подменный модуль requests —
+каждый вызов Bitrix24 и Google Sheets (метод REST, исход, размер ответа).
+Счетчики, которые ведут сами скрипты (попадания в кеши, отказы
+предохранителя), читаются из общего словаря CACHE_STORE при выгрузке.
+"""
+import http.server
+import json
+import threading
+import time
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def format_labels(labels):
+    """Превращает кортеж пар (имя, значение) в строку меток Prometheus."""
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def b24_method_from_url(url):
+    """Извлекает имя метода REST из адреса вызова (…/rest/1/secret/user.get.json -> user.get)."""
+    if "docs.google.com" in url:
+        return "sheets.csv"
+    method = url.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+    if method.endswith(".json"):
+        method = method[:-len(".json")]
+    return method
+
+
+def command_outcome(result):
+    """Определяет исход команды по ответу скрипта (dict или JSON-строка)."""
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return "unknown"
+    if not isinstance(result, dict):
+        return "unknown"
+    status = result.get("result") or result.get("status")
+    if status not in ("success", "error", "partial", "clarify"):
+        return "unknown"
+    if status == "success" and result.get("stale"):
+        return "stale"
+    return status
+
+
+class Metrics:
+    """Потокобезопасный набор счетчиков и гистограмм."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1, help_text=""):
+        with self.lock:
+            self.help.setdefault(name, help_text)
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS, help_text=""):
+        with self.lock:
+            self.help.setdefault(name, help_text)
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                series[labels] = histogram
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def observe_command(self, command, seconds, outcome):
+        labels = (("command", command), ("outcome", outcome))
+        self.inc("nextbot_commands_total", labels, help_text="Вызовы команд NextBot")
+        self.observe("nextbot_command_duration_seconds", labels, seconds,
+                     help_text="Длительность команды NextBot")
+
+    def observe_b24_call(self, method, seconds, outcome, response_bytes=None):
+        labels = (("method", method), ("outcome", outcome))
+        self.inc("nextbot_b24_requests_total", labels, help_text="Запросы к Bitrix24 и Google Sheets")
+        self.observe("nextbot_b24_request_duration_seconds", labels, seconds,
+                     help_text="Длительность запроса к Bitrix24 и Google Sheets")
+        if response_bytes is not None:
+            self.observe("nextbot_b24_response_bytes", (("method", method),), response_bytes,
+                         buckets=SIZE_BUCKETS, help_text="Размер ответа Bitrix24 и Google Sheets")
+
+    def render(self, store=None):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for name in sorted(self.histograms):
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                        bucket_labels = labels + (("le", repr(float(bound))),)
+                        lines.append(f"{name}_bucket{format_labels(bucket_labels)} {count}")
+                    inf_labels = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{format_labels(inf_labels)} {histogram['count']}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        if store is not None:
+            lines.extend(render_store_metrics(store))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, store=None):
+        """Записывает метрики в файл (например, для node_exporter textfile collector)."""
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(self.render(store))
+
+
+def render_store_metrics(store):
+    """Выгружает счетчики, которые скрипты ведут в CACHE_STORE."""
+    lines = []
+    cache_stats = store.get("cache_stats", {})
+    if cache_stats:
+        lines.append("# HELP nextbot_cache_events_total Обращения к кешам скриптов (hit, stale, miss)")
+        lines.append("# TYPE nextbot_cache_events_total counter")
+        for cache_name in sorted(cache_stats):
+            for event, value in sorted(cache_stats[cache_name].items()):
+                labels = (("cache", cache_name), ("event", event))
+                lines.append(f"nextbot_cache_events_total{format_labels(labels)} {value}")
+
+    circuits = store.get("circuit_breakers", {})
+    if circuits:
+        lines.append("# HELP nextbot_circuit_open Предохранитель портала разомкнут (1) или замкнут (0)")
+        lines.append("# TYPE nextbot_circuit_open gauge")
+        for portal_url in sorted(circuits):
+            is_open = 0 if circuits[portal_url]["state"] == "closed" else 1
+            lines.append(f"nextbot_circuit_open{format_labels((('portal', portal_url),))} {is_open}")
+        lines.append("# HELP nextbot_circuit_rejected_total Запросы, отклоненные предохранителем без обращения к порталу")
+        lines.append("# TYPE nextbot_circuit_rejected_total counter")
+        for portal_url in sorted(circuits):
+            rejected = circuits[portal_url].get("rejected", 0)
+            lines.append(f"nextbot_circuit_rejected_total{format_labels((('portal', portal_url),))} {rejected}")
+    return lines
+
+
+def response_size(response, stream=False):
+    """Размер тела ответа в байтах; для потокового ответа берется из заголовка Content-Length."""
+    if stream:
+        # Потоковый ответ нельзя читать целиком, размер берем из заголовка
+        return int(response.headers.get("Content-Length") or 0) or None
+    return len(response.content or b"")
+
+
+class InstrumentedRequests:
+    """Обертка над модулем requests, которая замеряет каждый вызов."""
+
+    def __init__(self, requests_module, metrics):
+        self.requests_module = requests_module
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.requests_module, name)
+
+    def call(self, function, url, kwargs):
+        method = b24_method_from_url(url)
+        started = time.perf_counter()
+        try:
+            response = function(url, **kwargs)
+        except self.requests_module.exceptions.Timeout:
+            self.metrics.observe_b24_call(method, time.perf_counter() - started, "timeout")
+            raise
+        except Exception:
+            self.metrics.observe_b24_call(method, time.perf_counter() - started, "network_error")
+            raise
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 500:
+            outcome = "server_error"
+        elif response.status_code >= 400:
+            outcome = "client_error"
+        else:
+            outcome = "ok"
+        self.metrics.observe_b24_call(method, elapsed, outcome, response_size(response, kwargs.get("stream")))
+        return response
+
+    def post(self, url, **kwargs):
+        return self.call(self.requests_module.post, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.call(self.requests_module.get, url, kwargs)
+
+
+def serve_metrics(metrics, store=None, host="127.0.0.1", port=9108):
+    """Запускает HTTP-сервер с метриками по адресу /metrics в фоновом потоке."""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render(store).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,426 @@
+"""
+Локальный мок Bitrix24 и опубликованной Google Таблицы для нагрузочных прогонов.
+
+Один HTTP-сервер обслуживает несколько порталов: вебхук портала N имеет вид
+http://127.0.0.1:<port>/portalN/rest/1/secretN/, а таблица с вебхуками
+пользователей отдается по адресу /sheet.csv. Данные порталов живут в памяти,
+задержку ответа можно задать (в том числе отдельно для портала в
+portal_latency), счетчики запросов ведутся по порталам и методам. При
+multi_portal_every=N каждый N-й пользователь работает еще и на следующем портале.
+"""
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+PROJECT_NAMES = (
+    "Маркетинг", "Разработка сайта", "Мобильное приложение", "Продажи", "Поддержка клиентов",
+    "Бухгалтерия", "Кадры", "Логистика", "Закупки", "Аналитика",
+)
+TASK_VERBS = ("Подготовить", "Согласовать", "Проверить", "Обновить", "Отправить", "Собрать", "Написать", "Запустить")
+TASK_OBJECTS = (
+    "презентацию", "отчет", "договор", "макет", "рассылку", "бюджет", "план", "счет",
+    "лендинг", "инструкцию", "смету", "релиз", "опрос", "баннер", "регламент",
+)
+TASK_DETAILS = ("для клиента", "по проекту", "на квартал", "для отдела", "к встрече", "по продажам", "на сайт", "")
+FIRST_NAMES = ("Иван", "Анна", "Петр", "Мария", "Олег", "Елена", "Сергей", "Ольга")
+LAST_NAMES = ("Петров", "Смирнова", "Иванов", "Кузнецова", "Соколов", "Попова", "Лебедев", "Новикова")
+
+# Поля фильтра/select Bitrix24 и ключи задачи в ответе tasks.task.*
+TASK_FIELD_KEYS = {
+    "ID": "id", "TITLE": "title", "DESCRIPTION": "description", "RESPONSIBLE_ID": "responsibleId",
+    "GROUP_ID": "groupId", "STATUS": "status", "DEADLINE": "deadline", "PRIORITY": "priority",
+    "CREATED_BY": "createdBy", "PARENT_ID": "parentId",
+}
+
+
+def project_record(record, select, key_map=None):
+    """Оставляет в записи только поля из select (как делает портал); ID возвращается всегда."""
+    if not select:
+        return dict(record)
+    wanted = {"ID"}
+    wanted.update(select)
+    if key_map is not None:
+        wanted = {key_map.get(field, field.lower()) for field in wanted}
+    return {key: value for key, value in record.items() if key in wanted}
+
+
+def unflatten_query(pairs):
+    """Собирает пары fields[TITLE]=... из строки запроса команды batch во вложенные параметры."""
+    params = {}
+    for name, value in pairs:
+        keys = [name.split("[")[0]] + re.findall(r"\[([^\]]*)\]", name)
+        target = params
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return lists_from_indexes(params)
+
+
+def lists_from_indexes(value):
+    """Превращает словари с ключами 0, 1, 2... в списки (select[0]=ID -> ["ID"])."""
+    if not isinstance(value, dict):
+        return value
+    value = {key: lists_from_indexes(item) for key, item in value.items()}
+    if value and all(key.isdigit() for key in value):
+        return [value[key] for key in sorted(value, key=int)]
+    return value
+
+
+def make_task_title(rng):
+    """Случайное название задачи из словаря мока."""
+    title = f"{rng.choice(TASK_VERBS)} {rng.choice(TASK_OBJECTS)} {rng.choice(TASK_DETAILS)}"
+    return title.strip()
+
+
+class PortalState:
+    """Данные одного мок-портала в памяти."""
+
+    def __init__(self, rng, tasks_count, users_count):
+        self.lock = threading.Lock()
+        self.users = []
+        for index in range(users_count):
+            user_id = str(index + 1)
+            self.users.append({
+                "ID": user_id,
+                "ACTIVE": True,
+                "NAME": FIRST_NAMES[index % len(FIRST_NAMES)],
+                "LAST_NAME": LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)],
+                "SECOND_NAME": "",
+                "EMAIL": f"user{user_id}@example.com",
+                "LAST_LOGIN": "2026-03-01T09:00:00+03:00",
+                "DATE_REGISTER": "2024-01-15T00:00:00+03:00",
+                "PERSONAL_GENDER": "",
+                "PERSONAL_PHOTO": f"https://cdn.example.com/main/avatar/{user_id}.png",
+                "PERSONAL_MOBILE": f"+7900000{int(user_id):04d}",
+                "PERSONAL_CITY": "Москва",
+                "WORK_POSITION": "Менеджер проектов",
+                "WORK_PHONE": "",
+                "UF_DEPARTMENT": [1],
+                "UF_EMPLOYMENT_DATE": "",
+                "TIME_ZONE": "Europe/Moscow",
+                "USER_TYPE": "employee",
+            })
+        self.groups = []
+        for index, name in enumerate(PROJECT_NAMES):
+            self.groups.append({
+                "ID": str(index + 1),
+                "NAME": name,
+                "DESCRIPTION": f"Рабочая группа «{name}»",
+                "DATE_CREATE": "2025-01-10T12:00:00+03:00",
+                "DATE_UPDATE": "2026-02-01T12:00:00+03:00",
+                "DATE_ACTIVITY": "2026-03-01T12:00:00+03:00",
+                "ACTIVE": "Y",
+                "VISIBLE": "Y",
+                "OPENED": "Y",
+                "CLOSED": "N",
+                "SUBJECT_ID": "1",
+                "SUBJECT_NAME": "Рабочие группы",
+                "OWNER_ID": "1",
+                "KEYWORDS": "",
+                "NUMBER_OF_MEMBERS": "5",
+                "INITIATE_PERMS": "E",
+                "PROJECT": "Y",
+                "IS_EXTRANET": "N",
+            })
+        self.tasks = {}
+        self.next_task_id = 1
+        self.checklist_items = {}
+        for _ in range(tasks_count):
+            self.add_task({
+                "TITLE": make_task_title(rng),
+                "DESCRIPTION": "Описание задачи " * rng.randint(1, 20),
+                "RESPONSIBLE_ID": rng.choice(self.users)["ID"],
+                "GROUP_ID": rng.choice(self.groups + [{"ID": "0"}])["ID"],
+                "STATUS": str(rng.choice((2, 2, 3, 3, 4, 5, 6))),
+                "DEADLINE": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T18:00:00+03:00",
+            })
+
+    def add_task(self, fields):
+        task_id = str(self.next_task_id)
+        self.next_task_id += 1
+        task = {
+            "id": task_id,
+            "title": str(fields.get("TITLE", "")),
+            "description": str(fields.get("DESCRIPTION", "")),
+            "responsibleId": str(fields.get("RESPONSIBLE_ID", "1")),
+            "groupId": str(fields.get("GROUP_ID", "0")),
+            "status": str(fields.get("STATUS", "2")),
+            "deadline": fields.get("DEADLINE"),
+            "priority": str(fields.get("PRIORITY", "1")),
+            "parentId": str(fields.get("PARENT_ID", "0")),
+            "createdBy": "1",
+            "createdDate": "2026-03-01T09:00:00+03:00",
+            "changedDate": "2026-03-01T09:00:00+03:00",
+            "closedDate": None,
+            "timeEstimate": "0",
+            "allowChangeDeadline": "Y",
+            "taskControl": "N",
+            "multitask": "N",
+            "mark": None,
+            "commentsCount": "0",
+            "favorite": "N",
+            "siteId": "s1",
+            "creator": {"id": "1", "name": "Иван Петров", "link": "/company/personal/user/1/",
+                        "icon": "https://cdn.example.com/main/avatar/1.png"},
+        }
+        self.tasks[task_id] = task
+        return task
+
+    def update_task(self, task_id, fields):
+        task = self.tasks.get(str(task_id))
+        if task is None:
+            return None
+        for field, key in TASK_FIELD_KEYS.items():
+            if field in ("ID", "CREATED_BY"):
+                continue
+            if field in fields:
+                task[key] = str(fields[field]) if fields[field] is not None else None
+        return task
+
+    def list_tasks(self, task_filter, select):
+        tasks = []
+        for task in self.tasks.values():
+            if "!STATUS" in task_filter and task["status"] == str(task_filter["!STATUS"]):
+                continue
+            if "GROUP_ID" in task_filter and task["groupId"] != str(task_filter["GROUP_ID"]):
+                continue
+            if "STATUS" in task_filter and task["status"] != str(task_filter["STATUS"]):
+                continue
+            if ">=DEADLINE" in task_filter:
+                deadline = (task["deadline"] or "").replace("T", " ")[:19]
+                if not deadline or deadline < task_filter[">=DEADLINE"] or deadline > task_filter.get("<=DEADLINE", "9999"):
+                    continue
+            if "<DEADLINE" in task_filter:
+                deadline = (task["deadline"] or "").replace("T", " ")[:19]
+                if not deadline or deadline >= task_filter["<DEADLINE"]:
+                    continue
+            tasks.append(task)
+        return [project_record(task, select, TASK_FIELD_KEYS) for task in tasks]
+
+    def batch(self, params):
+        """Метод batch: команды выполняются по порядку, $result[ключ][...] ссылается на прежние результаты."""
+        results = {}
+        errors = {}
+        totals = {}
+
+        def substitute(match):
+            value = results.get(match.group(1))
+            for key in re.findall(r"\[([^\]]*)\]", match.group(2)):
+                if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                    value = value[int(key)]
+                elif isinstance(value, dict):
+                    value = value.get(key)
+                else:
+                    value = None
+            return urllib.parse.quote("" if value is None else str(value))
+
+        for key, command in (params.get("cmd") or {}).items():
+            command = re.sub(r"\$result\[([^\]]+)\]((?:\[[^\]]*\])*)", substitute, command)
+            method, _, query = command.partition("?")
+            body = self.call(method, unflatten_query(urllib.parse.parse_qsl(query, keep_blank_values=True)))
+            if body is None:
+                errors[key] = {"error": "ERROR_METHOD_NOT_FOUND", "error_description": f"Метод {method} не найден"}
+            elif "error" in body:
+                errors[key] = body
+            else:
+                results[key] = body["result"]
+                if "total" in body:
+                    totals[key] = body["total"]
+            if key in errors and str(params.get("halt", 0)) not in ("0", "false", "False"):
+                break
+        return {"result": {"result": results, "result_error": errors, "result_total": totals, "result_next": {}}}
+
+    def call(self, method, params):
+        """Выполняет метод REST и возвращает тело ответа."""
+        params = params or {}
+        if method == "batch":
+            return self.batch(params)
+        with self.lock:
+            if method == "sonet_group.get":
+                groups = [project_record(group, params.get("SELECT")) for group in self.groups]
+                return {"result": groups, "total": len(groups)}
+            if method == "sonet_group.create":
+                fields = params.get("fields", {})
+                name = str(fields.get("NAME", "")).strip().lower()
+                if any(group["NAME"].strip().lower() == name for group in self.groups):
+                    return {"error": "ERROR_CORE", "error_description": "Группа с таким названием уже существует"}
+                group_id = str(len(self.groups) + 1)
+                self.groups.append({"ID": group_id, "NAME": fields.get("NAME", "")})
+                return {"result": int(group_id)}
+            if method == "tasks.task.list":
+                tasks = self.list_tasks(params.get("filter", {}), params.get("select"))
+                start = int(params.get("start", 0) or 0)
+                page = tasks[start:start + 50]
+                body = {"result": {"tasks": page}, "total": len(tasks)}
+                if start + 50 < len(tasks):
+                    body["next"] = start + 50
+                return body
+            if method == "tasks.task.add":
+                if not str(params.get("fields", {}).get("TITLE", "")).strip():
+                    return {"error": "ERROR_CORE", "error_description": "Не указано название задачи"}
+                task = self.add_task(params.get("fields", {}))
+                return {"result": {"task": project_record(task, params.get("select"), TASK_FIELD_KEYS)}}
+            if method == "tasks.task.update":
+                task = self.update_task(params.get("taskId"), params.get("fields", {}))
+                if task is None:
+                    return {"error": "ERROR_CORE", "error_description": "Задача не найдена"}
+                return {"result": {"task": project_record(task, params.get("select"), TASK_FIELD_KEYS)}}
+            if method == "task.checklistitem.add":
+                task_id = str(params.get("TASKID", ""))
+                if task_id not in self.tasks:
+                    return {"error": "ERROR_CORE", "error_description": "Задача не найдена"}
+                item_id = sum(len(items) for items in self.checklist_items.values()) + 1
+                title = str(params.get("FIELDS", {}).get("TITLE", ""))
+                self.checklist_items.setdefault(task_id, []).append({"ID": str(item_id), "TITLE": title})
+                return {"result": item_id}
+            if method == "tasks.task.delete":
+                removed = self.tasks.pop(str(params.get("taskId")), None)
+                if removed is None:
+                    return {"error": "ERROR_CORE", "error_description": "Задача не найдена"}
+                return {"result": True}
+            select = params.get("SELECT")
+            if method == "user.get":
+                user_id = params.get("ID") or params.get("FILTER", {}).get("ID")
+                users = self.users
+                if user_id:
+                    users = [user for user in self.users if user["ID"] == str(user_id)]
+                start = int(params.get("start", 0) or 0)
+                body = {"result": [project_record(user, select) for user in users[start:start + 50]], "total": len(users)}
+                if start + 50 < len(users):
+                    body["next"] = start + 50
+                return body
+            if method == "user.search":
+                needle = str(params.get("FILTER", {}).get("FIND", "")).lower()
+                found = [project_record(user, select) for user in self.users
+                         if needle and (needle in user["NAME"].lower() or needle in user["LAST_NAME"].lower())]
+                return {"result": found}
+            if method == "user.current":
+                return {"result": project_record(self.users[0], select)}
+        return None
+
+
+class MockPortalServer:
+    """HTTP-сервер с несколькими мок-порталами и таблицей вебхуков."""
+
+    def __init__(self, portals=3, users=50, tasks_per_portal=300, latency_ms=0, seed=1, host="127.0.0.1", port=0,
+                 multi_portal_every=0):
+        self.rng = random.Random(seed)
+        self.latency = latency_ms / 1000.0
+        self.portal_latency = {}
+        self.multi_portal_every = multi_portal_every
+        self.portals = [PortalState(self.rng, tasks_per_portal, 20) for _ in range(portals)]
+        self.user_names = [f"user{index}" for index in range(users)]
+        self.counts_lock = threading.Lock()
+        self.request_counts = {}
+        self.server = http.server.ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def sheet_url(self):
+        return f"{self.base_url}/sheet.csv"
+
+    def webhook_for_portal(self, portal_index):
+        return f"{self.base_url}/portal{portal_index}/rest/1/secret{portal_index}/"
+
+    def portal_of_user(self, user_name):
+        return self.user_names.index(user_name) % len(self.portals)
+
+    def portals_of_user(self, user_name):
+        """Порталы пользователя, основной первым."""
+        portal_index = self.portal_of_user(user_name)
+        user_portals = [portal_index]
+        if (self.multi_portal_every and len(self.portals) > 1
+                and self.user_names.index(user_name) % self.multi_portal_every == 0):
+            user_portals.append((portal_index + 1) % len(self.portals))
+        return user_portals
+
+    def sheet_csv(self):
+        rows = []
+        for name in self.user_names:
+            for portal_index in self.portals_of_user(name):
+                rows.append(f"{name},{self.webhook_for_portal(portal_index)}")
+        return "\n".join(rows) + "\n"
+
+    def count_request(self, portal, method):
+        with self.counts_lock:
+            key = (portal, method)
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self.counts_lock:
+            self.request_counts = {}
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_body(self, status, body, content_type="application/json; charset=utf-8"):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if self.path.split("?")[0] == "/sheet.csv":
+                    mock.count_request("sheets", "sheets.csv")
+                    self.send_body(200, mock.sheet_csv(), "text/csv; charset=utf-8")
+                else:
+                    self.send_body(404, "{}")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                parts = self.path.strip("/").split("/")
+                if len(parts) < 5 or not parts[0].startswith("portal") or parts[1] != "rest":
+                    self.send_body(404, "{}")
+                    return
+                portal_index = int(parts[0][len("portal"):])
+                latency = mock.portal_latency.get(portal_index, mock.latency)
+                if latency:
+                    time.sleep(latency)
+                method = parts[4].split("?")[0]
+                if method.endswith(".json"):
+                    method = method[:-len(".json")]
+                mock.count_request(parts[0], method)
+                try:
+                    params = json.loads(raw) if raw else {}
+                except ValueError:
+                    params = {}
+                if portal_index >= len(mock.portals):
+                    self.send_body(404, "{}")
+                    return
+                body = mock.portals[portal_index].call(method, params)
+                if body is None:
+                    self.send_body(400, json.dumps({"error": "ERROR_METHOD_NOT_FOUND"}))
+                else:
+                    self.send_body(200, json.dumps(body, ensure_ascii=False))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-portal", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,155 @@
+"""
+Отчет об объеме ответов Bitrix24 на одну команду NextBot.
+
+Один и тот же поток команд выполняется против свежего мока Bitrix24
+(mock_portal.MockPortalServer), каждая команда — с пустым CACHE_STORE, как
+при запуске на платформе. Считаются байты всех ответов портала и таблицы
+вебхуков по командам и методам REST.
+
+Чтобы сравнить «до» и «после» изменения проекций полей, укажите каталог
+со скриптами предыдущей версии, например из git worktree:
+
+    git worktree add /tmp/nextbot-base HEAD~1
+    python -m nextbot_runner.payloads --baseline /tmp/nextbot-base/nextbot_functions
+"""
+import argparse
+import json
+import threading
+import time
+
+from .loadgen import SheetRedirectRequests, synthetic_trace
+from .metrics import b24_method_from_url, response_size
+from .mock_portal import MockPortalServer
+from .runner import ScriptRunner
+
+
+class PayloadMeter:
+    """Обертка над requests, считающая байты ответов по командам и методам."""
+
+    def __init__(self, requests_module):
+        self.requests_module = requests_module
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def __getattr__(self, name):
+        return getattr(self.requests_module, name)
+
+    def call(self, function, url, kwargs):
+        response = function(url, **kwargs)
+        size = response_size(response, kwargs.get("stream")) or 0
+        key = (getattr(self.local, "command", "-"), b24_method_from_url(url))
+        with self.lock:
+            totals = self.methods.setdefault(key, {"calls": 0, "bytes": 0})
+            totals["calls"] += 1
+            totals["bytes"] += size
+        return response
+
+    def post(self, url, **kwargs):
+        return self.call(self.requests_module.post, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.call(self.requests_module.get, url, kwargs)
+
+
+def measure_payloads(trace, requests_module, scripts_dir=None, users=10, tasks_per_portal=300, seed=1):
+    """
+    Выполняет трассу по одной команде и возвращает байты ответов на вызов команды.
+    Мок создается заново с тем же seed, поэтому разные версии скриптов видят одни и те же данные.
+    """
+    mock = MockPortalServer(portals=1, users=users, tasks_per_portal=tasks_per_portal, seed=seed).start()
+    try:
+        meter = PayloadMeter(SheetRedirectRequests(requests_module, mock.sheet_url))
+        commands = {}
+        for item in trace:
+            command = item["command"]
+            meter.local.command = command
+            runner = ScriptRunner(requests_module=meter, scripts_dir=scripts_dir)
+            started = time.perf_counter()
+            runner.run(command, dict(item["args"]))
+            stats = commands.setdefault(command, {"invocations": 0, "seconds": 0.0})
+            stats["invocations"] += 1
+            stats["seconds"] += time.perf_counter() - started
+    finally:
+        mock.stop()
+
+    report = {}
+    for command, stats in commands.items():
+        methods = {}
+        total_bytes = 0
+        for key, totals in meter.methods.items():
+            if key[0] == command:
+                methods[key[1]] = round(totals["bytes"] / stats["invocations"])
+                total_bytes += totals["bytes"]
+        report[command] = {
+            "invocations": stats["invocations"],
+            "bytes_per_call": round(total_bytes / stats["invocations"]),
+            "ms_per_call": round(stats["seconds"] * 1000 / stats["invocations"], 2),
+            "methods": methods,
+        }
+    return report
+
+
+def change_percent(before, after):
+    if not before:
+        return 0.0
+    return round((after - before) * 100.0 / before, 1)
+
+
+def format_payload_report(current, baseline=None):
+    """Текстовое представление отчета; при наличии baseline — сравнение «до/после»."""
+    lines = []
+    if baseline is None:
+        lines.append(f"{'команда':<16}{'вызовов':>9}{'байт/вызов':>12}{'мс/вызов':>10}")
+        for command in sorted(current):
+            stats = current[command]
+            lines.append(f"{command:<16}{stats['invocations']:>9}{stats['bytes_per_call']:>12}{stats['ms_per_call']:>10}")
+        return "\n".join(lines)
+
+    lines.append(f"{'команда / метод':<34}{'до, байт':>11}{'после, байт':>13}{'изм.':>9}")
+    for command in sorted(set(current) | set(baseline)):
+        before = baseline.get(command, {"bytes_per_call": 0, "methods": {}})
+        after = current.get(command, {"bytes_per_call": 0, "methods": {}})
+        lines.append(
+            f"{command:<34}{before['bytes_per_call']:>11}{after['bytes_per_call']:>13}"
+            f"{change_percent(before['bytes_per_call'], after['bytes_per_call']):>8}%"
+        )
+        for method in sorted(set(before["methods"]) | set(after["methods"])):
+            method_before = before["methods"].get(method, 0)
+            method_after = after["methods"].get(method, 0)
+            lines.append(
+                f"  {method:<32}{method_before:>11}{method_after:>13}"
+                f"{change_percent(method_before, method_after):>8}%"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Байты ответов Bitrix24 на одну команду NextBot.")
+    parser.add_argument("--ops", type=int, default=200, help="число синтетических команд")
+    parser.add_argument("--users", type=int, default=10, help="число пользователей в таблице вебхуков")
+    parser.add_argument("--tasks", type=int, default=300, help="задач на портале")
+    parser.add_argument("--baseline", help="каталог со скриптами предыдущей версии для сравнения")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    options = parser.parse_args(argv)
+
+    import requests
+
+    user_names = [f"user{index}" for index in range(options.users)]
+    trace = synthetic_trace(options.ops, user_names, seed=options.seed)
+    current = measure_payloads(trace, requests, users=options.users, tasks_per_portal=options.tasks, seed=options.seed)
+    baseline = None
+    if options.baseline:
+        baseline = measure_payloads(trace, requests, scripts_dir=options.baseline, users=options.users,
+                                    tasks_per_portal=options.tasks, seed=options.seed)
+
+    if options.json:
+        print(json.dumps({"current": current, "baseline": baseline}, ensure_ascii=False, indent=2))
+    else:
+        print(format_payload_report(current, baseline))
+    return {"current": current, "baseline": baseline}
+
+
+if __name__ == "__main__":
+    main()
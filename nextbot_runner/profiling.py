@@ -0,0 +1,130 @@
+"""
+Профилирование отдельного вызова команды NextBot.
+
+Включается аргументом {"profile": true} в args или переменной окружения
+NEXTBOT_PROFILE=1; каталог отчетов задает NEXTBOT_PROFILE_DIR (по умолчанию
+./profiles). На каждый вызов пишутся два файла с именем <команда>-<время>:
+
+* .collapsed — свернутые стеки семплирующего профилировщика (формат
+  flamegraph.pl / speedscope). Семплируется стек по стенному времени, поэтому
+  ожидание сети видно как стеки внутри requests/socket, а работа Python —
+  как стеки внутри функций скрипта;
+* .alloc.txt — итог по времени (стенное и процессорное) и top-N мест
+  выделения памяти по данным tracemalloc.
+
+Пока профилирование выключено, раннер не вызывает этот модуль вовсе.
+
+tracemalloc глобален для процесса, поэтому одновременно профилируется одна
+команда. Явный запрос {"profile": true} ждет своей очереди, а в режиме
+NEXTBOT_PROFILE=1 команда, заставшая профилировщик занятым, выполняется без
+профилирования: остальные команды не выстраиваются в очередь за одной блокировкой
+(их выделения памяти в это время попадают и в отчет tracemalloc профилируемой).
+"""
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_INTERVAL = 0.001
+DEFAULT_TOP_N = 25
+
+logger = logging.getLogger("nextbot_runner")
+
+# tracemalloc глобален для процесса, поэтому профилируемые вызовы идут по одному
+profile_lock = threading.Lock()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Периодически снимает стек указанного потока и считает одинаковые стеки."""
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name="stack-sampler", daemon=True)
+
+    def loop(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+
+
+def report_path(output_dir, command, suffix):
+    now = datetime.datetime.now()
+    return os.path.join(output_dir, f"{command}-{now:%Y%m%d-%H%M%S-%f}{suffix}")
+
+
+def profile_call(function, command, output_dir, top_n=DEFAULT_TOP_N, interval=DEFAULT_INTERVAL, wait=True):
+    """
+    Выполняет function() под профилировщиком и пишет отчеты в output_dir.
+    С wait=False вызов, заставший другой профилируемый вызов, выполняется без профилирования.
+    """
+    if not profile_lock.acquire(blocking=wait):
+        logger.debug("Профилировщик занят, команда %s выполняется без профилирования", command)
+        return function()
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        sampler = StackSampler(threading.get_ident(), interval)
+        tracemalloc.start(25)
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        sampler.start()
+        try:
+            return function()
+        finally:
+            sampler.stop()
+            cpu_seconds = time.thread_time() - cpu_started
+            wall_seconds = time.perf_counter() - wall_started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            base_path = report_path(output_dir, command, "")
+            with open(base_path + ".collapsed", "w", encoding="utf-8") as output:
+                output.write(sampler.collapsed())
+
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ))
+            lines = [
+                f"Команда: {command}",
+                f"Стенное время: {wall_seconds * 1000:.1f} мс",
+                f"Процессорное время потока: {cpu_seconds * 1000:.1f} мс "
+                f"(ожидание ввода-вывода ~{max(wall_seconds - cpu_seconds, 0) * 1000:.1f} мс)",
+                f"Пик выделенной памяти: {peak / 1024:.1f} КиБ",
+                "",
+                f"Top-{top_n} мест выделения памяти:",
+            ]
+            for index, stat in enumerate(snapshot.statistics("lineno")[:top_n], 1):
+                frame = stat.traceback[0]
+                lines.append(f"{index:>3}. {frame.filename}:{frame.lineno}  {stat.size / 1024:.1f} КиБ в {stat.count} блоках")
+            with open(base_path + ".alloc.txt", "w", encoding="utf-8") as output:
+                output.write("\n".join(lines) + "\n")
+    finally:
+        profile_lock.release()
@@ -0,0 +1,217 @@
+"""
+Локальный резидентный запуск скриптов NextBot.
+
+Скрипт исполняется так же, как на платформе: в его пространство имен
+подставляются requests, json, re, datetime, debug и args, а результат
+читается из переменной result. Дополнительно подставляется общий словарь
+CACHE_STORE, поэтому кеши скриптов живут между вызовами и видны всем командам.
+Хранилище вебхуков (credentials.CredentialStore), переданное раннеру,
+подставляется в тот же словарь вместо загрузки Google Таблицы, а функция
+PARALLEL_MAP позволяет скрипту опросить несколько порталов параллельно.
+Если задан каталог выгрузок (export_dir или NEXTBOT_EXPORT_DIR), подставляется
+EXPORT_OPEN: show_task пишет выгрузку в файл только внутри этого каталога.
+"""
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .metrics import InstrumentedRequests, command_outcome
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nextbot_functions")
+PARALLEL_MAP_WORKERS = 16
+COMMANDS = ("add_new_task", "update_task", "delete_task", "show_task", "create_project", "batch_tasks")
+
+logger = logging.getLogger("nextbot_runner")
+
+
+# Строки журнала скриптов имеют вид "[ID вызова] УРОВЕНЬ сообщение"
+SCRIPT_LOG_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+
+
+def debug(message):
+    """Аналог функции debug() платформы NextBot; строки журнала скриптов пишутся со своим уровнем."""
+    parts = message.split(" ", 2)
+    level = logging.DEBUG
+    if len(parts) == 3 and parts[0].startswith("["):
+        level = SCRIPT_LOG_LEVELS.get(parts[1], logging.DEBUG)
+    logger.log(level, message)
+
+
+def script_log_level():
+    """Уровень журнала скриптов (LOG_LEVEL) по настройке логгера: отключенные сообщения скрипт не форматирует."""
+    effective = logger.getEffectiveLevel()
+    for name in ("debug", "info", "warning"):
+        if effective <= SCRIPT_LOG_LEVELS[name.upper()]:
+            return name
+    return "error"
+
+
+class ScriptRunner:
+    """Исполняет команды NextBot в одном процессе с общим хранилищем кешей."""
+
+    def __init__(self, requests_module=None, store=None, metrics=None, scripts_dir=None, credentials=None,
+                 export_dir=None):
+        if requests_module is None:
+            import requests as requests_module
+        self.metrics = metrics
+        if metrics is not None:
+            requests_module = InstrumentedRequests(requests_module, metrics)
+        self.requests = requests_module
+        self.store = {} if store is None else store
+        self.scripts_dir = scripts_dir or SCRIPTS_DIR
+        if credentials is not None:
+            # Вебхуки ищутся в локальном хранилище, Google Таблица не читается
+            credentials.install(self.store)
+        self.export_dir = export_dir or os.environ.get("NEXTBOT_EXPORT_DIR") or None
+        self.profile_all = os.environ.get("NEXTBOT_PROFILE", "") not in ("", "0")
+        self.profile_dir = os.environ.get("NEXTBOT_PROFILE_DIR", "profiles")
+        self.code_cache = {}
+        self.parallel_executor = None
+        self.parallel_lock = threading.Lock()
+        self.refresh_thread = None
+        self.stop_event = threading.Event()
+
+    def compile_script(self, command):
+        """Компилирует скрипт команды один раз за время жизни процесса."""
+        if command not in COMMANDS:
+            raise ValueError(f"Неизвестная команда: {command}")
+        code = self.code_cache.get(command)
+        if code is None:
+            path = os.path.join(self.scripts_dir, f"{command}.py")
+            with open(path, encoding="utf-8") as source:
+                code = compile(source.read(), path, "exec")
+            self.code_cache[command] = code
+        return code
+
+    def run(self, command, args):
+        """
+        Выполняет команду с аргументами NextBot и возвращает значение result.
+        Аргумент {"profile": true} (или NEXTBOT_PROFILE=1) включает профилирование вызова.
+        """
+        profile = self.profile_all
+        requested = False
+        if "profile" in args:
+            args = dict(args)
+            requested = bool(args.pop("profile"))
+            profile = requested or profile
+        namespace = {
+            "__name__": f"nextbot_{command}",
+            "requests": self.requests,
+            "json": json,
+            "re": re,
+            "datetime": datetime,
+            "debug": debug,
+            "LOG_LEVEL": script_log_level(),
+            "args": args,
+            "CACHE_STORE": self.store,
+            "PARALLEL_MAP": self.parallel_map,
+            "EXPORT_OPEN": self.open_export_file if self.export_dir else None,
+        }
+        code = self.compile_script(command)
+        if profile:
+            from .profiling import profile_call
+            # Явный запрос ждет профилировщика; в режиме NEXTBOT_PROFILE=1 занятый профилировщик пропускается
+            return profile_call(lambda: self.execute(command, code, namespace), command, self.profile_dir,
+                                wait=requested)
+        return self.execute(command, code, namespace)
+
+    def parallel_map(self, function, calls, timeout):
+        """
+        Вызывает function(*arguments) для каждого списка аргументов в отдельном потоке.
+        Возвращает результаты в порядке calls; вызов, не завершившийся за timeout
+        секунд или упавший с исключением, представлен значением None.
+        """
+        with self.parallel_lock:
+            if self.parallel_executor is None:
+                self.parallel_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=PARALLEL_MAP_WORKERS, thread_name_prefix="nextbot-portal")
+        futures = [self.parallel_executor.submit(function, *arguments) for arguments in calls]
+        concurrent.futures.wait(futures, timeout=timeout)
+        results = []
+        for future in futures:
+            if not future.done():
+                # Отставший вызов дорабатывает в фоне, его результат не ждем
+                results.append(None)
+            elif future.exception() is not None:
+                logger.warning("Параллельный вызов завершился ошибкой: %s", future.exception())
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
+
+    def open_export_file(self, file_name, append=False):
+        """
+        Открывает файл выгрузки show_task в каталоге export_dir (EXPORT_OPEN скриптов).
+        Принимается только имя файла: имя с '/', '\\' или '..', а также путь, который
+        после разрешения ссылок оказывается вне каталога, отклоняются с ValueError.
+        """
+        if not self.export_dir:
+            raise ValueError("каталог выгрузок не настроен")
+        if not isinstance(file_name, str) or not file_name.strip() or any(
+                part in file_name for part in ("/", "\\", "..", "\x00")):
+            raise ValueError(f"недопустимое имя файла выгрузки: {file_name!r}")
+        root = os.path.realpath(self.export_dir)
+        path = os.path.realpath(os.path.join(root, file_name))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"файл выгрузки вне каталога {root}: {file_name!r}")
+        os.makedirs(root, exist_ok=True)
+        return open(path, "a" if append else "w", encoding="utf-8", newline="")
+
+    def execute(self, command, code, namespace):
+        """Исполняет скомпилированный скрипт, при необходимости замеряя его для метрик."""
+        if self.metrics is None:
+            exec(code, namespace)
+            return namespace.get("result")
+
+        started = time.perf_counter()
+        try:
+            exec(code, namespace)
+        except Exception:
+            self.metrics.observe_command(command, time.perf_counter() - started, "exception")
+            raise
+        result = namespace.get("result")
+        self.metrics.observe_command(command, time.perf_counter() - started, command_outcome(result))
+        return result
+
+    def refresh_stale_listings(self):
+        """Разбирает очередь фонового обновления кеша show_task."""
+        pending = self.store.get("show_task_refresh", {})
+        refreshed = 0
+        for cache_key in list(pending):
+            refresh_args = pending.pop(cache_key, None)
+            if refresh_args is None:
+                continue
+            try:
+                self.run("show_task", refresh_args)
+                refreshed += 1
+            except Exception as e:
+                logger.warning("Фоновое обновление '%s' не удалось: %s", cache_key, e)
+        return refreshed
+
+    def start_refresh_worker(self, interval=1.0):
+        """Запускает фоновый поток, обновляющий устаревшие списки задач."""
+        if self.refresh_thread is not None:
+            return self.refresh_thread
+
+        def loop():
+            while not self.stop_event.wait(interval):
+                self.refresh_stale_listings()
+
+        self.refresh_thread = threading.Thread(target=loop, name="show-task-refresh", daemon=True)
+        self.refresh_thread.start()
+        return self.refresh_thread
+
+    def stop(self):
+        """Останавливает фоновый поток обновления."""
+        self.stop_event.set()
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+            self.refresh_thread = None
+        if self.parallel_executor is not None:
+            self.parallel_executor.shutdown(wait=False)
+            self.parallel_executor = None